@@ -0,0 +1,343 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scripts.date_extractor import extract_date_parts, join_date_parts
+from src.context_builder import ContextBuilder
+from src.driver import PROMPTS
+from src.indexing import article_units, build_document, create_index
+from src.ingest import parallel_ingest
+from src.local_engine import LocalSearchEngine
+from src.query import build_search_bodies, embed_prompt, fuse_hits, hydrate_hits, index_metadata
+from src.text import analyze
+
+STAGES = (
+    "date_extraction", "embed_prompt", "query_build", "lexical_search", "knn_search",
+    "rrf_merge", "hydrate", "rerank", "context_build",
+)
+
+# Vocabulary of the synthetic corpus, news-like Turkish words
+VOCABULARY = (
+    "asgari ücret zam erdoğan öğretmen atama sendika müfredat bakanlık elektrikli araç teşvik kira artış hükümet "
+    "önlem aşı sağlık bakanı istanbul metro proje emeklilik vergi şirket üniversite sınav ekonomi enflasyon "
+    "merkez bankası faiz dolar borsa ihracat ithalat tarım deprem afet belediye seçim meclis yasa teklif "
+    "mahkeme karar futbol maç kulüp transfer iklim enerji doğalgaz petrol turizm otel hastane doktor "
+    "eğitim okul öğrenci kredi konut inşaat ulaşım havalimanı tren köprü yatırım istihdam işsizlik"
+).split()
+
+
+class HashingEmbedder:
+    """
+    Deterministic, model-free stand-in for SentenceTransformer: a signed
+    feature-hashing bag of words and character trigrams. Lexically similar
+    texts get similar vectors, which is enough to exercise kNN and fusion.
+    """
+
+    def __init__(self, dims=128):
+        self.dims = dims
+        self.model_name = f"hashing-{dims}"
+
+    def get_sentence_embedding_dimension(self):
+        return self.dims
+
+    def _vector(self, text):
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for token in analyze(text):
+            features = [token] + [token[i:i + 3] for i in range(max(1, len(token) - 2))]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vector[h % self.dims] += 1.0 if h & 0x80000000 else -1.0
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.stack([self._vector(text) for text in texts]) if len(texts) else np.zeros((0, self.dims))
+
+
+class OverlapReranker:
+    """Stand-in for CrossEncoderReranker: scores hits by query token overlap."""
+
+    def __init__(self, top_k=5):
+        self.top_k = top_k
+
+    def rerank_with_metadata(self, prompt, retrievals, top_k=5):
+        query = set(analyze(prompt))
+        scored = []
+        for hit in retrievals:
+            source = hit["_source"]
+            tokens = analyze(f"{source.get('title', '')} {source.get('passage') or source.get('text', '')}")
+            scored.append(dict(hit, rerank_score=len(query.intersection(tokens)) / (len(tokens) or 1)))
+        return sorted(scored, key=lambda hit: hit["rerank_score"], reverse=True)[:min(top_k, self.top_k)]
+
+
+def synthetic_rows(n_docs, seed=0):
+    # MLSUM-shaped rows (title, summary, text, "00/MM/YYYY" date)
+    rng = random.Random(seed)
+    for _ in range(n_docs):
+        def words(n):
+            return " ".join(rng.choice(VOCABULARY) for _ in range(n))
+        yield {
+            "title": words(8).capitalize(),
+            "summary": words(30).capitalize() + ".",
+            "text": ". ".join(words(20).capitalize() for _ in range(rng.randint(10, 30))) + ".",
+            "date": f"00/{rng.randint(1, 12):02d}/{rng.randint(2010, 2019)}",
+        }
+
+
+def build_corpus(es, model, index_name, n_docs, seed=0):
+    create_index(es, index_name, model.get_sentence_embedding_dimension())
+    units = [unit for i, row in enumerate(synthetic_rows(n_docs, seed)) for unit in article_units(row, i)]
+    embeddings = model.encode([text for _, _, text in units], batch_size=256)
+    actions = (
+        build_document(index_name, doc_id, source, embedding.tolist())
+        for (doc_id, source, _), embedding in zip(units, embeddings)
+    )
+    return parallel_ingest(es, actions, index_name=index_name, workers=1)
+
+
+# Same settings as the Streamlit app
+_context_builder = ContextBuilder()
+
+
+def app_context(prompt, hits):
+    # The prompt the Streamlit app sends to the LLM
+    return _context_builder.build(prompt, hits)["prompt"]
+
+
+def run_query(prompt, es, model, reranker, index_name, timings=None):
+    """
+    Runs the serving pipeline for one prompt, stage by stage.
+
+    Args:
+        timings (dict): Stage name -> list of seconds, appended to when given.
+
+    Returns:
+        str: The LLM prompt built from the reranked hits.
+    """
+    def timed(stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        if timings is not None:
+            timings[stage].append(time.perf_counter() - start)
+        return result
+
+    metadata = index_metadata.fetch(es, index_name)
+    timed("date_extraction", lambda: join_date_parts(*extract_date_parts(prompt)))
+    embedding = timed("embed_prompt", embed_prompt, prompt, model, metadata["truncate_dims"])
+    lexical_body, vec_body = timed("query_build", build_search_bodies, prompt, embedding, 10, metadata["properties"])
+    lex_hits = timed("lexical_search", es.search, index=index_name, body=lexical_body)["hits"]["hits"]
+    vec_hits = timed("knn_search", es.search, index=index_name, body=vec_body)["hits"]["hits"]
+    fused = timed("rrf_merge", fuse_hits, lex_hits, vec_hits, metadata["properties"])
+    hits = timed("hydrate", hydrate_hits, es, index_name, fused)
+    reranked = timed("rerank", reranker.rerank_with_metadata, prompt, hits)
+    return timed("context_build", app_context, prompt, reranked)
+
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def bench_stages(prompts, es, model, reranker, index_name, repeats):
+    timings = {stage: [] for stage in STAGES}
+    end_to_end = []
+    for _ in range(repeats):
+        for prompt in prompts:
+            start = time.perf_counter()
+            run_query(prompt, es, model, reranker, index_name, timings)
+            end_to_end.append(time.perf_counter() - start)
+    results = {stage: percentiles(seconds) for stage, seconds in timings.items()}
+    results["end_to_end"] = percentiles(end_to_end)
+    return results
+
+
+def bench_concurrency(prompts, es, model, reranker, index_name, concurrency, requests_per_level):
+    results = {}
+    for workers in concurrency:
+        workload = [prompts[i % len(prompts)] for i in range(requests_per_level)]
+
+        def one(prompt):
+            start = time.perf_counter()
+            run_query(prompt, es, model, reranker, index_name)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = list(pool.map(one, workload))
+        elapsed = time.perf_counter() - start
+        results[str(workers)] = dict(percentiles(latencies), qps=len(workload) / elapsed)
+    return results
+
+
+def median_of_runs(runs):
+    """
+    Folds the results of repeated runs into one: every statistic becomes its
+    median across the runs, and the compared ones (p50, p95, QPS) also get a
+    `<metric>_spread`, the range of the runs relative to their median.
+
+    Args:
+        runs (List[dict]): Per-run results, name (stage or concurrency level) -> statistics.
+
+    Returns:
+        dict: name -> median statistics.
+    """
+    merged = {}
+    for name in runs[0]:
+        stats = {}
+        for metric in runs[0][name]:
+            values = np.array([run[name][metric] for run in runs], dtype=float)
+            stats[metric] = float(np.median(values))
+            if metric in ("p50_ms", "p95_ms", "qps"):
+                stats[f"{metric}_spread"] = float(np.ptp(values) / stats[metric]) if stats[metric] else 0.0
+        stats["n"] = int(sum(run[name]["n"] for run in runs))
+        stats["runs"] = len(runs)
+        merged[name] = stats
+    return merged
+
+
+def compare(current, baseline, tolerance=0.10, min_delta_ms=0.05, qps_tolerance=0.15):
+    """
+    Compares the median stage p50/p95 and QPS with a baseline. The threshold
+    of a metric is its tolerance (`qps_tolerance` for QPS), raised to the
+    spread of the runs measured in either result when that is wider: a
+    median moving less than identical runs differ from each other is noise.
+    Slowdowns smaller than `min_delta_ms` are timer noise on sub-millisecond
+    stages and are ignored.
+
+    Returns:
+        List[str]: Human readable regressions (slower or lower QPS beyond the threshold).
+    """
+    def threshold(stats, base, metric):
+        allowed = qps_tolerance if metric == "qps" else tolerance
+        return max(allowed, stats.get(f"{metric}_spread", 0.0), base.get(f"{metric}_spread", 0.0))
+
+    regressions = []
+    for stage, stats in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            slower = stats[metric] - base[metric]
+            limit = threshold(stats, base, metric)
+            if base[metric] and stats[metric] > base[metric] * (1 + limit) and slower > min_delta_ms:
+                regressions.append(f"{stage} {metric}: {base[metric]:.3f} -> {stats[metric]:.3f} (> {limit:.0%})")
+    for level, stats in current["concurrency"].items():
+        base = baseline.get("concurrency", {}).get(level)
+        if not base:
+            continue
+        limit = threshold(stats, base, "qps")
+        if stats["qps"] < base["qps"] * (1 - limit):
+            regressions.append(f"qps@{level}: {base['qps']:.1f} -> {stats['qps']:.1f} (> {limit:.0%})")
+    return regressions
+
+
+def print_report(results, baseline=None):
+    print(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'base p50':>10}")
+    for stage, stats in results["stages"].items():
+        base = (baseline or {}).get("stages", {}).get(stage, {}).get("p50_ms")
+        base = f"{base:10.3f}" if base is not None else f"{'-':>10}"
+        print(f"{stage:<16}{stats['p50_ms']:10.3f}{stats['p95_ms']:10.3f}{stats['p99_ms']:10.3f}{base}")
+    print(f"\n{'concurrency':<16}{'qps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for level, stats in results["concurrency"].items():
+        print(f"{level:<16}{stats['qps']:10.1f}{stats['p50_ms']:10.3f}{stats['p95_ms']:10.3f}{stats['p99_ms']:10.3f}")
+
+
+# Usage: python -m scripts.benchmark [--docs 5000] [--concurrency 1 4 8] [--output bench.json] [--baseline base.json]
+# Runs offline on the local engine with a hashing embedder and an overlap reranker unless
+# --model / --reranker point at local model directories.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency and throughput benchmark of the retrieval pipeline")
+    parser.add_argument("--docs", type=int, default=5000, help="Synthetic corpus size")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the prompts for the stage timings")
+    parser.add_argument("--runs", type=int, default=5, help="Benchmark runs, compared by their medians")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed passes over the prompts before measuring")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--dims", type=int, default=128, help="Hashing embedder dimension")
+    parser.add_argument("--model", help="Local SentenceTransformer directory instead of the hashing embedder")
+    parser.add_argument("--reranker", help="Local cross-encoder directory instead of the overlap reranker")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="IVF lists of the local engine, 0 for exact kNN")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Compare with a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative slowdown before failing, raised to the measured run spread")
+    parser.add_argument("--qps-tolerance", type=float, default=0.15,
+                        help="Allowed relative QPS drop before failing, raised to the measured run spread")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="Ignore smaller absolute slowdowns")
+    args = parser.parse_args()
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model, device="cpu")
+    else:
+        model = HashingEmbedder(args.dims)
+    if args.reranker:
+        from src.reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(model_name=args.reranker, device="cpu")
+    else:
+        reranker = OverlapReranker()
+
+    es = LocalSearchEngine(ivf_lists=args.ivf_lists)
+    index_name = "benchmark"
+    ingest = build_corpus(es, model, index_name, args.docs)
+    print(f"Indexed {ingest['docs']} synthetic documents in {ingest['seconds']:.1f}s\n")
+
+    # Untimed passes build the lazy search structures and warm caches and the allocator
+    for _ in range(args.warmup):
+        for prompt in PROMPTS:
+            run_query(prompt, es, model, reranker, index_name)
+
+    stage_runs, concurrency_runs = [], []
+    for _ in range(args.runs):
+        stage_runs.append(bench_stages(PROMPTS, es, model, reranker, index_name, args.repeats))
+        concurrency_runs.append(
+            bench_concurrency(PROMPTS, es, model, reranker, index_name, args.concurrency, args.requests)
+        )
+
+    results = {
+        "meta": {
+            "docs": args.docs,
+            "model": args.model or model.model_name,
+            "reranker": args.reranker or "overlap-stub",
+            "ivf_lists": args.ivf_lists,
+            "runs": args.runs,
+            "warmup": args.warmup,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": median_of_runs(stage_runs),
+        "concurrency": median_of_runs(concurrency_runs),
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms, args.qps_tolerance)
+        if regressions:
+            print("\nRegressions beyond tolerance:")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print("\nNo regressions beyond tolerance.")
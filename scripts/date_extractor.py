@@ -1,27 +1,40 @@
 import re
 
-def extract_turkish_date(text):
-    aylar = [
-        "Ocak", "Şubat", "Mart", "Nisan", "Mayıs", "Haziran",
-        "Temmuz", "Ağustos", "Eylül", "Ekim", "Kasım", "Aralık"
-    ]
-    ay_regex = r"|".join(aylar)
+AYLAR = [
+    "Ocak", "Şubat", "Mart", "Nisan", "Mayıs", "Haziran",
+    "Temmuz", "Ağustos", "Eylül", "Ekim", "Kasım", "Aralık"
+]
+AY_REGEX = r"|".join(AYLAR)
+
+# Patterns are compiled once at import time, not on every call
+YIL_PATTERN = re.compile(r"\b(20\d{2})\s*['’]?(te|de)?\b")
+AY_PATTERN = re.compile(rf"\b({AY_REGEX})(?:\s*20\d{{2}})?(?:ın|in|un|ün|a|e|da|de|ta|te|nda|nde|’ta|’te|’da|’de| ayında)?\b", re.IGNORECASE)
+AY_YIL_PATTERN = re.compile(rf"\b({AY_REGEX})(20\d{{2}})", re.IGNORECASE)
+
+# Month name -> month number (1-12), keyed without the dotless ı so "MAYIS" and "Mayıs" agree
+AY_NUMARALARI = {ay.lower().replace("ı", "i"): i for i, ay in enumerate(AYLAR, start=1)}
+
 
+def extract_date_parts(text):
     # Extract the year
-    yil_match = re.search(r"\b(20\d{2})\s*['’]?(te|de)?\b", text)
+    yil_match = YIL_PATTERN.search(text)
     yil = yil_match.group(1) if yil_match else None
 
     # Extract the month
-    ay_match = re.search(rf"\b({ay_regex})(?:\s*20\d{{2}})?(?:ın|in|un|ün|a|e|da|de|ta|te|nda|nde|’ta|’te|’da|’de| ayında)?\b", text, re.IGNORECASE)
+    ay_match = AY_PATTERN.search(text)
     ay = ay_match.group(1).capitalize() if ay_match else None
 
     # Check if the date written like this: "Mart2024"
     if not ay or not yil:
-        match = re.search(rf"\b({ay_regex})(20\d{{2}})", text, re.IGNORECASE)
+        match = AY_YIL_PATTERN.search(text)
         if match:
             ay = match.group(1).capitalize()
             yil = match.group(2)
 
+    return ay, yil
+
+
+def join_date_parts(ay, yil):
     # Concat them
     if ay and yil:
         return f"{ay} {yil}"
@@ -31,3 +44,17 @@ def extract_turkish_date(text):
         return yil
     else:
         return ""
+
+
+def extract_turkish_date(text):
+    return join_date_parts(*extract_date_parts(text))
+
+
+def to_month_year(ay, yil):
+    # Numeric (month, year) of the extracted parts, None for missing parts
+    month = AY_NUMARALARI.get(ay.lower().replace("ı", "i")) if ay else None
+    return month, int(yil) if yil else None
+
+
+def extract_month_year(text):
+    return to_month_year(*extract_date_parts(text))
@@ -14,3 +14,16 @@ def format_month_year(date_str):
         return f"{month_name} {year}"  # e.g., "Ocak 2024"
     except Exception as e:
         return ""
+
+
+def parse_month_year(date_str):
+    # Numeric (month, year) of a "00/MM/YYYY" date, (None, None) if it can't be parsed
+    try:
+        parts = date_str.split("/")
+        month = int(parts[1])
+        year = int(parts[2])
+        if month not in turkish_months:
+            return None, None
+        return month, year
+    except Exception as e:
+        return None, None
@@ -1,11 +1,11 @@
-from elasticsearch import Elasticsearch
+from src.backends import get_search_client
 
 
 def delete_index(index_name):
     # Helper to delete a specific index
 
-    # Connect to local Elasticsearch instance
-    es = Elasticsearch("http://localhost:9200")
+    # Connect to local Elasticsearch instance (or the in-process engine, see $SEARCH_BACKEND)
+    es = get_search_client()
 
     # Check if the index exists and delete it
     if es.indices.exists(index=index_name, request_timeout=30):
@@ -16,8 +16,8 @@ def delete_index(index_name):
 
 
 def list_indices():
-    # Connect to local Elasticsearch instance
-    es = Elasticsearch("http://localhost:9200")
+    # Connect to local Elasticsearch instance (or the in-process engine, see $SEARCH_BACKEND)
+    es = get_search_client()
 
     # Fetch and print all index names using keyword argument
     indices = es.indices.get_alias(index="*")
@@ -0,0 +1,10 @@
+import sys
+from sentence_transformers import SentenceTransformer
+from src.indexing import stream_index_data
+
+
+# Index the full MLSUM Turkish corpus (train/validation/test), resuming from the last checkpoint
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else "jinaai/jina-embeddings-v3"
+    model = SentenceTransformer(model_name, trust_remote_code=True)
+    stream_index_data(model, model_name=model_name, workers=4, force_merge=True)
@@ -0,0 +1,90 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Canned answer streamed word by word
+ANSWER = "Bu, yerel test sunucusunun ürettiği örnek bir cevaptır ve gerçek modelin yerine geçer."
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the RAG LLM endpoint.
+
+    POST /ask answers {"prompt": ...} with the canned answer, as server-sent
+    events when the request asks for {"stream": true}, as {"answer": ...}
+    otherwise. GET /stats returns the number of /ask requests served.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json({"requests": self.server.requests})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self._send_json({"error": "not found"}, status=404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+
+        time.sleep(self.server.first_token_delay)
+        words = ANSWER.split(" ")
+        if not request.get("stream"):
+            time.sleep(self.server.token_delay * len(words))
+            self._send_json({"answer": ANSWER})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, word in enumerate(words):
+            token = word if i == 0 else " " + word
+            self.wfile.write(f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def make_server(host="127.0.0.1", port=8001, first_token_delay=0.2, token_delay=0.02):
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.first_token_delay = first_token_delay
+    server.token_delay = token_delay
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+# Usage: python -m scripts.llm_stub_server [--port 8001], then LLM_URL=http://127.0.0.1:8001
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the RAG LLM endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.first_token_delay, args.token_delay)
+    print(f"Stub LLM listening on http://{args.host}:{args.port}")
+    server.serve_forever()
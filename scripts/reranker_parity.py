@@ -0,0 +1,76 @@
+import sys
+import time
+import numpy as np
+from src.backends import get_search_client
+from src.driver import PROMPTS
+from src.reranker import CrossEncoderReranker
+
+
+def kendall_tau(a, b):
+    # Kendall rank correlation of two score lists over the same candidates
+    a, b = np.asarray(a), np.asarray(b)
+    i, j = np.triu_indices(len(a), k=1)
+    concordance = np.sign(a[i] - a[j]) * np.sign(b[i] - b[j])
+    return float(concordance.mean()) if len(concordance) else 1.0
+
+
+def rank_agreement(reference_scores, candidate_scores, k=5):
+    """
+    Compares the rankings two backends produce for the same candidates.
+
+    Returns:
+        dict: Kendall tau, top-1 agreement and top-k overlap (fraction).
+    """
+    ref_order = np.argsort(-np.asarray(reference_scores), kind="stable")
+    cand_order = np.argsort(-np.asarray(candidate_scores), kind="stable")
+    return {
+        "kendall_tau": kendall_tau(reference_scores, candidate_scores),
+        "top1": float(ref_order[0] == cand_order[0]),
+        f"top{k}_overlap": len(set(ref_order[:k]) & set(cand_order[:k])) / min(k, len(ref_order)),
+    }
+
+
+def fetch_candidates(es, index_name, prompt, size=25):
+    # BM25 candidates are enough to compare rankings, no embedding model needed
+    hits = es.search(index=index_name, body={
+        "size": size,
+        "_source": ["text"],
+        "query": {"multi_match": {"query": prompt, "fields": ["summary^3", "title^2"]}}
+    })["hits"]["hits"]
+    return [hit["_source"]["text"] for hit in hits if hit["_source"].get("text")]
+
+
+def timed_scores(reranker, prompt, texts):
+    start = time.perf_counter()
+    scores = reranker._forward([prompt] * len(texts), texts)
+    return scores, time.perf_counter() - start
+
+
+# Usage: python -m scripts.reranker_parity <backend: int8|onnx> [num_threads]
+if __name__ == "__main__":
+    backend = sys.argv[1] if len(sys.argv) > 1 else "int8"
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    es = get_search_client()
+    reference = CrossEncoderReranker(device="cpu", num_threads=num_threads, cache_size=0)
+    candidate = CrossEncoderReranker(backend=backend, num_threads=num_threads, cache_size=0)
+
+    metrics, ref_time, cand_time = [], 0.0, 0.0
+    for prompt in PROMPTS:
+        texts = fetch_candidates(es, "mlsum_tr_semantic", prompt)
+        if len(texts) < 2:
+            continue
+        ref_scores, t_ref = timed_scores(reference, prompt, texts)
+        cand_scores, t_cand = timed_scores(candidate, prompt, texts)
+        ref_time += t_ref
+        cand_time += t_cand
+        metrics.append(rank_agreement(ref_scores, cand_scores))
+
+    if not metrics:
+        print("No candidates retrieved, is the index populated?")
+        sys.exit(1)
+
+    print(f"Backend: {backend} vs fp32 over {len(metrics)} prompts")
+    for key in metrics[0]:
+        print(f"{key}: {np.mean([m[key] for m in metrics]):.3f}")
+    print(f"fp32: {ref_time:.2f}s, {backend}: {cand_time:.2f}s, speedup: {ref_time / cand_time:.1f}x")
@@ -0,0 +1,282 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import statistics
+import time
+from src.embedder import truncate_dims
+from src.passages import parent_of
+from src.query import (
+    DEFAULT_RETRIEVAL_CONFIG, RETRIEVAL_CONFIG_PATH, build_search_bodies, check_dims, fuse_hits, index_metadata
+)
+
+# Query side of the eval pairs: the article's title, its summary, or the first sentence of its text.
+# Title and summary are also indexed (and embedded), "lead" is the only one that does not leak into the index.
+QUERY_FIELDS = ("lead", "title", "summary")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def lead_sentence(text):
+    return _SENTENCE_END.split(text.strip(), 1)[0] if text else ""
+
+
+def build_eval_set(es, index, n_queries=200, query_field="lead", seed=0):
+    """
+    Samples indexed articles and turns each into a labelled query.
+
+    Args:
+        es: Search client.
+        index (str): Index to sample from.
+        n_queries (int): Number of queries.
+        query_field (str): One of QUERY_FIELDS.
+        seed (int): Sampling seed.
+
+    Returns:
+        List[Tuple[str, str]]: (query, target article id) pairs.
+    """
+    # Passage indices hold several documents per article, over-sample and keep one per article
+    body = {
+        "size": n_queries * 4,
+        "_source": ["title", "summary", "text", "passage"],
+        "query": {"function_score": {"query": {"match_all": {}}, "random_score": {"seed": seed, "field": "_seq_no"}}},
+    }
+    pairs = {}
+    for hit in es.search(index=index, body=body)["hits"]["hits"]:
+        target = parent_of(hit["_id"])
+        source = hit["_source"]
+        if query_field == "lead":
+            query = lead_sentence(source.get("text") or source.get("passage", ""))
+        else:
+            query = source.get(query_field, "")
+        if target not in pairs and query.strip():
+            pairs[target] = query.strip()
+        if len(pairs) >= n_queries:
+            break
+    return [(query, target) for target, query in pairs.items()]
+
+
+def embed_queries(queries, model, metadata, batch_size=64):
+    embeddings = truncate_dims(model.encode(queries, batch_size=batch_size), metadata["truncate_dims"]).tolist()
+    check_dims(metadata["dims"], embeddings)
+    return embeddings
+
+
+def run_searches(es, index, eval_set, embeddings, metadata, window_size_lex, knn_k, num_candidates, repeats=3):
+    """
+    Runs the lexical and kNN search of every eval query with one set of search parameters.
+
+    Returns:
+        Tuple[List[Tuple[list, list]], List[float]]: (lexical hits, kNN hits) per query and the
+            per-query search latency in seconds (median of `repeats`).
+    """
+    config = dict(DEFAULT_RETRIEVAL_CONFIG, window_size_lex=window_size_lex, window_size_vec=knn_k,
+                  knn_k=knn_k, num_candidates=num_candidates)
+    results, latencies = [], []
+    for (query, _), embedding in zip(eval_set, embeddings):
+        lexical_body, vec_body = build_search_bodies(query, embedding, 10, metadata["properties"], config)
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            lex_hits = es.search(index=index, body=lexical_body)["hits"]["hits"]
+            vec_hits = es.search(index=index, body=vec_body)["hits"]["hits"]
+            runs.append(time.perf_counter() - start)
+        results.append((lex_hits, vec_hits))
+        latencies.append(statistics.median(runs))
+    return results, latencies
+
+
+def hydrate_latency(es, index, eval_set, search_results, limit):
+    # Fetching _source of the fused survivors grows with `limit`, time it once per limit
+    latencies = []
+    for lex_hits, vec_hits in search_results:
+        ids = list(dict.fromkeys(hit["_id"] for hit in lex_hits + vec_hits))[:limit]
+        start = time.perf_counter()
+        if ids:
+            es.mget(index=index, ids=ids, source_excludes=["embedding"])
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies)
+
+
+def score_fusion(eval_set, search_results, properties, config, cutoffs=(1, 5, 10)):
+    """
+    Fuses the cached search results with one fusion config and scores the rankings.
+
+    Returns:
+        dict: recall@limit, recall@<cutoff> for every cutoff, MRR and the mean fusion time in ms.
+    """
+    ranks = []
+    start = time.perf_counter()
+    for (_, target), (lex_hits, vec_hits) in zip(eval_set, search_results):
+        fused = fuse_hits(lex_hits, vec_hits, properties, config=config)
+        ids = [parent_of(hit["_id"]) for hit in fused]
+        ranks.append(ids.index(target) + 1 if target in ids else None)
+    fusion_ms = (time.perf_counter() - start) * 1000 / len(eval_set)
+
+    n = len(ranks)
+    metrics = {"recall": sum(rank is not None for rank in ranks) / n}
+    for cutoff in cutoffs:
+        metrics[f"recall@{cutoff}"] = sum(rank is not None and rank <= cutoff for rank in ranks) / n
+    metrics["mrr"] = sum(1 / rank for rank in ranks if rank) / n
+    metrics["fusion_ms"] = fusion_ms
+    return metrics
+
+
+def sweep(es, index, eval_set, embeddings, metadata, grid, repeats=3, verbose=True):
+    """
+    Evaluates every combination of the grid.
+
+    Search parameters (window_size_lex, knn_k, num_candidates) are run against
+    the index and timed; fusion parameters (k_const, w_vec, limit) only re-rank
+    the cached hits, so the sweep costs one search pass per search setting.
+
+    Returns:
+        List[dict]: {"params", "metrics", "latency_ms"} of every configuration.
+    """
+    search_grid = list(itertools.product(grid["window_size_lex"], grid["knn_k"], grid["num_candidates"]))
+    fusion_grid = list(itertools.product(grid["k_const"], grid["w_vec"], grid["limit"]))
+    rows = []
+    for i, (window_size_lex, knn_k, num_candidates) in enumerate(search_grid, 1):
+        if num_candidates < knn_k:
+            continue
+        search_results, latencies = run_searches(
+            es, index, eval_set, embeddings, metadata, window_size_lex, knn_k, num_candidates, repeats
+        )
+        search_ms = statistics.median(latencies) * 1000
+        hydrate_ms = {
+            limit: hydrate_latency(es, index, eval_set, search_results, limit) * 1000 for limit in grid["limit"]
+        }
+        for k_const, w_vec, limit in fusion_grid:
+            params = dict(
+                DEFAULT_RETRIEVAL_CONFIG, window_size_lex=window_size_lex, window_size_vec=knn_k, knn_k=knn_k,
+                num_candidates=num_candidates, k_const=k_const, w_vec=w_vec, limit=limit
+            )
+            metrics = score_fusion(eval_set, search_results, metadata["properties"], params)
+            latency_ms = search_ms + metrics["fusion_ms"] + hydrate_ms[limit]
+            rows.append({"params": params, "metrics": metrics, "latency_ms": latency_ms})
+        if verbose:
+            print(f"[{i}/{len(search_grid)}] lex={window_size_lex} knn_k={knn_k} candidates={num_candidates}: "
+                  f"search p50 {search_ms:.2f} ms")
+    return rows
+
+
+def pareto_frontier(rows, metric="recall"):
+    # Configurations no other configuration beats on both quality (higher) and latency (lower)
+    frontier = []
+    for row in sorted(rows, key=lambda row: (row["latency_ms"], -row["metrics"][metric])):
+        if not frontier or row["metrics"][metric] > frontier[-1]["metrics"][metric]:
+            frontier.append(row)
+    return frontier
+
+
+def choose(frontier, metric="recall", max_loss=0.005):
+    # The fastest configuration within `max_loss` of the best quality
+    best = max(row["metrics"][metric] for row in frontier)
+    return next(row for row in frontier if row["metrics"][metric] >= best - max_loss)
+
+
+def print_frontier(frontier, chosen, metric):
+    print(f"\n{'lex':>5} {'knn_k':>6} {'cand':>5} {'k':>4} {'w_vec':>6} {'limit':>6} "
+          f"{'recall':>7} {'R@5':>6} {'MRR':>6} {'ms':>8}")
+    for row in frontier:
+        p, m = row["params"], row["metrics"]
+        marker = "  <- chosen" if row is chosen else ""
+        print(f"{p['window_size_lex']:>5} {p['knn_k']:>6} {p['num_candidates']:>5} {p['k_const']:>4} "
+              f"{p['w_vec']:>6.2f} {p['limit']:>6} {m['recall']:>7.3f} {m['recall@5']:>6.3f} {m['mrr']:>6.3f} "
+              f"{row['latency_ms']:>8.2f}{marker}")
+    print(f"\nFrontier by {metric} vs latency, {len(frontier)} configurations")
+
+
+def baseline_row(es, index, eval_set, embeddings, metadata, repeats=3):
+    # The current defaults, measured the same way, for comparison
+    config = DEFAULT_RETRIEVAL_CONFIG
+    search_results, latencies = run_searches(
+        es, index, eval_set, embeddings, metadata, config["window_size_lex"], config["knn_k"],
+        config["num_candidates"], repeats
+    )
+    metrics = score_fusion(eval_set, search_results, metadata["properties"], config)
+    latency_ms = (statistics.median(latencies) + hydrate_latency(es, index, eval_set, search_results, config["limit"])) * 1000
+    return {"params": dict(config), "metrics": metrics, "latency_ms": latency_ms + metrics["fusion_ms"]}
+
+
+# Usage:
+#   python -m scripts.tune_retrieval --index mlsum_tr_semantic [--queries 200] [--query-field lead]
+#   python -m scripts.tune_retrieval --synthetic 5000      (offline: local engine, hashing embedder)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep retrieval parameters and write the chosen config")
+    parser.add_argument("--index", default="mlsum_tr_semantic")
+    parser.add_argument("--model", default="jinaai/jina-embeddings-v3")
+    parser.add_argument("--synthetic", type=int, default=0, help="Tune on a synthetic local corpus of this many docs")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-field", choices=QUERY_FIELDS, default="lead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per query and search setting")
+    parser.add_argument("--metric", choices=("recall", "recall@5", "mrr"), default="recall",
+                        help="Quality axis of the frontier, recall is measured at the fused `limit`")
+    parser.add_argument("--max-loss", type=float, default=0.005, help="Quality the chosen config may give up for speed")
+    parser.add_argument("--window-size-lex", type=int, nargs="+", default=[25, 50, 100])
+    parser.add_argument("--knn-k", type=int, nargs="+", default=[25, 50, 100])
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--k-const", type=int, nargs="+", default=[10, 30, 60, 100])
+    parser.add_argument("--w-vec", type=float, nargs="+", default=[0.7, 1.0, 1.3, 1.6])
+    parser.add_argument("--limit", type=int, nargs="+", default=[10, 15, 25])
+    parser.add_argument("--output", default=RETRIEVAL_CONFIG_PATH, help="Config file read by query_similar")
+    parser.add_argument("--dry-run", action="store_true", help="Report without writing the config")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        from scripts.benchmark import HashingEmbedder, build_corpus
+        from src.local_engine import LocalSearchEngine
+        model, es, index = HashingEmbedder(), LocalSearchEngine(), "tune_retrieval"
+        build_corpus(es, model, index, args.synthetic, seed=args.seed)
+    else:
+        from src.backends import get_search_client
+        from src.startup import load_embedding_model
+        es, index = get_search_client(), args.index
+        model = load_embedding_model(args.model, trust_remote_code=True)
+
+    metadata = index_metadata.fetch(es, index)
+    eval_set = build_eval_set(es, index, args.queries, args.query_field, args.seed)
+    embeddings = embed_queries([query for query, _ in eval_set], model, metadata)
+    print(f"Eval set: {len(eval_set)} queries ({args.query_field} -> article) from '{index}'")
+
+    grid = {
+        "window_size_lex": args.window_size_lex, "knn_k": args.knn_k, "num_candidates": args.num_candidates,
+        "k_const": args.k_const, "w_vec": args.w_vec, "limit": args.limit,
+    }
+    # One untimed pass warms caches and the engine's lazy structures
+    run_searches(es, index, eval_set, embeddings, metadata, max(args.window_size_lex), max(args.knn_k),
+                 max(args.num_candidates), repeats=1)
+    baseline = baseline_row(es, index, eval_set, embeddings, metadata, args.repeats)
+    rows = sweep(es, index, eval_set, embeddings, metadata, grid, args.repeats)
+
+    frontier = pareto_frontier(rows, args.metric)
+    chosen = choose(frontier, args.metric, args.max_loss)
+    print_frontier(frontier, chosen, args.metric)
+    for label, row in (("Defaults", baseline), ("Chosen", chosen)):
+        m = row["metrics"]
+        print(f"{label:>8}: recall {m['recall']:.3f}, recall@5 {m['recall@5']:.3f}, MRR {m['mrr']:.3f}, "
+              f"{row['latency_ms']:.2f} ms")
+
+    if not args.dry_run:
+        # Written next to the target and renamed over it, readers never see a half-written file
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "params": chosen["params"],
+                "eval": {
+                    "index": index,
+                    "queries": len(eval_set),
+                    "query_field": args.query_field,
+                    "metric": args.metric,
+                    "metrics": chosen["metrics"],
+                    "latency_ms": chosen["latency_ms"],
+                    "baseline": {"metrics": baseline["metrics"], "latency_ms": baseline["latency_ms"]},
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "frontier": [{"params": row["params"], "metrics": row["metrics"], "latency_ms": row["latency_ms"]}
+                             for row in frontier],
+            }, f, indent=2)
+        os.replace(tmp_path, args.output)
+        print(f"\nWrote {args.output}")
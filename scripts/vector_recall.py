@@ -0,0 +1,58 @@
+import sys
+import numpy as np
+from elasticsearch import Elasticsearch
+from sentence_transformers import SentenceTransformer
+from src.driver import PROMPTS
+from src.query import index_metadata, embed_prompt
+
+
+def knn_ids(es, index_name, embedding, k):
+    body = {
+        "size": k,
+        "_source": False,
+        "knn": {"field": "embedding", "query_vector": embedding, "k": k, "num_candidates": max(100, k)}
+    }
+    return [hit["_id"] for hit in es.search(index=index_name, body=body)["hits"]["hits"]]
+
+
+def store_size_mb(es, index_name):
+    stats = es.indices.stats(index=index_name, metric="store")
+    return stats["_all"]["primaries"]["store"]["size_in_bytes"] / (1024 * 1024)
+
+
+def sample_queries(es, index_name, n=100):
+    # Titles of random indexed articles, in addition to the evaluation prompts
+    hits = es.search(index=index_name, body={
+        "size": n,
+        "_source": ["title"],
+        "query": {"function_score": {"random_score": {"seed": 42, "field": "_seq_no"}}}
+    })["hits"]["hits"]
+    return [hit["_source"]["title"] for hit in hits if hit["_source"].get("title")]
+
+
+# Usage: python -m scripts.vector_recall <full index> <compact index> [model] [k]
+# Reports recall@k of the compact (quantized and/or truncated) index against the full-precision one
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m scripts.vector_recall <full-index> <compact-index> [model] [k]")
+        sys.exit(1)
+
+    full_index, compact_index = sys.argv[1], sys.argv[2]
+    model_name = sys.argv[3] if len(sys.argv) > 3 else "jinaai/jina-embeddings-v3"
+    k = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    es = Elasticsearch("http://localhost:9200")
+    model = SentenceTransformer(model_name, trust_remote_code=True)
+    full_meta = index_metadata.fetch(es, full_index)
+    compact_meta = index_metadata.fetch(es, compact_index)
+
+    recalls = []
+    for query in PROMPTS + sample_queries(es, full_index):
+        expected = knn_ids(es, full_index, embed_prompt(query, model, full_meta["truncate_dims"]), k)
+        found = knn_ids(es, compact_index, embed_prompt(query, model, compact_meta["truncate_dims"]), k)
+        if expected:
+            recalls.append(len(set(expected) & set(found)) / len(expected))
+
+    print(f"{compact_index} ({compact_meta['dims']} dims) vs {full_index} ({full_meta['dims']} dims)")
+    print(f"recall@{k}: {np.mean(recalls):.3f} over {len(recalls)} queries")
+    print(f"store size: {store_size_mb(es, compact_index):.1f} MB vs {store_size_mb(es, full_index):.1f} MB")
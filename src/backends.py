@@ -0,0 +1,41 @@
+import os
+from functools import lru_cache
+from elasticsearch import Elasticsearch
+from src.local_engine import LocalSearchEngine
+
+# Selected with the SEARCH_BACKEND environment variable
+BACKENDS = ("elasticsearch", "local")
+
+
+@lru_cache(maxsize=None)
+def get_search_client(backend=None, host="localhost", port=9200, data_dir=None):
+    """
+    Returns the shared search client of a backend.
+
+    Both backends expose the client API used by indexing and querying, so the
+    result can be passed wherever an `es` client is expected.
+
+    Args:
+        backend (str): "elasticsearch" or "local", defaults to $SEARCH_BACKEND or "elasticsearch".
+        host (str): Elasticsearch host.
+        port (int): Elasticsearch port.
+        data_dir (str): Directory of the local engine, defaults to $LOCAL_INDEX_DIR (in-memory if unset).
+
+    Returns:
+        Union[Elasticsearch, LocalSearchEngine]: One client per backend and location for the whole process.
+    """
+    backend = backend or os.environ.get("SEARCH_BACKEND", "elasticsearch")
+    if backend == "elasticsearch":
+        return Elasticsearch(f"http://{host}:{port}")
+    if backend == "local":
+        return LocalSearchEngine(
+            data_dir=data_dir or os.environ.get("LOCAL_INDEX_DIR"),
+            ivf_lists=int(os.environ.get("LOCAL_IVF_LISTS", 0)),
+            nprobe=int(os.environ.get("LOCAL_IVF_NPROBE", 8)),
+        )
+    raise ValueError(f"Unknown search backend: {backend} (expected one of {BACKENDS})")
+
+
+def is_local(es):
+    # The local engine has no streaming_bulk transport, it is fed through plain bulk requests
+    return isinstance(es, LocalSearchEngine)
@@ -0,0 +1,103 @@
+import threading
+from collections import Counter
+from src.instrumentation import count
+
+
+class RerankCascade:
+    """
+    RerankCascade sits between fusion and the cross-encoder and decides how many
+    fused candidates actually need cross-encoding.
+
+    The decision uses the per-retriever ranks that fusion attaches to every hit
+    (`_fusion_ranks`) and the fused scores:
+        - "skip": the top hit is first in every retriever and the retrievers agree
+          on the top-k, so the fusion order is returned as is (no cross-encoder).
+        - "shallow": the retrievers mostly agree or the top-k is clearly separated
+          from the rest, so only the first `shallow_depth` candidates are reranked.
+        - "full": every candidate is reranked.
+    Hits without fusion ranks (e.g. server-side fusion) always take the full path.
+
+    Attributes:
+        top_k (int): Number of hits returned.
+        skip_agreement (float): Minimum top-k overlap of the retrievers to skip reranking.
+        shallow_agreement (float): Minimum top-k overlap of the retrievers for a shallow rerank.
+        margin (float): Relative score gap between hit 1 and hit top_k + 1 that allows a shallow rerank.
+        shallow_depth (int): Candidates reranked on the shallow path, 2 * top_k if None.
+        stats (Counter): Number of queries that took each path.
+    """
+
+    def __init__(self, top_k: int = 5, skip_agreement: float = 0.8, shallow_agreement: float = 0.4,
+                 margin: float = 0.3, shallow_depth: int = None):
+        self.top_k = top_k
+        self.skip_agreement = skip_agreement
+        self.shallow_agreement = shallow_agreement
+        self.margin = margin
+        self.shallow_depth = shallow_depth or 2 * top_k
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def agreement(self, hits) -> float:
+        # Overlap of the retrievers' top-k among the fused hits (1.0 = identical sets)
+        ranks = [hit.get("_fusion_ranks") for hit in hits]
+        if not ranks or any(r is None for r in ranks) or len(ranks[0]) < 2:
+            return 0.0
+        tops = [
+            {i for i, r in enumerate(ranks) if r[n] is not None and r[n] <= self.top_k}
+            for n in range(len(ranks[0]))
+        ]
+        return len(set.intersection(*tops)) / self.top_k
+
+    def decide(self, hits):
+        """
+        Chooses the rerank path for fused hits.
+
+        Returns:
+            Tuple[int, str]: Number of candidates to cross-encode and the path name.
+        """
+        if not hits:
+            return 0, "empty"
+        if "_fusion_ranks" not in hits[0]:
+            return len(hits), "full"
+
+        agreement = self.agreement(hits)
+        top_ranks = hits[0]["_fusion_ranks"]
+        if all(r == 1 for r in top_ranks) and agreement >= self.skip_agreement:
+            return 0, "skip"
+
+        margin = 0.0
+        if len(hits) > self.top_k and hits[0]["_score"]:
+            margin = (hits[0]["_score"] - hits[self.top_k]["_score"]) / hits[0]["_score"]
+        if agreement >= self.shallow_agreement or margin >= self.margin:
+            return min(self.shallow_depth, len(hits)), "shallow"
+        return len(hits), "full"
+
+    def record(self, path: str):
+        with self._lock:
+            self.stats[path] += 1
+        count("rerank_cascade", path=path)
+
+    def rerank(self, prompt: str, hits: list, reranker, top_k: int = None) -> list:
+        """
+        Reranks fused hits with as little cross-encoder work as the decision allows.
+
+        Args:
+            prompt (str): The query or question.
+            hits (list): Fused Elasticsearch hits, best first.
+            reranker (CrossEncoderReranker): Cross-encoder used when reranking is needed.
+            top_k (int): Number of hits to return, defaults to the cascade's top_k.
+
+        Returns:
+            List[dict]: Top-k hits, each with the path taken as "cascade_path".
+        """
+        top_k = top_k or self.top_k
+        depth, path = self.decide(hits)
+        self.record(path)
+
+        if depth == 0:
+            results = [hit.copy() for hit in hits[:top_k]]
+        else:
+            results = reranker.rerank_with_metadata(prompt, hits[:depth], top_k=top_k)
+
+        for hit in results:
+            hit["cascade_path"] = path
+        return results
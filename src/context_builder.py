@@ -0,0 +1,256 @@
+import hashlib
+import math
+import re
+import string
+import textwrap
+import zlib
+from collections import Counter
+import numpy as np
+from src.text import analyze
+
+# Few-shot instructions of the news assistant, {question} and {context} are filled per request
+DEFAULT_TEMPLATE = textwrap.dedent("""\
+    Sen tarafsız bir haber asistanısın.
+    Görevin, verilen bağlamı inceleyerek soruya yalnızca bu bilgilere dayanarak yanıt vermektir.
+    Yanıtını Türkçe ve kısa, açık cümlelerle ver. Bağlamdaki bilgileri kullan, fakat bağlamın kendisine atıfta bulunma.
+
+    Örnek:
+    Soru: Türkiye’nin 2020 yılında ekonomik büyüme oranı neydi?
+    Bağlam:
+    1. Özet: Türkiye ekonomisi 2020 yılında pandemi etkisiyle daralma yaşasa da yılın son çeyreğinde toparlanma görüldü. Yıllık bazda %1,8 büyüme kaydedildi.
+    2. Metin: TÜİK verilerine göre, 2020 yılı büyüme oranı %1,8 olarak açıklandı.
+    Cevap: Türkiye ekonomisi 2020 yılında %1,8 oranında büyümüştür.
+
+    Şimdi senin sıran:
+
+    Soru: {question}
+
+    Bağlamlar:
+    {context}
+
+    Cevap:
+    """)
+
+# Sentence boundary: end punctuation followed by whitespace and an upper-case letter or digit
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+(?=[\"“'(\dA-ZÇĞİÖŞÜ])")
+
+# Sub-word pieces of at most four characters, a tokenizer-free estimate of LLM tokens for Turkish text
+_TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Mersenne prime of the MinHash permutations
+_MERSENNE = (1 << 61) - 1
+
+
+def estimate_tokens(text):
+    return len(_TOKEN_PIECE.findall(text))
+
+
+def stems(tokens, prefix=5):
+    # Turkish is suffixing, a five-letter prefix matches most inflections of a word ("ücret", "ücretler")
+    return {token[:prefix] for token in tokens}
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text or "") if sentence.strip()]
+
+
+def _summary(hit):
+    return (hit.get("_source", {}).get("summary") or "").strip()
+
+
+def _body(hit):
+    source = hit.get("_source", {})
+    return (source.get("passage") or source.get("text") or "").strip()
+
+
+class PromptTemplate:
+    """
+    A prompt template parsed once: rendering joins the literal parts with the
+    field values, and the token cost of the literal parts is known up front so
+    the context budget can account for it.
+    """
+
+    def __init__(self, template: str = DEFAULT_TEMPLATE, count_tokens=estimate_tokens):
+        self.template = template
+        self._parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+        self.fields = [field for _, field in self._parts if field]
+        self.fixed_tokens = sum(count_tokens(literal) for literal, _ in self._parts)
+        self.digest = hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+    def render(self, **values):
+        return "".join(literal + (str(values[field]) if field else "") for literal, field in self._parts)
+
+
+class MinHasher:
+    """
+    MinHash signatures of word shingles; the share of equal signature slots
+    estimates the Jaccard similarity of two texts.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._a = rng.integers(1, _MERSENNE, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE, num_perm, dtype=np.uint64)
+
+    def shingles(self, text):
+        tokens = analyze(text)
+        n = min(self.shingle_size, len(tokens)) or 1
+        return {" ".join(tokens[i:i + n]) for i in range(max(len(tokens) - n + 1, 1))}
+
+    def signature(self, text):
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in self.shingles(text)], dtype=np.uint64)
+        # (a * x + b) mod p per permutation; 32-bit hashes times 61-bit multipliers wrap, which keeps them well mixed
+        return ((np.outer(hashes, self._a) + self._b) % np.uint64(_MERSENNE)).min(axis=0)
+
+    @staticmethod
+    def similarity(signature, other):
+        return float(np.mean(signature == other))
+
+
+class ContextBuilder:
+    """
+    ContextBuilder turns reranked hits into the LLM prompt.
+
+    1. Near-duplicate hits (the same wire story published by several outlets)
+       are dropped: a hit whose summary's (title's, passage's or text's when
+       it has none) MinHash similarity to a better ranked hit reaches
+       `duplicate_threshold` adds nothing. Hits without any text are kept.
+    2. The summary of every remaining hit is kept, and the sentences of its
+       text are scored against the question (IDF-weighted stem overlap, the
+       lead sentence favoured and eligible even without overlap).
+    3. Summaries in rank order, then the best sentences across all hits, are
+       packed into `max_tokens` (template included); selected sentences keep
+       their original order in the rendered context. Hits contributing
+       neither a summary nor a sentence are left out, ids included.
+
+    `build` also returns a cache key derived from the template, the
+    normalised question and the exact selected content, stable across
+    processes; identical payloads get identical keys.
+    """
+
+    def __init__(self, max_tokens: int = 1500, duplicate_threshold: float = 0.7, template: str = DEFAULT_TEMPLATE,
+                 count_tokens=estimate_tokens, max_sentences_per_hit: int = 6, num_perm: int = 64):
+        """
+        Args:
+            max_tokens (int): Token budget of the whole prompt.
+            duplicate_threshold (float): MinHash similarity of summaries above which a hit is a duplicate.
+            template (str): Prompt template with {question} and {context} fields.
+            count_tokens (Callable[[str], int]): Token counter, e.g. `lambda s: len(tokenizer.encode(s))`.
+            max_sentences_per_hit (int): Upper bound of text sentences taken from one hit.
+            num_perm (int): MinHash signature length.
+        """
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.template = PromptTemplate(template, count_tokens)
+        self.count_tokens = count_tokens
+        self.max_sentences_per_hit = max_sentences_per_hit
+        self.hasher = MinHasher(num_perm)
+
+    def deduplicate(self, hits):
+        """
+        Returns:
+            Tuple[List[dict], List[dict]]: Kept hits in rank order and the dropped duplicates.
+        """
+        kept, dropped, signatures = [], [], []
+        for hit in hits:
+            source = hit.get("_source", {})
+            text = source.get("summary") or source.get("title") or source.get("passage") or source.get("text")
+            if not (text or "").strip():
+                # Nothing to compare, every empty hit would otherwise share one signature
+                kept.append(hit)
+                continue
+            signature = self.hasher.signature(text)
+            if any(MinHasher.similarity(signature, other) >= self.duplicate_threshold for other in signatures):
+                dropped.append(hit)
+                continue
+            kept.append(hit)
+            signatures.append(signature)
+        return kept, dropped
+
+    def _score_sentences(self, question, texts):
+        # IDF over the candidate sentences of this request, so words every sentence shares count little
+        query = stems(analyze(question))
+        sentences = []
+        for i, text in enumerate(texts):
+            for j, sentence in enumerate(split_sentences(text)):
+                tokens = analyze(sentence)
+                sentences.append((i, j, sentence, " ".join(tokens), stems(tokens) & query))
+        df = Counter(stem for *_, matched in sentences for stem in matched)
+        n = len(sentences) or 1
+        scored = []
+        for i, j, sentence, normalized, matched in sentences:
+            score = sum(math.log(1 + n / df[stem]) for stem in matched)
+            scored.append((score * (1.2 if j == 0 else 1.0), i, j, sentence, normalized))
+        return scored
+
+    def build(self, question, hits):
+        """
+        Builds the prompt for a question and its reranked hits.
+
+        Returns:
+            dict: {"prompt", "context", "doc_ids", "tokens", "cache_key", "duplicates"}; doc_ids are the
+                hits present in the context, duplicates the ids of the dropped ones.
+        """
+        kept, dropped = self.deduplicate(hits)
+        # Hits without a summary or text have nothing to put in the context
+        kept = [hit for hit in kept if _summary(hit) or _body(hit)]
+        budget = self.max_tokens - self.template.fixed_tokens - self.count_tokens(question)
+
+        # Summaries first, in rank order, as long as they fit
+        summarized = []
+        for i, hit in enumerate(kept):
+            if not _summary(hit):
+                continue
+            cost = self.count_tokens(f"{len(summarized) + 1}. Özet: {_summary(hit)}\n")
+            if cost > budget:
+                continue
+            budget -= cost
+            summarized.append(i)
+
+        # Then the most relevant sentences of the summarized hits, and of the hits that only have a text
+        candidates = [i for i, hit in enumerate(kept) if i in summarized or not _summary(hit)]
+        texts = [_body(hit) if i in candidates else "" for i, hit in enumerate(kept)]
+        selected = {i: [] for i in candidates}
+        seen = set()
+        for score, i, j, sentence, normalized in sorted(self._score_sentences(question, texts), key=lambda s: (-s[0], s[1], s[2])):
+            # Sentences sharing no term with the question only get in as the lead of their article
+            if (score <= 0 and j > 0) or len(selected[i]) >= self.max_sentences_per_hit:
+                continue
+            # Sentences repeated within or across articles are sent once
+            if normalized in seen:
+                continue
+            # The first sentence of a hit also pays for the "Metin:" label
+            cost = self.count_tokens(sentence) + (0 if selected[i] else self.count_tokens("   Metin: \n"))
+            if cost > budget:
+                continue
+            budget -= cost
+            seen.add(normalized)
+            selected[i].append((j, sentence))
+
+        # A text-only hit is listed only if some of its sentences made it in
+        included = [i for i in candidates if i in summarized or selected[i]]
+        lines, key_parts = [], []
+        for n, i in enumerate(included, 1):
+            chosen = sorted(selected[i])
+            text = " ".join(sentence for _, sentence in chosen)
+            if i in summarized:
+                lines.append(f"{n}. Özet: {_summary(kept[i])}")
+                if chosen:
+                    lines.append(f"   Metin: {text}")
+            else:
+                lines.append(f"{n}. Metin: {text}")
+            key_parts.append(f"{kept[i].get('_id')}:{','.join(str(j) for j, _ in chosen)}")
+        context = "\n".join(lines)
+        prompt = self.template.render(question=question.strip(), context=context)
+
+        key = "|".join([self.template.digest, " ".join(analyze(question)), *key_parts])
+        return {
+            "prompt": prompt,
+            "context": context,
+            "doc_ids": [kept[i].get("_id") for i in included],
+            "tokens": self.count_tokens(prompt),
+            "cache_key": hashlib.sha256(key.encode("utf-8")).hexdigest(),
+            "duplicates": [hit.get("_id") for hit in dropped],
+        }
@@ -1,8 +1,7 @@
+import os
 import sys
-from sentence_transformers import SentenceTransformer
-from src.indexing import index_data
-from src.query import query_similar, print_retrievals
-from src.reranker import CrossEncoderReranker
+from src.query import query_similar_batch, print_retrievals
+from src.startup import load_models
 
 
 # Define evaluation prompts
@@ -28,18 +27,28 @@ def main():
     model_name = sys.argv[1] if len(sys.argv) == 2 else "jinaai/jina-embeddings-v3"
     print(f"\n>>> Loading embedding model: {model_name}")
 
-    model = SentenceTransformer(model_name, trust_remote_code=True)
+    # The cross-encoder loads alongside the embedding model instead of after indexing
+    model, reranker = load_models(model_name, run_warmup=False)
     print(f"\n>>> Embedding model successfully loaded: {model_name}")
 
-    # Step 1: Index data
+    # Step 1: Index data (imported here, PROMPTS importers should not pay for datasets and torch)
+    from src.embedder import ParallelEmbedder
+    from src.index_versions import ensure_index
     print("\n>>> Indexing data into Elasticsearch...")
-    es = index_data(model)
+    # A new model gets its own index version, the alias moves to it once it is built
+    # EMBED_WORKERS=<n> shards corpus embedding across n CPU processes
+    workers = int(os.environ.get("EMBED_WORKERS", "0"))
+    if workers:
+        with ParallelEmbedder(model_name, workers=workers, trust_remote_code=True) as embedder:
+            es = ensure_index(embedder, model_name=model_name, encode_chunk_size=embedder.batch_size * workers * 4)
+    else:
+        es = ensure_index(model, model_name=model_name)
 
     # Step 2: Query similar results
     print("\n>>> Querying reranked retrievals with the prompts")
-    reranker = CrossEncoderReranker()
-    for prompt in PROMPTS:
-        retrievals = query_similar(prompt, model, es=es)
+    # All prompts share one embedding batch and one _msearch round-trip
+    batch_retrievals = query_similar_batch(PROMPTS, model, es=es)
+    for prompt, retrievals in zip(PROMPTS, batch_retrievals):
         reranked_retrievals = reranker.rerank_with_metadata(prompt, retrievals)
         print_retrievals(prompt, reranked_retrievals)
 
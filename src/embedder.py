@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Model loaded once per worker process
+_worker_model = None
+
+
+def _init_worker(model_name, threads, model_kwargs):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Each worker owns a slice of the cores instead of competing for all of them
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu", **model_kwargs)
+
+
+def _encode_batches(batches, encode_kwargs):
+    return [_worker_model.encode(batch, batch_size=len(batch), **encode_kwargs) for batch in batches]
+
+
+def _dimension():
+    return _worker_model.get_sentence_embedding_dimension()
+
+
+def truncate_dims(vectors, dims=None):
+    """
+    Matryoshka truncation: keeps the first `dims` components and re-normalises.
+
+    Args:
+        vectors (np.ndarray): One vector or a matrix of vectors.
+        dims (int): Target dimension, vectors are returned unchanged if None.
+
+    Returns:
+        np.ndarray: Truncated float32 vectors with unit norm.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dims or dims >= vectors.shape[-1]:
+        return vectors
+    truncated = vectors[..., :dims]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return truncated / norms
+
+
+def length_buckets(texts, batch_size):
+    """
+    Sorts texts by length and cuts them into batches of similar lengths.
+
+    Returns:
+        List[List[int]]: Batches of positions into `texts`.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class ParallelEmbedder:
+    """
+    ParallelEmbedder shards SentenceTransformer encoding across a CPU process pool.
+
+    Inputs are sorted into length buckets so every batch pads to a similar
+    length, the batches are spread over the worker processes and the vectors
+    are returned in the original input order. It exposes the `encode` and
+    `get_sentence_embedding_dimension` methods used by the indexing code, so
+    it can be passed to `index_data` in place of the model.
+
+    Attributes:
+        model_name (str): HuggingFace model identifier loaded in every worker.
+        workers (int): Number of worker processes.
+        batch_size (int): Number of texts per length bucket.
+    """
+
+    def __init__(self, model_name: str, workers: int = None, threads_per_worker: int = 1,
+                 batch_size: int = 64, batches_per_task: int = 4, **model_kwargs):
+        """
+        Starts the worker pool and loads the model in every worker.
+
+        Args:
+            model_name (str): HuggingFace model identifier.
+            workers (int): Number of processes, defaults to cpu_count / threads_per_worker.
+            threads_per_worker (int): Torch intra-op threads of each worker.
+            batch_size (int): Number of texts per length bucket.
+            batches_per_task (int): Buckets sent to a worker per task, amortises IPC.
+            **model_kwargs: Extra SentenceTransformer arguments (e.g. trust_remote_code=True).
+        """
+        self.model_name = model_name
+        self.workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.batch_size = batch_size
+        self.batches_per_task = batches_per_task
+        self._dim = None
+        self._tokenizer = None
+        self._model_kwargs = model_kwargs
+
+        # Spawn, not fork: forked torch runtimes deadlock on their thread pools
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads_per_worker, model_kwargs)
+        )
+
+    def get_sentence_embedding_dimension(self):
+        if self._dim is None:
+            self._dim = self.pool.submit(_dimension).result()
+        return self._dim
+
+    @property
+    def tokenizer(self):
+        # Loaded in this process for passage splitting, the workers keep their own copy inside the model
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name, trust_remote_code=self._model_kwargs.get("trust_remote_code", False)
+            )
+        return self._tokenizer
+
+    def encode(self, texts, batch_size: int = None, **encode_kwargs):
+        """
+        Encodes texts on the worker pool.
+
+        Args:
+            texts (Union[str, List[str]]): Text or texts to embed.
+            batch_size (int): Overrides the length bucket size.
+            **encode_kwargs: Extra SentenceTransformer.encode arguments.
+
+        Returns:
+            np.ndarray: Vectors in the order of `texts` (1-D for a single string).
+        """
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size, **encode_kwargs)[0]
+        if not len(texts):
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        buckets = length_buckets(texts, batch_size or self.batch_size)
+
+        # Interleave buckets across tasks so every worker gets short and long texts
+        tasks = [buckets[i::self.workers * self.batches_per_task] for i in range(self.workers * self.batches_per_task)]
+        tasks = [task for task in tasks if task]
+        futures = [
+            self.pool.submit(_encode_batches, [[texts[i] for i in bucket] for bucket in task], encode_kwargs)
+            for task in tasks
+        ]
+
+        out = None
+        for task, future in zip(tasks, futures):
+            for bucket, vectors in zip(task, future.result()):
+                if out is None:
+                    out = np.zeros((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+                out[bucket] = vectors
+        return out
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
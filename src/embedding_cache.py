@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    EmbeddingCache is a persistent, content-addressed store for embedding vectors.
+
+    Vectors are kept in a memory-mapped float32 matrix on disk and looked up
+    through an append-only key file that maps sha256(text) to a row in that
+    matrix (the n-th key belongs to the n-th row). Every embedding model gets
+    its own directory, so switching models never mixes vectors of different
+    spaces.
+
+    Attributes:
+        model_name (str): Name of the embedding model the vectors belong to.
+        dim (int): Dimension of the stored vectors.
+        directory (str): Directory holding the matrix and the index for this model.
+    """
+
+    def __init__(self, model_name: str, dim: int, cache_dir: str = ".embedding_cache", initial_capacity: int = 1024):
+        """
+        Opens (or creates) the cache for the given model.
+
+        Args:
+            model_name (str): Embedding model identifier, part of the cache key.
+            dim (int): Embedding dimension of the model.
+            cache_dir (str): Root directory of all embedding caches.
+            initial_capacity (int): Number of rows allocated for a fresh cache.
+        """
+        self.model_name = model_name
+        self.dim = dim
+        self.directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.txt")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        os.makedirs(self.directory, exist_ok=True)
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != dim:
+                raise ValueError(f"Cache at {self.directory} holds {meta.get('dim')}-dim vectors, expected {dim}")
+        else:
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model": model_name, "dim": dim}, f)
+
+        # Load the id -> row index (line number in keys.txt is the row)
+        self.rows = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                for row, line in enumerate(f):
+                    self.rows[line.strip()] = row
+        self._pending = []
+
+        self.vectors = None
+        self.capacity = 0
+        existing = os.path.getsize(self.vectors_path) // (dim * 4) if os.path.exists(self.vectors_path) else 0
+        self._open(max(existing, len(self.rows), initial_capacity))
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, text):
+        return self.text_key(text) in self.rows
+
+    def _open(self, capacity):
+        # Grow the backing file (never shrink) and map it into memory
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(max(os.path.getsize(self.vectors_path), capacity * self.dim * 4))
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def get_many(self, texts):
+        """
+        Looks up cached vectors.
+
+        Returns:
+            Tuple[np.ndarray, List[int]]: A (len(texts), dim) matrix and the positions
+            of the texts that are not cached yet (their rows are left as zeros).
+        """
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        missing = []
+        for i, text in enumerate(texts):
+            row = self.rows.get(self.text_key(text))
+            if row is None:
+                missing.append(i)
+            else:
+                out[i] = self.vectors[row]
+        return out, missing
+
+    def put_many(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        new = {}
+        for text, vector in zip(texts, vectors):
+            key = self.text_key(text)
+            if key not in self.rows:
+                new[key] = vector
+        if not new:
+            return
+
+        # Double the capacity until the new rows fit
+        needed = len(self.rows) + len(new)
+        if needed > self.capacity:
+            capacity = self.capacity
+            while capacity < needed:
+                capacity *= 2
+            self._open(capacity)
+
+        for key, vector in new.items():
+            row = len(self.rows)
+            self.vectors[row] = vector
+            self.rows[key] = row
+            self._pending.append(key)
+
+    def flush(self):
+        # Vectors go to disk before the keys that point at them
+        if not self._pending:
+            return
+        self.vectors.flush()
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.write("".join(key + "\n" for key in self._pending))
+        self._pending = []
+
+    def encode(self, texts, encode_fn, flush=True):
+        """
+        Returns vectors for all texts, encoding only the ones missing from the cache.
+
+        Args:
+            texts (List[str]): Texts to embed.
+            encode_fn (Callable[[List[str]], np.ndarray]): Encoder used for cache misses.
+            flush (bool): Persist the newly encoded vectors right away.
+
+        Returns:
+            np.ndarray: A (len(texts), dim) float32 matrix in the order of `texts`.
+        """
+        out, missing = self.get_many(texts)
+        if missing:
+            # Encode each distinct missing text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(encode_fn(unique), dtype=np.float32)
+            self.put_many(unique, encoded)
+            lookup = dict(zip(unique, encoded))
+            for i in missing:
+                out[i] = lookup[texts[i]]
+            if flush:
+                self.flush()
+        return out
+
+
+def model_identifier(model):
+    """
+    Name of the model behind an encoder, the key that keeps vectors of
+    different models apart.
+
+    Raises:
+        ValueError: The model does not know its name; pass `model_name` explicitly.
+    """
+    # ParallelEmbedder knows its model name
+    if getattr(model, "model_name", None):
+        return model.model_name
+
+    # SentenceTransformer keeps the name it was loaded with in its model card data
+    card = getattr(model, "model_card_data", None)
+    name = getattr(card, "base_model", None) if card is not None else None
+    if name:
+        return name
+
+    # ... or in the config of its transformer module
+    try:
+        name = model[0].auto_model.config._name_or_path
+    except (AttributeError, IndexError, KeyError, TypeError):
+        name = None
+    if name:
+        return name
+    raise ValueError(f"Cannot tell which model this {type(model).__name__} is, pass model_name explicitly")
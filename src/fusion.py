@@ -0,0 +1,150 @@
+import numpy as np
+
+
+def _code_ids(ranked_lists):
+    """
+    Flattens ranked hit lists into integer-coded doc ids.
+
+    Returns:
+        Tuple: per-entry doc codes, per-entry list number, per-entry 1-based rank
+        and the first hit seen for every code.
+    """
+    ids, list_no, ranks, hits = [], [], [], []
+    for n, hit_list in enumerate(ranked_lists):
+        for r, hit in enumerate(hit_list, start=1):
+            ids.append(str(hit["_id"]))
+            list_no.append(n)
+            ranks.append(r)
+            hits.append(hit)
+
+    # np.unique sorts the ids, so a lower code also means a smaller _id (used for tie-breaking)
+    _, first, codes = np.unique(np.array(ids), return_index=True, return_inverse=True)
+    return codes.ravel(), np.array(list_no), np.array(ranks, dtype=np.float64), [hits[i] for i in first]
+
+
+def _weights(ranked_lists, weights):
+    if weights is None:
+        return np.ones(len(ranked_lists))
+    if len(weights) != len(ranked_lists):
+        raise ValueError(f"Got {len(weights)} weights for {len(ranked_lists)} ranked lists")
+    return np.asarray(weights, dtype=np.float64)
+
+
+def _top(scores, unique_hits, limit, codes, list_no, ranks, n_lists):
+    # 1-based rank of every doc in every input list, 0 where it is missing
+    rank_matrix = np.zeros((len(unique_hits), n_lists), dtype=np.int64)
+    rank_matrix[codes, list_no] = ranks
+
+    # Score descending, ties broken by _id ascending (stable across runs)
+    order = np.lexsort((np.arange(len(scores)), -scores))[:limit]
+    fused = []
+    for code in order:
+        hit = unique_hits[code]
+        # Expose the fused score as _score for inspection
+        hit["_score"] = float(scores[code])
+        # Per-retriever ranks (None = not retrieved), used by the rerank cascade
+        hit["_fusion_ranks"] = [int(r) or None for r in rank_matrix[code]]
+        fused.append(hit)
+    return fused
+
+
+def rrf_fuse(ranked_lists, weights=None, k_const=60, limit=25):
+    """
+    Weighted Reciprocal Rank Fusion over any number of ranked hit lists.
+
+    Args:
+        ranked_lists (List[List[dict]]): Elasticsearch hits of every retriever, best first.
+        weights (List[float]): Per-retriever weights, 1.0 each if None.
+        k_const (int): rank_constant (larger = flatter influence).
+        limit (int): Final fused size.
+
+    Returns:
+        List[dict]: Fused hits with the RRF score as `_score` and per-list ranks as `_fusion_ranks`.
+    """
+    if not any(ranked_lists):
+        return []
+    w = _weights(ranked_lists, weights)
+    codes, list_no, ranks, unique_hits = _code_ids(ranked_lists)
+    scores = np.bincount(codes, weights=w[list_no] / (k_const + ranks), minlength=len(unique_hits))
+    return _top(scores, unique_hits, limit, codes, list_no, ranks, len(ranked_lists))
+
+
+def linear_fuse(ranked_lists, weights=None, normalization="minmax", limit=25):
+    """
+    Weighted sum of per-retriever normalised scores (docs missing from a list add 0).
+
+    Args:
+        ranked_lists (List[List[dict]]): Elasticsearch hits of every retriever, with `_score`.
+        weights (List[float]): Per-retriever weights, 1.0 each if None.
+        normalization (str): "minmax" (scores mapped to [0, 1]) or "zscore".
+        limit (int): Final fused size.
+
+    Returns:
+        List[dict]: Fused hits with the combined score as `_score` and per-list ranks as `_fusion_ranks`.
+    """
+    if not any(ranked_lists):
+        return []
+    w = _weights(ranked_lists, weights)
+    codes, list_no, ranks, unique_hits = _code_ids(ranked_lists)
+    raw = np.array([hit["_score"] or 0.0 for hits in ranked_lists for hit in hits], dtype=np.float64)
+
+    # Normalise every list on its own, BM25 and cosine scores live on different scales
+    norm = np.zeros_like(raw)
+    for n in range(len(ranked_lists)):
+        mask = list_no == n
+        if not mask.any():
+            continue
+        s = raw[mask]
+        if normalization == "minmax":
+            spread = s.max() - s.min()
+            norm[mask] = (s - s.min()) / spread if spread else 1.0
+        elif normalization == "zscore":
+            std = s.std()
+            norm[mask] = (s - s.mean()) / std if std else 0.0
+        else:
+            raise ValueError(f"Unknown normalization: {normalization}")
+
+    scores = np.bincount(codes, weights=w[list_no] * norm, minlength=len(unique_hits))
+    return _top(scores, unique_hits, limit, codes, list_no, ranks, len(ranked_lists))
+
+
+def fuse(ranked_lists, method="rrf", **kwargs):
+    # Dispatch to a client-side fusion method by name
+    if method == "rrf":
+        return rrf_fuse(ranked_lists, **kwargs)
+    if method == "linear":
+        return linear_fuse(ranked_lists, **kwargs)
+    raise ValueError(f"Unknown fusion method: {method}")
+
+
+def build_rrf_retriever_body(lexical_query, knn, rank_window_size=100, rank_constant=60, size=25):
+    """
+    Builds a search body that lets Elasticsearch fuse BM25 and kNN with its native
+    `rrf` retriever (Elasticsearch 8.14+). Per-retriever weights are not supported
+    server side, every retriever counts equally.
+
+    Args:
+        lexical_query (dict): Query DSL of the BM25 retriever.
+        knn (dict): kNN section (field, query_vector, k, num_candidates, filter).
+        rank_window_size (int): Hits taken from every retriever.
+        rank_constant (int): RRF rank constant.
+        size (int): Final fused size.
+
+    Returns:
+        dict: The search body.
+    """
+    knn_k = max(knn.get("k", 0), rank_window_size)
+    return {
+        "size": size,
+        "_source": False,
+        "retriever": {
+            "rrf": {
+                "retrievers": [
+                    {"standard": {"query": lexical_query}},
+                    {"knn": dict(knn, k=knn_k, num_candidates=max(knn.get("num_candidates", 0), knn_k))}
+                ],
+                "rank_window_size": rank_window_size,
+                "rank_constant": rank_constant
+            }
+        }
+    }
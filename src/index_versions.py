@@ -0,0 +1,234 @@
+import argparse
+import re
+import time
+from src.backends import get_search_client
+from src.query import index_metadata
+
+# Separates the alias from the model and version parts of an index name
+VERSION_SEPARATOR = "__"
+
+
+def version_name(alias, model_name, timestamp=None):
+    """
+    Names a new index version: "<alias>__<model slug>__<UTC timestamp>".
+
+    Index names must be lowercase and free of / \\ * ? " < > | , # : and spaces,
+    so the model name is reduced to a slug. The timestamp orders the versions
+    of an alias.
+    """
+    slug = re.sub(r"[^a-z0-9_.-]+", "-", model_name.lower()).strip("-_.")
+    timestamp = timestamp or time.strftime("%Y%m%d%H%M%S", time.gmtime())
+    return VERSION_SEPARATOR.join((alias, slug, timestamp))
+
+
+def resolve_alias(es, alias):
+    """
+    Returns:
+        List[str]: Indices the alias points at, empty if `alias` is not an alias.
+    """
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return sorted(es.indices.get_alias(name=alias))
+
+
+def list_versions(es, alias):
+    """
+    Returns:
+        List[str]: Index versions of the alias, oldest first.
+    """
+    # Ordered by the timestamp suffix, the model part differs between versions
+    return sorted(es.indices.get_alias(index=f"{alias}{VERSION_SEPARATOR}*"),
+                  key=lambda name: name.rsplit(VERSION_SEPARATOR, 1)[-1])
+
+
+def current_model(es, alias):
+    # Model recorded in the mapping of the index the alias (or a plain index of that name) points at
+    if not es.indices.exists(index=alias):
+        return None
+    (mapping,) = es.indices.get_mapping(index=alias).values()
+    return mapping["mappings"].get("_meta", {}).get("model")
+
+
+def was_live(es, index):
+    # Set by swap_alias in the mapping of every index it made live
+    (mapping,) = es.indices.get_mapping(index=index).values()
+    return "live_since" in mapping["mappings"].get("_meta", {})
+
+
+def mark_live(es, index):
+    (mapping,) = es.indices.get_mapping(index=index).values()
+    meta = dict(mapping["mappings"].get("_meta", {}))
+    # _meta is replaced as a whole, the model and matryoshka entries are written back
+    meta.setdefault("live_since", time.strftime("%Y%m%d%H%M%S", time.gmtime()))
+    es.indices.put_mapping(index=index, meta=meta)
+
+
+def swap_alias(es, alias, index):
+    """
+    Points `alias` at `index` in one atomic update_aliases call, so searches
+    through the alias never see a missing or half-built index.
+
+    A plain index named like the alias (the layout before versioned indices)
+    is removed in the same call, since an alias cannot share its name. The
+    index is marked as having been live, which garbage collection relies on.
+
+    Returns:
+        List[str]: Indices the alias pointed at before.
+    """
+    previous = resolve_alias(es, alias)
+    actions = []
+    if not previous and es.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions += [{"remove": {"index": old, "alias": alias}} for old in previous if old != index]
+    actions.append({"add": {"index": index, "alias": alias}})
+    es.indices.update_aliases(actions=actions)
+    index_metadata.invalidate(alias)
+    mark_live(es, index)
+    return previous
+
+
+def collect_garbage(es, alias, keep=1):
+    """
+    Deletes old versions of an alias.
+
+    The live version is never deleted. The `keep` newest versions before it
+    that were live themselves are kept for rollback and for processes that
+    still hold the previous resolution of the alias (see
+    IndexMetadataCache.alias_ttl). Versions that never went live (builds that
+    failed, or are still running) are neither counted nor deleted.
+
+    Returns:
+        List[str]: The deleted indices.
+    """
+    live = set(resolve_alias(es, alias))
+    versions = list_versions(es, alias)
+    positions = [i for i, name in enumerate(versions) if name in live]
+    if not positions:
+        return []
+    older = [name for name in versions[:max(positions)] if name not in live and was_live(es, name)]
+    doomed = older[:max(len(older) - keep, 0)]
+    for name in doomed:
+        es.indices.delete(index=name)
+        index_metadata.invalidate(name)
+    return doomed
+
+
+def build_version(model, alias="mlsum_tr_semantic", model_name=None, keep=1, builder=None, es=None,
+                  **index_kwargs):
+    """
+    Builds a new index version next to the live one, then moves the alias to it.
+
+    The alias keeps serving the previous version while the new one is
+    embedded and ingested (run this from a separate process, e.g.
+    `python -m src.index_versions build <model>`). The alias only moves once
+    the new index holds documents with the model's dimensions, a build that
+    fails is deleted; old versions are garbage-collected afterwards.
+
+    Args:
+        model: SentenceTransformer (or ParallelEmbedder) used to embed the corpus.
+        alias (str): Alias the application queries.
+        model_name (str): Model name, part of the index name and cache key.
+        keep (int): Previous versions kept after the swap.
+        builder (Callable): `index_data` (default) or `stream_index_data`.
+        es (Elasticsearch): Client to use, the shared client of $SEARCH_BACKEND if None.
+        **index_kwargs: Extra builder arguments (workers, passages, dims, ...).
+
+    Returns:
+        str: Name of the new live index.
+    """
+    from src.embedding_cache import model_identifier
+    from src.indexing import index_data
+
+    es = es or get_search_client()
+    model_name = model_name or model_identifier(model)
+    index = version_name(alias, model_name)
+    try:
+        (builder or index_data)(model, index_name=index, model_name=model_name, es=es, **index_kwargs)
+
+        # Never point the alias at an empty or mismatched index
+        es.indices.refresh(index=index)
+        docs = es.count(index=index)["count"]
+        if not docs:
+            raise RuntimeError(f"Index '{index}' is empty, the alias '{alias}' was not moved")
+        expected_dims = index_kwargs.get("dims") or model.get_sentence_embedding_dimension()
+        index_metadata.invalidate(index)
+        dims = index_metadata.fetch(es, index)["dims"]
+        if dims != expected_dims:
+            raise RuntimeError(f"Index '{index}' has {dims} dims, expected {expected_dims}; the alias was not moved")
+    except Exception:
+        # A version that will never go live is not left behind
+        if es.indices.exists(index=index):
+            es.indices.delete(index=index)
+            index_metadata.invalidate(index)
+            print(f"🗑️ Deleted failed build '{index}'")
+        raise
+
+    previous = swap_alias(es, alias, index)
+    print(f"✅ '{alias}' -> '{index}' ({docs} docs), was {', '.join(previous) or 'unset'}")
+    deleted = collect_garbage(es, alias, keep)
+    if deleted:
+        print(f"🗑️ Deleted old versions: {', '.join(deleted)}")
+    return index
+
+
+def ensure_index(model, alias="mlsum_tr_semantic", model_name=None, es=None, **index_kwargs):
+    """
+    Reuses the index behind `alias` if it was built with the same model, builds
+    and swaps in a new version otherwise.
+
+    Indices built before the model was recorded in the mapping are reused when
+    their dimensions match the model.
+
+    Returns:
+        Elasticsearch: The client used.
+    """
+    from src.embedding_cache import model_identifier
+
+    es = es or get_search_client()
+    model_name = model_name or model_identifier(model)
+    if es.indices.exists(index=alias):
+        live_model = current_model(es, alias)
+        dims = index_metadata.fetch(es, alias)["dims"]
+        expected_dims = index_kwargs.get("dims") or model.get_sentence_embedding_dimension()
+        if live_model == model_name or (live_model is None and dims == expected_dims):
+            print(f"Data is already indexed for {model_name}")
+            return es
+        print(f"'{alias}' serves {live_model or f'a {dims}-dim model'}, building a version for {model_name}")
+    build_version(model, alias, model_name, es=es, **index_kwargs)
+    return es
+
+
+# Usage:
+#   python -m src.index_versions list [--alias mlsum_tr_semantic]
+#   python -m src.index_versions build jinaai/jina-embeddings-v3 [--workers 4] [--keep 1]
+#   python -m src.index_versions swap <index>        (roll back / forward by hand)
+#   python -m src.index_versions gc [--keep 1]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Versioned indices behind an alias")
+    parser.add_argument("command", choices=("list", "build", "swap", "gc"))
+    parser.add_argument("target", nargs="?", help="Model name (build) or index name (swap)")
+    parser.add_argument("--alias", default="mlsum_tr_semantic")
+    parser.add_argument("--keep", type=int, default=1, help="Previous versions kept by gc")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent bulk workers (build)")
+    args = parser.parse_args()
+
+    es = get_search_client()
+    if args.command == "list":
+        live = set(resolve_alias(es, args.alias))
+        for name in list_versions(es, args.alias):
+            print(f"{'*' if name in live else ' '} {name}")
+    elif args.command == "build":
+        if not args.target:
+            parser.error("build needs a model name")
+        from src.startup import load_embedding_model
+        build_version(
+            load_embedding_model(args.target, trust_remote_code=True), args.alias, args.target,
+            keep=args.keep, es=es, workers=args.workers
+        )
+    elif args.command == "swap":
+        if not args.target:
+            parser.error("swap needs an index name")
+        swap_alias(es, args.alias, args.target)
+        print(f"'{args.alias}' -> '{args.target}'")
+    else:
+        print(f"Deleted: {', '.join(collect_garbage(es, args.alias, args.keep)) or 'nothing'}")
@@ -1,83 +1,483 @@
+import json
+import os
+import queue
+import threading
 from elasticsearch.helpers import streaming_bulk
-from elasticsearch import Elasticsearch
-from datasets import load_dataset
 from tqdm import tqdm
-from scripts.date_formatter import format_month_year
+from scripts.date_formatter import format_month_year, parse_month_year
+from src.backends import get_search_client, is_local
+from src.embedder import truncate_dims
+from src.embedding_cache import EmbeddingCache, model_identifier
+from src.ingest import parallel_ingest
+from src.passages import model_tokenizer, passage_id, split_passages
 
-def index_data(model, index_name="mlsum_tr_semantic"):
-    # Connect to Elasticsearch
-    es = Elasticsearch("http://localhost:9200")
+# MLSUM Turkish splits indexed by the streaming indexer
+SPLITS = ("train", "validation", "test")
+
+
+def create_index(es, index_name, dims, passages=False, index_options=None, truncated_dims=None, model_name=None):
+    properties = {
+        "text": {"type": "text"},
+        "summary": {"type": "text"},
+        "title": {"type": "text"},
+        "date": {"type": "text"}, # Ocak 2024 # date_string custom field # 00/01/2010
+        "year": {"type": "short"}, # 2024, used as a filter
+        "month": {"type": "byte"}, # 1-12, used as a filter
+        "embedding": {
+            "type": "dense_vector",
+            "dims": dims, # index reload
+            "index": True,
+            "similarity": "cosine"
+        }
+    }
+    if index_options:
+        # Quantized HNSW, e.g. {"type": "int8_hnsw"} (ES 8.12+) or {"type": "bbq_hnsw"} (ES 8.16+)
+        properties["embedding"]["index_options"] = index_options
+    if passages:
+        # Passage documents point back to their article
+        properties.update({
+            "parent_id": {"type": "keyword"},
+            "passage_no": {"type": "integer"},
+            "passage": {"type": "text"}
+        })
+
+    mappings = {"properties": properties}
+    meta = {}
+    if truncated_dims:
+        # Tells the query path to truncate prompt embeddings the same way
+        meta["matryoshka_dims"] = truncated_dims
+    if model_name:
+        # Which model the vectors come from, checked before an index version is reused
+        meta["model"] = model_name
+    if meta:
+        mappings["_meta"] = meta
+
+    # Create the index with appropriate mappings
+    es.indices.create(
+        index=index_name,
+        body={"mappings": mappings},
+        request_timeout=60
+    )
+
+
+def open_embedding_cache(model, cache_dir, model_name=None):
+    # Embeddings are read from the on-disk cache, only new texts are encoded
+    if not cache_dir:
+        return None
+    return EmbeddingCache(
+        model_name or model_identifier(model),
+        model.get_sentence_embedding_dimension(),
+        cache_dir=cache_dir
+    )
+
+
+def embed_texts(model, texts, cache=None, batch_size=64, dims=None):
+    # The cache keeps full vectors, truncation happens on the way out
+    if cache is not None:
+        embeddings = cache.encode(texts, lambda missing: model.encode(missing, batch_size=batch_size), flush=False)
+    else:
+        embeddings = model.encode(texts, batch_size=batch_size)
+    return truncate_dims(embeddings, dims).tolist()
+
+
+def article_units(row, _id, passages=None):
+    """
+    Turns an MLSUM row into the documents to index.
+
+    Args:
+        row (dict): MLSUM row (text, summary, title, date).
+        _id: Article id.
+        passages (dict): Passage options (max_tokens, stride, tokenizer), None to index whole articles.
+
+    Returns:
+        List[Tuple[str, dict, str]]: (document id, _source without embedding, text to embed).
+    """
+    month, year = parse_month_year(row["date"])
+    metadata = {
+        "summary": row["summary"],
+        "title": row["title"],
+        "date": format_month_year(row["date"]),
+        "year": year,
+        "month": month
+    }
+    if passages is None:
+        return [(str(_id), dict(metadata, text=row["text"]), f"{row['title']} {row['summary']}")]
+
+    # An article without a body still gets one passage, its summary (embedded with the title like every passage)
+    texts = split_passages(row["text"], **passages) or [row["summary"]]
+    return [
+        (passage_id(_id, n), dict(metadata, parent_id=str(_id), passage_no=n, passage=passage), f"{row['title']} {passage}")
+        for n, passage in enumerate(texts)
+    ]
+
+
+def build_document(index_name, _id, source, embedding):
+    return {
+        "_index": index_name,
+        "_id": _id,
+        "_source": dict(source, embedding=embedding)
+    }
+
+
+def print_ingest_stats(stats):
+    print(
+        f"⏱️ {stats['docs']} docs in {stats['seconds']:.1f}s "
+        f"({stats['docs_per_s']:.0f} docs/s, {stats['mb_per_s']:.1f} MB/s)"
+    )
+
+
+def index_data(model, index_name="mlsum_tr_semantic", cache_dir=".embedding_cache", model_name=None,
+               workers=None, max_chunk_bytes=8 * 1024 * 1024, force_merge=False, encode_chunk_size=64,
+               passages=False, passage_tokens=128, passage_stride=32, dims=None, index_options=None, es=None):
+    # Connect to the search backend (Elasticsearch unless $SEARCH_BACKEND says otherwise)
+    es = es or get_search_client()
 
     # Check if the index already exists
     if es.indices.exists(index=index_name):
         print("Data is already indexed")
     else:
-        # Create the index with appropriate mappings
-        es.indices.create(
-            index=index_name,
-            body={
-                "mappings": {
-                    "properties": {
-                        "text": {"type": "text"},
-                        "summary": {"type": "text"},
-                        "title": {"type": "text"},
-                        "date": {"type": "text"}, # Ocak 2024 # date_string custom field # 00/01/2010
-                        "embedding": {
-                            "type": "dense_vector",
-                            "dims": model.get_sentence_embedding_dimension(), # index reload
-                            "index": True,
-                        "similarity": "cosine"
-                    }
-                    }
-                }
-            },
-            request_timeout=60
+        create_index(
+            es, index_name, dims or model.get_sentence_embedding_dimension(),
+            passages=passages, index_options=index_options, truncated_dims=dims,
+            model_name=model_name or model_identifier(model)
         )
 
-        # Load the Turkish portion of the MLSUM dataset
+        # Load the Turkish portion of the MLSUM dataset (datasets is imported only when indexing)
+        from datasets import load_dataset
         dataset = load_dataset(
             "mlsum", "tu", split="train[:5%]", trust_remote_code=True)
 
-        # Generate embeddings for each entry
-        def batched_embed(batch):
-            texts = [
-                f"{title} {summary}"
-                for title, summary in zip(batch["title"], batch["summary"])
-            ]
-            embeddings = model.encode(texts, batch_size=64).tolist()
-            
-            return {"embedding": embeddings}
-        
+        cache = open_embedding_cache(model, cache_dir, model_name)
+        passage_options = {
+            "max_tokens": passage_tokens, "stride": passage_stride, "tokenizer": model_tokenizer(model)
+        } if passages else None
 
+        # Generate embeddings for each entry (or each passage of it)
+        def batched_embed(batch, indices):
+            rows = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+            units = [unit for row, idx in zip(rows, indices) for unit in article_units(row, idx, passage_options)]
+            embeddings = embed_texts(model, [text for _, _, text in units], cache, dims=dims)
 
-        dataset = dataset.map(batched_embed, batched=True, batch_size=64, load_from_cache_file=False)
+            return {
+                "doc_id": [doc_id for doc_id, _, _ in units],
+                "source": [source for _, source, _ in units],
+                "embedding": embeddings
+            }
+
+
+
+        # Larger chunks keep every process of a ParallelEmbedder busy
+        dataset = dataset.map(
+            batched_embed, batched=True, with_indices=True, batch_size=encode_chunk_size,
+            remove_columns=dataset.column_names, load_from_cache_file=False
+        )
+        if cache is not None:
+            cache.flush()
 
         def doc_generator(dataset, index_name):
-            for idx, row in enumerate(dataset):
-                yield {
-                    "_index": index_name,
-                    "_id": idx,
-                    "_source": {
-                        "text": row["text"],
-                        "summary": row["summary"],
-                        "title": row["title"],
-                        "date": format_month_year(row["date"]),
-                        "embedding": row["embedding"]
-                    }
-                }
+            for row in dataset:
+                yield build_document(index_name, row["doc_id"], row["source"], row["embedding"])
 
         es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1"}})
 
         # Stream and monitor status
         success_count = 0
-        for ok, response in tqdm(streaming_bulk(es, doc_generator(dataset, index_name), chunk_size=500)):
-            if not ok:
-                print("❌ Failed to index document:", response)
-            else:
-                success_count += 1
+        if workers or is_local(es):
+            # Concurrent, byte-sized bulk requests
+            with tqdm(total=len(dataset), unit="doc") as progress:
+                stats = parallel_ingest(
+                    es, doc_generator(dataset, index_name), index_name=index_name, workers=workers or 1,
+                    max_chunk_bytes=max_chunk_bytes, force_merge=force_merge, progress=progress
+                )
+            success_count = stats["docs"]
+            print_ingest_stats(stats)
+        else:
+            for ok, response in tqdm(streaming_bulk(es, doc_generator(dataset, index_name), chunk_size=500)):
+                if not ok:
+                    print("❌ Failed to index document:", response)
+                else:
+                    success_count += 1
 
         es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "1s"}})
         print(f"✅ Indexed {success_count} documents successfully.")
 
     return es
-    
\ No newline at end of file
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    # Write atomically so a crash never leaves a half-written checkpoint
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+class _AckTracker:
+    """
+    Orders acknowledgements of concurrently uploaded bulk chunks.
+
+    Batch boundaries are marked with their position in the action stream;
+    a mark is committed once every document before it has been acknowledged,
+    so a checkpoint never covers a document still in flight or failed.
+    """
+
+    def __init__(self, commit):
+        self.commit = commit
+        self.acknowledged = 0
+        self._chunks = {}
+        self._marks = []
+        self._lock = threading.Lock()
+
+    def mark(self, position, mark):
+        with self._lock:
+            self._marks.append((position, mark))
+            self._advance()
+
+    def ack(self, first, docs, failed):
+        if failed:
+            for item in failed[:10]:
+                print("❌ Failed to index document:", item)
+            raise RuntimeError(f"{len(failed)} documents failed to index, rerun to resume from the last checkpoint")
+        with self._lock:
+            self._chunks[first] = docs
+            # Chunks finish out of order, only the contiguous acknowledged prefix counts
+            while self.acknowledged in self._chunks:
+                self.acknowledged += self._chunks.pop(self.acknowledged)
+            self._advance()
+
+    def _advance(self):
+        while self._marks and self._marks[0][0] <= self.acknowledged:
+            self.commit(*self._marks.pop(0)[1])
+
+
+def stream_index_data(model, index_name="mlsum_tr_semantic", splits=SPLITS, batch_size=256, queue_size=4,
+                      checkpoint_path=None, cache_dir=".embedding_cache", model_name=None, es=None,
+                      workers=None, max_chunk_bytes=8 * 1024 * 1024, force_merge=False,
+                      passages=False, passage_tokens=128, passage_stride=32, dims=None, index_options=None,
+                      recreate=False, resume=False):
+    """
+    Streams the MLSUM Turkish splits into Elasticsearch with constant memory.
+
+    An encoder thread reads each split in batches and embeds them while the
+    calling thread uploads the previous batch; a bounded queue between the two
+    stages keeps at most `queue_size` encoded batches in memory. Once every
+    document of a batch is acknowledged the last committed `_id` is written to
+    a checkpoint, so an interrupted run resumes where it stopped.
+
+    An existing index without a checkpoint was not written by this function
+    (or its checkpoint was lost), so its document ids may differ from the
+    "<split>-<row>" ids streamed here and re-indexing would duplicate them;
+    it is only touched when `recreate` or `resume` says how.
+
+    Args:
+        model: SentenceTransformer (or ParallelEmbedder) used to embed "title summary".
+        index_name (str): Target index.
+        splits (Tuple[str]): MLSUM splits to index, in order.
+        batch_size (int): Number of articles per encode/upload batch.
+        queue_size (int): Maximum number of encoded batches waiting for upload.
+        checkpoint_path (str): Checkpoint file, defaults to .checkpoints/<index_name>.json.
+        cache_dir (str): Embedding cache directory, None to disable the cache.
+        model_name (str): Embedding model name used as the cache key.
+        es (Elasticsearch): Client to use, the shared client of $SEARCH_BACKEND if None.
+        workers (int): Concurrent bulk workers shared by the whole stream, None for a single streaming_bulk.
+        max_chunk_bytes (int): Upper bound of a bulk request body when `workers` is set.
+        force_merge (bool): Force-merge the index once all splits are indexed.
+        passages (bool): Index overlapping passages (with a parent id) instead of whole articles.
+        passage_tokens (int): Maximum tokens per passage.
+        passage_stride (int): Tokens shared by consecutive passages.
+        dims (int): Matryoshka truncation of the embeddings, full model dimension if None.
+        index_options (dict): dense_vector index_options, e.g. {"type": "int8_hnsw"}.
+        recreate (bool): Delete an existing index (and its checkpoint) and index from scratch.
+        resume (bool): Stream into an existing index that has no checkpoint, from the first row.
+
+    Returns:
+        Elasticsearch: The client used for indexing.
+
+    Raises:
+        RuntimeError: The index exists without a checkpoint and neither `recreate` nor `resume` is set.
+    """
+    es = es or get_search_client()
+    checkpoint_path = checkpoint_path or os.path.join(".checkpoints", f"{index_name}.json")
+    has_checkpoint = os.path.exists(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    if recreate and es.indices.exists(index=index_name):
+        print(f"Deleting index '{index_name}' to index it from scratch")
+        es.indices.delete(index=index_name)
+    if not es.indices.exists(index=index_name):
+        # A checkpoint of a deleted index is meaningless
+        create_index(
+            es, index_name, dims or model.get_sentence_embedding_dimension(),
+            passages=passages, index_options=index_options, truncated_dims=dims,
+            model_name=model_name or model_identifier(model)
+        )
+        # Written right away, so a crash before the first batch still reads as unfinished
+        checkpoint = {"completed_splits": []}
+        save_checkpoint(checkpoint_path, checkpoint)
+    elif not has_checkpoint and not resume:
+        raise RuntimeError(
+            f"Index '{index_name}' exists but has no checkpoint at {checkpoint_path}; "
+            "pass recreate=True to rebuild it or resume=True to stream into it from the start"
+        )
+    elif checkpoint.get("done"):
+        print("Data is already indexed")
+        return es
+    else:
+        # Unfinished checkpoint: resume (document ids are deterministic, re-sent batches overwrite)
+        print(f"Resuming unfinished index '{index_name}' from {checkpoint.get('last_id') or 'the start'}")
+
+    checkpoint.setdefault("completed_splits", [])
+    cache = open_embedding_cache(model, cache_dir, model_name)
+    passage_options = {
+        "max_tokens": passage_tokens, "stride": passage_stride, "tokenizer": model_tokenizer(model)
+    } if passages else None
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Block while the uploader is behind, but give up once it has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def encode_stage():
+        try:
+            from datasets import load_dataset
+            for split in splits:
+                if split in checkpoint["completed_splits"]:
+                    continue
+                offset = checkpoint.get("offset", 0) if checkpoint.get("split") == split else 0
+
+                dataset = load_dataset("mlsum", "tu", split=split, streaming=True, trust_remote_code=True)
+                if offset:
+                    dataset = dataset.skip(offset)
+
+                rows = []
+                for row in dataset:
+                    if stop.is_set():
+                        return
+                    rows.append(row)
+                    if len(rows) == batch_size:
+                        # The offset sent along is the first row after this batch
+                        put(("batch", split, offset + len(rows), encode_rows(rows, offset, split)))
+                        offset += len(rows)
+                        rows = []
+                if rows:
+                    put(("batch", split, offset + len(rows), encode_rows(rows, offset, split)))
+                    offset += len(rows)
+                put(("split_done", split, offset, None))
+            put(("done", None, None, None))
+        except Exception as e:
+            put(("error", None, None, e))
+
+    def encode_rows(rows, offset, split):
+        units = [
+            unit for i, row in enumerate(rows)
+            for unit in article_units(row, f"{split}-{offset + i}", passage_options)
+        ]
+        embeddings = embed_texts(model, [text for _, _, text in units], cache, dims=dims)
+        if cache is not None:
+            cache.flush()
+        return [
+            build_document(index_name, doc_id, source, embedding)
+            for (doc_id, source, _), embedding in zip(units, embeddings)
+        ]
+
+    encoder = threading.Thread(target=encode_stage, name="mlsum-encoder", daemon=True)
+    es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1"}})
+    encoder.start()
+
+    success_count = 0
+    ingest_seconds, ingest_bytes = 0.0, 0
+    progress = tqdm(unit="doc")
+
+    def commit(kind, split, offset, last_id):
+        if kind == "done":
+            checkpoint["done"] = True
+        elif kind == "split_done":
+            checkpoint["completed_splits"].append(split)
+            checkpoint.update({"split": None, "offset": 0})
+        else:
+            checkpoint.update({"split": split, "offset": offset})
+            if last_id is not None:
+                checkpoint["last_id"] = last_id
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    try:
+        if workers or is_local(es):
+            # One worker pool for the whole stream, batches are checkpointed once all their chunks are acknowledged
+            tracker = _AckTracker(commit)
+
+            def actions():
+                position = 0
+                while True:
+                    kind, split, offset, payload = batches.get()
+                    if kind == "error":
+                        raise payload
+                    if kind == "batch":
+                        yield from payload
+                        position += len(payload)
+                    tracker.mark(position, (kind, split, offset, payload[-1]["_id"] if payload else None))
+                    if kind == "done":
+                        return
+
+            stats = parallel_ingest(
+                es, actions(), workers=workers or 1, max_chunk_bytes=max_chunk_bytes,
+                on_chunk=tracker.ack, progress=progress
+            )
+            success_count, ingest_seconds, ingest_bytes = stats["docs"], stats["seconds"], stats["bytes"]
+        else:
+            while True:
+                kind, split, offset, payload = batches.get()
+                if kind == "error":
+                    raise payload
+                if kind != "batch":
+                    commit(kind, split, offset, None)
+                    if kind == "done":
+                        break
+                    continue
+
+                # Upload the batch, failed documents stop the run before the checkpoint moves past them
+                failed = 0
+                for ok, response in streaming_bulk(es, payload, chunk_size=len(payload), raise_on_error=False,
+                                                   max_retries=5):
+                    if not ok:
+                        print("❌ Failed to index document:", response)
+                        failed += 1
+                    else:
+                        success_count += 1
+                if failed:
+                    raise RuntimeError(
+                        f"{failed} documents of {split} before offset {offset} failed to index, "
+                        f"rerun to resume from {checkpoint.get('last_id') or 'the start'}"
+                    )
+                progress.update(len(payload))
+                commit(kind, split, offset, payload[-1]["_id"] if payload else None)
+    finally:
+        stop.set()
+        progress.close()
+        es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "1s"}})
+
+    es.indices.refresh(index=index_name)
+    if force_merge:
+        es.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=3600)
+    if workers and ingest_seconds:
+        print_ingest_stats({
+            "docs": success_count,
+            "seconds": ingest_seconds,
+            "docs_per_s": success_count / ingest_seconds,
+            "mb_per_s": ingest_bytes / (1024 * 1024) / ingest_seconds,
+        })
+    print(f"✅ Indexed {success_count} documents successfully.")
+    return es
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import ApiError
+
+
+def serialize_action(action):
+    # Turn a streaming_bulk style action into the two NDJSON lines of a bulk request
+    header = {"index": {"_index": action["_index"], "_id": action["_id"]}}
+    return [
+        json.dumps(header, ensure_ascii=False).encode("utf-8"),
+        json.dumps(action["_source"], ensure_ascii=False).encode("utf-8"),
+    ]
+
+
+def chunk_by_bytes(actions, max_chunk_bytes=8 * 1024 * 1024, max_chunk_docs=5000):
+    """
+    Groups actions into bulk chunks bounded by request size instead of doc count.
+
+    Yields:
+        Tuple[List[bytes], int]: The NDJSON lines of a chunk and its size in bytes.
+    """
+    lines, size, docs = [], 0, 0
+    for action in actions:
+        action_lines = serialize_action(action)
+        action_size = sum(len(line) + 1 for line in action_lines)
+        if docs and (size + action_size > max_chunk_bytes or docs >= max_chunk_docs):
+            yield lines, size
+            lines, size, docs = [], 0, 0
+        lines.extend(action_lines)
+        size += action_size
+        docs += 1
+    if lines:
+        yield lines, size
+
+
+def send_chunk(es, lines, max_retries=5, initial_backoff=1.0, max_backoff=30.0):
+    """
+    Sends one bulk chunk, retrying rejected (429) documents with exponential backoff.
+
+    Returns:
+        Tuple[int, List[dict]]: Number of indexed documents and the failed items.
+    """
+    indexed, failed = 0, []
+    backoff = initial_backoff
+    for attempt in range(max_retries + 1):
+        try:
+            resp = es.bulk(operations=lines)
+        except ApiError as e:
+            # The whole request was rejected by a full write queue
+            if e.meta.status != 429 or attempt == max_retries:
+                raise
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+            continue
+
+        retry = []
+        for i, item in enumerate(resp["items"]):
+            result = next(iter(item.values()))
+            if result.get("status") == 429 and attempt < max_retries:
+                retry.extend(lines[2 * i:2 * i + 2])
+            elif "error" in result:
+                failed.append(result)
+            else:
+                indexed += 1
+        if not retry:
+            break
+        lines = retry
+        time.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
+
+    return indexed, failed
+
+
+def parallel_ingest(es, actions, index_name=None, workers=4, max_chunk_bytes=8 * 1024 * 1024,
+                    max_chunk_docs=5000, max_in_flight=None, max_retries=5, initial_backoff=1.0,
+                    refresh=True, force_merge=False, progress=None, on_chunk=None):
+    """
+    Uploads actions with N concurrent bulk workers.
+
+    Chunks are sized by bytes, at most `max_in_flight` chunks are serialized
+    or in flight at a time (backpressure on the action generator), and rejected
+    documents are retried with exponential backoff. When `index_name` is given
+    the index is refreshed (and optionally force-merged) at the end.
+
+    Args:
+        es (Elasticsearch): Client shared by the workers.
+        actions (Iterable[dict]): streaming_bulk style actions with _index, _id and _source.
+        index_name (str): Index to refresh/force-merge after the upload.
+        workers (int): Number of concurrent bulk requests.
+        max_chunk_bytes (int): Upper bound of a bulk request body.
+        max_chunk_docs (int): Upper bound of documents per bulk request.
+        max_in_flight (int): Chunks allowed in flight, defaults to 2 * workers.
+        max_retries (int): Retries of 429 rejections per chunk.
+        initial_backoff (float): First retry delay in seconds, doubled on each retry.
+        refresh (bool): Refresh the index when done.
+        force_merge (bool): Force-merge the index to one segment when done.
+        progress (tqdm): Optional progress bar, updated with indexed documents.
+        on_chunk (Callable[[int, int, List[dict]], None]): Called from the worker after every chunk with
+            the position of its first action in `actions`, its number of actions and its failed items;
+            an exception raised by it aborts the upload.
+
+    Returns:
+        dict: Indexed/failed counts, payload bytes, elapsed seconds, docs/s and MB/s.
+    """
+    slots = threading.BoundedSemaphore(max_in_flight or 2 * workers)
+    lock = threading.Lock()
+    stats = {"docs": 0, "failed": 0, "bytes": 0}
+    failures = []
+
+    def upload(first, lines, size):
+        try:
+            indexed, failed = send_chunk(es, lines, max_retries=max_retries, initial_backoff=initial_backoff)
+            with lock:
+                stats["docs"] += indexed
+                stats["failed"] += len(failed)
+                stats["bytes"] += size
+                failures.extend(failed[:10])
+            if progress is not None:
+                progress.update(indexed)
+            if on_chunk is not None:
+                on_chunk(first, len(lines) // 2, failed)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    futures = []
+    first = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk") as pool:
+        for lines, size in chunk_by_bytes(actions, max_chunk_bytes, max_chunk_docs):
+            slots.acquire()
+            futures.append(pool.submit(upload, first, lines, size))
+            first += len(lines) // 2
+            # Surface worker errors early and drop finished futures
+            pending = []
+            for f in futures:
+                if f.done():
+                    f.result()
+                else:
+                    pending.append(f)
+            futures = pending
+        for f in futures:
+            f.result()
+    elapsed = time.perf_counter() - start
+
+    if index_name:
+        if refresh:
+            es.indices.refresh(index=index_name)
+        if force_merge:
+            es.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=3600)
+
+    for failure in failures:
+        print("❌ Failed to index document:", failure)
+
+    stats["seconds"] = elapsed
+    stats["docs_per_s"] = stats["docs"] / elapsed if elapsed else 0.0
+    stats["mb_per_s"] = stats["bytes"] / (1024 * 1024) / elapsed if elapsed else 0.0
+    return stats
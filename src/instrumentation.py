@@ -0,0 +1,287 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# Histogram buckets (upper bounds) of durations in seconds, payload sizes in bytes (or tokens) and plain counts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Enclosing span of the current thread / task, for parent links and trace ids
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Exporter:
+    """
+    Receives the instrumentation events. Subclasses override the three hooks;
+    `enabled = False` lets the module-level helpers skip all work.
+    """
+
+    enabled = True
+
+    def span(self, name, seconds, parent, trace_id, attributes):
+        pass
+
+    def count(self, name, value, labels):
+        pass
+
+    def observe(self, name, value, labels):
+        pass
+
+
+class NoopExporter(Exporter):
+    # Default: every helper returns before reading a clock or allocating
+    enabled = False
+
+
+class JSONLogExporter(Exporter):
+    """Writes one JSON line per event, e.g. to stderr or a log file collected by the log shipper."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def _write(self, event):
+        line = json.dumps(dict(event, ts=time.time()), ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def span(self, name, seconds, parent, trace_id, attributes):
+        self._write({
+            "type": "span", "name": name, "ms": round(seconds * 1000, 3),
+            "parent": parent, "trace_id": trace_id, **attributes
+        })
+
+    def count(self, name, value, labels):
+        self._write({"type": "counter", "name": name, "value": value, **labels})
+
+    def observe(self, name, value, labels):
+        self._write({"type": "histogram", "name": name, "value": value, **labels})
+
+
+def histogram_buckets(name):
+    if name.endswith("_seconds"):
+        return LATENCY_BUCKETS
+    if name.endswith("_bytes") or name.endswith("_tokens"):
+        return SIZE_BUCKETS
+    return COUNT_BUCKETS
+
+
+class PrometheusExporter(Exporter):
+    """
+    Aggregates counters and histograms in memory and renders them in the
+    Prometheus text exposition format. Spans are recorded as the
+    `<span>_seconds` latency histogram. Serve `render()` from an HTTP handler
+    or start the standalone endpoint with `serve`.
+    """
+
+    def __init__(self, namespace="rag"):
+        self.namespace = namespace
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def span(self, name, seconds, parent, trace_id, attributes):
+        self.observe(f"{name}_seconds", seconds, {})
+
+    def count(self, name, value, labels):
+        key = self._key(f"{name}_total", labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = self._key(name, labels)
+        buckets = histogram_buckets(name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "n": 0}
+            i = bisect_left(buckets, value)
+            if i < len(buckets):
+                histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["n"] += 1
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(h, counts=list(h["counts"]))) for key, h in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            name = self._name(name)
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            name = self._name(name)
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram['n']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['n']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="0.0.0.0"):
+        # Minimal /metrics endpoint on a daemon thread
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_exporter = NoopExporter()
+
+
+def set_exporter(exporter):
+    global _exporter
+    _exporter = exporter or NoopExporter()
+    return _exporter
+
+
+def get_exporter():
+    return _exporter
+
+
+def configure_from_env():
+    """
+    Selects the exporter from $INSTRUMENTATION ("prometheus", "json" or unset
+    for no-op). With "prometheus", $METRICS_PORT starts a standalone /metrics
+    endpoint.
+    """
+    backend = os.environ.get("INSTRUMENTATION", "").lower()
+    if backend == "prometheus":
+        exporter = PrometheusExporter()
+        if os.environ.get("METRICS_PORT"):
+            exporter.serve(int(os.environ["METRICS_PORT"]))
+        return set_exporter(exporter)
+    if backend == "json":
+        return set_exporter(JSONLogExporter())
+    if backend not in ("", "none", "noop"):
+        raise ValueError(f"Unknown instrumentation backend: {backend}")
+    return set_exporter(NoopExporter())
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "trace_id", "parent", "start", "_token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent = parent.name if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _exporter.span(self.name, seconds, self.parent, self.trace_id, self.attributes)
+        return False
+
+    def set(self, **attributes):
+        # Attributes known only inside the span (e.g. hit counts)
+        self.attributes.update(attributes)
+
+
+def span(name, **attributes):
+    """
+    Times a block: `with span("lexical_search", index=index) as s: ...`.
+
+    Spans opened inside another span (same thread or task) share its trace id
+    and name it as their parent.
+    """
+    if not _exporter.enabled:
+        return _NOOP_SPAN
+    return _Span(name, attributes)
+
+
+def traced(name=None):
+    # Decorator form of span, named after the function by default
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _exporter.enabled:
+                return fn(*args, **kwargs)
+            with _Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    if _exporter.enabled:
+        _exporter.count(name, value, labels)
+
+
+def observe(name, value, **labels):
+    # Histogram sample, bucketed by the name's unit suffix ("_seconds", "_bytes"/"_tokens", else counts)
+    if _exporter.enabled:
+        _exporter.observe(name, value, labels)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from src.instrumentation import count, observe, span
+
+# The hosted RAG LLM (POST /ask {"prompt": ...} -> {"answer": ...})
+DEFAULT_LLM_URL = "https://ilbeygulmez-mlsum-rag-llm.hf.space"
+
+
+def _chunk_text(data):
+    # A streamed event is either raw text or a JSON object carrying the text under one of the usual keys;
+    # only objects are decoded, so text chunks like "2024" or "true" stay text and skip the parser
+    if not data.startswith("{"):
+        return data
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return data
+    if isinstance(payload, dict):
+        return payload.get("token") or payload.get("text") or payload.get("answer") or ""
+    return data
+
+
+class _Flight:
+    """One upstream generation, shared by every caller that asked the same prompt while it ran."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        # Guarded by the client's lock: callers following the flight, and whether upstream began or was called off
+        self.followers = 0
+        self.started = False
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def start(self):
+        with self._cond:
+            self.started = True
+            self._cond.notify_all()
+
+    def push(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self, timeout, queue_timeout=None):
+        # Replays the chunks received so far, then waits for the next ones
+        position = 0
+        while True:
+            with self._cond:
+                # Waiting for a free upstream slot is queueing, the read timeout starts with the upstream call
+                if not self._cond.wait_for(lambda: self.started or self.done, queue_timeout):
+                    raise TimeoutError(f"No free LLM slot within {queue_timeout}s")
+                if not self._cond.wait_for(lambda: len(self.chunks) > position or self.done, timeout):
+                    raise TimeoutError(f"No LLM output for {timeout}s")
+                new = self.chunks[position:]
+                finished, error = self.done, self.error
+            position += len(new)
+            yield from new
+            if finished and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMClient:
+    """
+    LLMClient calls the RAG LLM endpoint over a pooled HTTP session.
+
+    - Answers are streamed: `stream` yields text chunks as the endpoint sends
+      them (server-sent events or NDJSON); an endpoint answering with plain
+      JSON yields the whole answer as one chunk.
+    - Identical prompts asked while a generation is in flight are coalesced
+      into that one upstream call (single-flight per prompt key); every caller
+      receives the full chunk sequence.
+    - Upstream calls run on a pool of `max_concurrency` threads, further calls
+      queue instead of hitting the endpoint.
+
+    Attributes:
+        base_url (str): Endpoint root, "/ask" is appended.
+        upstream_calls (int): Requests sent to the endpoint.
+        coalesced (int): Calls served by an in-flight generation of the same prompt.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_LLM_URL, max_concurrency: int = 4, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, pool_size: int = None, queue_timeout: float = None):
+        """
+        Args:
+            base_url (str): Endpoint root.
+            max_concurrency (int): Maximum number of simultaneous upstream calls.
+            connect_timeout (float): Seconds to establish a connection.
+            read_timeout (float): Maximum seconds between two chunks of an answer.
+            pool_size (int): Kept-alive connections, defaults to max_concurrency.
+            queue_timeout (float): Maximum seconds to wait for a free upstream slot, unbounded if None.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.queue_timeout = queue_timeout
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def _upstream(self, prompt):
+        with self.session.post(
+            f"{self.base_url}/ask", json={"prompt": prompt, "stream": True}, stream=True, timeout=self.timeout
+        ) as res:
+            res.raise_for_status()
+            content_type = res.headers.get("Content-Type", "")
+            if "charset" not in content_type:
+                # requests falls back to ISO-8859-1 for text/* without a charset, the endpoint speaks UTF-8
+                res.encoding = "utf-8"
+            if "text/event-stream" in content_type:
+                for line in res.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    # One optional space follows the field name, anything after it (leading blanks included) is text
+                    data = line[len("data:"):]
+                    if data.startswith(" "):
+                        data = data[1:]
+                    if data == "[DONE]":
+                        break
+                    yield _chunk_text(data)
+            elif "ndjson" in content_type:
+                for line in res.iter_lines(decode_unicode=True):
+                    if line:
+                        yield _chunk_text(line)
+            else:
+                # Non-streaming endpoint, the whole answer arrives at once
+                yield res.json().get("answer") or ""
+
+    def _run(self, key, prompt, flight):
+        with self._lock:
+            # Every caller left while the flight was queued, nobody would read the answer
+            if flight.cancelled:
+                return
+            self.upstream_calls += 1
+            flight.start()
+        start = time.perf_counter()
+        size = 0
+        try:
+            with span("llm_upstream", prompt_bytes=len(prompt.encode("utf-8"))):
+                for chunk in self._upstream(prompt):
+                    if chunk:
+                        if not size:
+                            observe("llm_ttft_seconds", time.perf_counter() - start)
+                        size += len(chunk.encode("utf-8"))
+                        flight.push(chunk)
+            observe("llm_response_bytes", size)
+            flight.finish()
+        except Exception as e:
+            count("llm_errors", error=type(e).__name__)
+            flight.finish(e)
+        finally:
+            self._forget(key, flight)
+
+    def _forget(self, key, flight):
+        # A newer flight may already serve the key
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key, flight):
+        with self._lock:
+            flight.followers -= 1
+            if flight.followers or flight.started:
+                return
+            flight.cancelled = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        count("llm_cancelled")
+
+    def stream(self, prompt, key=None):
+        """
+        Streams the answer to a prompt.
+
+        Args:
+            prompt (str): Full prompt sent to the LLM.
+            key (str): Single-flight key, e.g. the context builder's cache key; the prompt's hash if None.
+
+        Yields:
+            str: Answer chunks in order.
+
+        Raises:
+            requests.RequestException: The upstream call failed.
+            TimeoutError: No chunk arrived within the read timeout of the upstream call (time spent
+                queueing for an upstream slot does not count), or no slot freed up within `queue_timeout`.
+                A flight every caller left before it reached the endpoint is cancelled.
+        """
+        key = key or self.key(prompt)
+        with self._lock:
+            flight = self._flights.get(key)
+            coalesced = flight is not None
+            if not coalesced:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._pool.submit(self._run, key, prompt, flight)
+            else:
+                self.coalesced += 1
+            flight.followers += 1
+        count("llm_requests", coalesced=coalesced)
+        try:
+            yield from flight.follow(self.timeout[1], self.queue_timeout)
+        finally:
+            self._leave(key, flight)
+
+    def ask(self, prompt, key=None):
+        # Blocking variant of stream, returns the full answer
+        return "".join(self.stream(prompt, key))
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
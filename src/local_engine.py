@@ -0,0 +1,674 @@
+import fnmatch
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+import numpy as np
+from src.fusion import rrf_fuse
+from src.text import analyze
+
+_FIELD_BOOST = re.compile(r"^(.+?)(?:\^([\d.]+))?$")
+
+# Alias -> index map, stored next to the index directories
+ALIASES_FILE = "aliases.json"
+
+# Types whose values are matched exactly by term filters
+_EXACT_TYPES = {"keyword", "short", "byte", "integer", "long", "boolean", "date"}
+
+
+class _InvertedField:
+    """BM25 postings of one text field (Lucene defaults: k1=1.2, b=0.75)."""
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(texts)
+        self.lengths = np.zeros(self.n_docs, dtype=np.float32)
+        postings = {}
+        for row, text in enumerate(texts):
+            tokens = analyze(text)
+            self.lengths[row] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(row)
+                postings[token][1].append(tf)
+        self.postings = {
+            token: (np.array(rows, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            for token, (rows, tfs) in postings.items()
+        }
+        self.avgdl = float(self.lengths.mean()) if self.n_docs else 0.0
+
+    def score(self, tokens):
+        """
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: BM25 scores and the number of matched query terms per doc.
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        matched = np.zeros(self.n_docs, dtype=np.int32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / (self.avgdl or 1.0))
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            rows, tfs = posting
+            idf = math.log(1 + (self.n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+            matched[rows] += 1
+        return scores, matched
+
+
+class _LocalIndex:
+    """Documents, a float16 embedding matrix and lazily built search structures of one index."""
+
+    def __init__(self, mappings, directory=None, index_uuid=None):
+        self.mappings = mappings
+        self.directory = directory
+        # Changes whenever the index is recreated, like the Elasticsearch index uuid
+        self.uuid = index_uuid or uuid.uuid4().hex
+        self.ids = []
+        self.sources = []
+        self.rows = {}
+        self.vectors = None
+        self._pending = {}
+        self._fields = {}
+        self._terms = {}
+        self.ivf = None
+        self.f32 = None
+        self.dirty = False
+        self.vector_field = next(
+            (name for name, prop in mappings.get("properties", {}).items() if prop.get("type") == "dense_vector"),
+            None
+        )
+
+    @property
+    def dims(self):
+        return self.mappings["properties"][self.vector_field]["dims"] if self.vector_field else 0
+
+    def index(self, _id, source):
+        _id = str(_id)
+        source = dict(source)
+        vector = source.pop(self.vector_field, None) if self.vector_field else None
+        row = self.rows.get(_id)
+        if row is None:
+            row = len(self.ids)
+            self.rows[_id] = row
+            self.ids.append(_id)
+            self.sources.append(source)
+        else:
+            self.sources[row] = source
+        if vector is not None:
+            self._pending[row] = vector
+        self.dirty = True
+
+    def refresh(self):
+        # Fold pending vectors into the (normalised, float16) matrix and drop stale search structures
+        if self._pending or (self.vectors is not None and len(self.vectors) != len(self.ids)):
+            matrix = np.zeros((len(self.ids), self.dims), dtype=np.float16)
+            if self.vectors is not None:
+                matrix[:len(self.vectors)] = self.vectors
+            if self._pending:
+                rows = np.fromiter(self._pending.keys(), dtype=np.int64)
+                pending = np.asarray(list(self._pending.values()), dtype=np.float32)
+                norms = np.linalg.norm(pending, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrix[rows] = (pending / norms).astype(np.float16)
+            self.vectors = matrix
+            self._pending = {}
+        self._fields = {}
+        self._terms = {}
+        self.ivf = None
+        self.f32 = None
+        self.dirty = False
+
+    def field_index(self, field):
+        if field not in self._fields:
+            self._fields[field] = _InvertedField([source.get(field) for source in self.sources])
+        return self._fields[field]
+
+    def term_rows(self, field, value):
+        if field not in self._terms:
+            terms = {}
+            for row, source in enumerate(self.sources):
+                terms.setdefault(source.get(field), []).append(row)
+            self._terms[field] = {k: np.array(v, dtype=np.int64) for k, v in terms.items()}
+        return self._terms[field].get(value, np.zeros(0, dtype=np.int64))
+
+    def save(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write next to the live files and swap, the current vectors may be a memmap of vectors.f16
+        files = {"mapping.json": self._write_mapping, "settings.json": self._write_settings, "docs.jsonl": self._write_docs}
+        if self.vectors is not None and len(self.vectors):
+            files["vectors.f16"] = self._write_vectors
+        for name, write in files.items():
+            path = os.path.join(self.directory, name)
+            write(path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+    def _write_mapping(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.mappings, f)
+
+    def _write_settings(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"uuid": self.uuid}, f)
+
+    def _write_docs(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for _id, source in zip(self.ids, self.sources):
+                f.write(json.dumps({"_id": _id, "_source": source}, ensure_ascii=False) + "\n")
+
+    def _write_vectors(self, path):
+        memmap = np.memmap(path, dtype=np.float16, mode="w+", shape=self.vectors.shape)
+        memmap[:] = self.vectors
+        memmap.flush()
+        del memmap
+
+    @classmethod
+    def load(cls, directory):
+        settings = {}
+        if os.path.exists(os.path.join(directory, "settings.json")):
+            with open(os.path.join(directory, "settings.json"), "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        with open(os.path.join(directory, "mapping.json"), "r", encoding="utf-8") as f:
+            index = cls(json.load(f), directory, settings.get("uuid"))
+        with open(os.path.join(directory, "docs.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                index.rows[doc["_id"]] = len(index.ids)
+                index.ids.append(doc["_id"])
+                index.sources.append(doc["_source"])
+        path = os.path.join(directory, "vectors.f16")
+        if os.path.exists(path) and index.ids:
+            # Memory-mapped, pages are loaded on demand
+            index.vectors = np.memmap(path, dtype=np.float16, mode="r", shape=(len(index.ids), index.dims))
+        return index
+
+
+class _Indices:
+    """The `es.indices` namespace of LocalSearchEngine."""
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def exists(self, index, **kwargs):
+        return self._engine._get(index, required=False) is not None
+
+    def create(self, index, body=None, mappings=None, **kwargs):
+        mappings = (body or {}).get("mappings", mappings or {})
+        with self._engine._lock:
+            if index in self._engine._indices or index in self._engine._aliases:
+                raise ValueError(f"Index {index} already exists")
+            directory = os.path.join(self._engine.data_dir, index) if self._engine.data_dir else None
+            self._engine._indices[index] = _LocalIndex(mappings, directory)
+        return {"acknowledged": True, "index": index}
+
+    def delete(self, index, **kwargs):
+        with self._engine._lock:
+            local_index = self._engine._indices.pop(index)
+            self._engine._drop_aliases(index)
+        if local_index.directory and os.path.isdir(local_index.directory):
+            shutil.rmtree(local_index.directory)
+        return {"acknowledged": True}
+
+    def get_alias(self, index="*", name=None, **kwargs):
+        # Like Elasticsearch: indices matching `index` with their aliases, restricted to alias `name` if given
+        engine = self._engine
+        pattern = "*" if index in ("*", "_all", None) else engine._resolve(index)
+        result = {}
+        for index_name in engine._indices:
+            if not fnmatch.fnmatchcase(index_name, pattern):
+                continue
+            aliases = {alias: {} for alias, target in engine._aliases.items() if target == index_name}
+            if name is not None:
+                aliases = {alias: {} for alias in aliases if fnmatch.fnmatchcase(alias, name)}
+                if not aliases:
+                    continue
+            result[index_name] = {"aliases": aliases}
+        if name is not None and not result:
+            raise KeyError(f"alias [{name}] missing")
+        return result
+
+    def exists_alias(self, name, index=None, **kwargs):
+        target = self._engine._aliases.get(name)
+        return target is not None and (index is None or fnmatch.fnmatchcase(target, index))
+
+    def put_alias(self, index, name, **kwargs):
+        return self.update_aliases(actions=[{"add": {"index": index, "alias": name}}])
+
+    def update_aliases(self, actions=None, body=None, **kwargs):
+        """
+        Applies add / remove / remove_index actions atomically: all of them are
+        validated first, and readers see either the old or the new aliases.
+        """
+        actions = actions if actions is not None else (body or {}).get("actions", [])
+        engine = self._engine
+        with engine._lock:
+            aliases = dict(engine._aliases)
+            removed = []
+            for action in actions:
+                (kind, options), = action.items()
+                if kind == "add":
+                    if options["index"] not in engine._indices or options["index"] in removed:
+                        raise KeyError(f"no such index [{options['index']}]")
+                    if options["alias"] in engine._indices and options["alias"] not in removed:
+                        raise ValueError(f"Invalid alias name [{options['alias']}], an index exists with the same name")
+                    aliases[options["alias"]] = options["index"]
+                elif kind == "remove":
+                    if aliases.get(options["alias"]) != options["index"]:
+                        raise KeyError(f"aliases [{options['alias']}] missing")
+                    del aliases[options["alias"]]
+                elif kind == "remove_index":
+                    if options["index"] not in engine._indices:
+                        raise KeyError(f"no such index [{options['index']}]")
+                    removed.append(options["index"])
+                    aliases = {alias: target for alias, target in aliases.items() if target != options["index"]}
+                else:
+                    raise ValueError(f"Unsupported alias action: {kind}")
+            directories = [engine._indices.pop(index).directory for index in removed]
+            engine._aliases = aliases
+            engine._save_aliases()
+        for directory in directories:
+            if directory and os.path.isdir(directory):
+                shutil.rmtree(directory)
+        return {"acknowledged": True}
+
+    def get_mapping(self, index, **kwargs):
+        return {self._engine._resolve(index): {"mappings": self._engine._get(index).mappings}}
+
+    def put_mapping(self, index, properties=None, meta=None, body=None, **kwargs):
+        # Like Elasticsearch: new properties are added, a given _meta replaces the stored one
+        body = body or {}
+        properties = properties if properties is not None else body.get("properties")
+        meta = meta if meta is not None else body.get("_meta")
+        local_index = self._engine._get(index)
+        with self._engine._lock:
+            if properties:
+                local_index.mappings.setdefault("properties", {}).update(properties)
+            if meta is not None:
+                local_index.mappings["_meta"] = meta
+            local_index.save()
+        return {"acknowledged": True}
+
+    def get_settings(self, index, **kwargs):
+        return {self._engine._resolve(index): {"settings": {"index": {"uuid": self._engine._get(index).uuid}}}}
+
+    def put_settings(self, index, body=None, **kwargs):
+        return {"acknowledged": True}
+
+    def refresh(self, index, **kwargs):
+        local_index = self._engine._get(index)
+        with self._engine._lock:
+            local_index.refresh()
+            local_index.save()
+        return {"_shards": {"failed": 0}}
+
+    def forcemerge(self, index, **kwargs):
+        return self.refresh(index)
+
+
+class LocalSearchEngine:
+    """
+    LocalSearchEngine is an in-process stand-in for the Elasticsearch client.
+
+    It implements the subset of the client API this project uses (`search`,
+    `msearch`, `mget`, `bulk`, `count` and `indices.*`) for the query shapes
+    built in `src.query`: multi_match/match/term/bool/match_all queries, kNN
+    with filters and the rrf retriever. Text fields are scored with BM25 over
+    an in-memory inverted index with Turkish-aware lowercasing, and vectors
+    live in a normalised float16 matrix (memory-mapped when loaded from disk)
+    searched exactly or through an IVF coarse quantizer.
+
+    Writes become searchable on the next read, they are persisted to `data_dir`
+    on `indices.refresh`. Aliases point at a single index and are swapped
+    atomically with `indices.update_aliases`. Embeddings are kept out of `_source`, they are never
+    returned.
+
+    Attributes:
+        data_dir (str): Directory the indices are persisted to, in-memory only if None.
+        ivf_lists (int): Number of IVF lists, exact search if 0.
+        nprobe (int): IVF lists scanned per query.
+        indices (_Indices): Index management namespace, like `es.indices`.
+    """
+
+    def __init__(self, data_dir: str = None, ivf_lists: int = 0, nprobe: int = 8, ivf_min_docs: int = 10000,
+                 float32_cache_mb: int = 256):
+        """
+        Opens the engine and loads any indices persisted in `data_dir`.
+
+        Args:
+            data_dir (str): Directory of persisted indices, in-memory only if None.
+            ivf_lists (int): Number of IVF lists (k-means centroids), 0 for exact search.
+            nprobe (int): IVF lists scanned per query.
+            ivf_min_docs (int): Below this corpus size exact search is used anyway.
+            float32_cache_mb (int): Matrices whose float32 copy fits this budget are upcast once
+                instead of on every query (float16 -> float32 conversion dominates exact search).
+        """
+        self.data_dir = data_dir
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.ivf_min_docs = ivf_min_docs
+        self.float32_cache_mb = float32_cache_mb
+        self.indices = _Indices(self)
+        self._indices = {}
+        self._aliases = {}
+        self._lock = threading.Lock()
+        if data_dir and os.path.isdir(data_dir):
+            for name in os.listdir(data_dir):
+                if os.path.exists(os.path.join(data_dir, name, "mapping.json")):
+                    self._indices[name] = _LocalIndex.load(os.path.join(data_dir, name))
+            if os.path.exists(os.path.join(data_dir, ALIASES_FILE)):
+                with open(os.path.join(data_dir, ALIASES_FILE), "r", encoding="utf-8") as f:
+                    self._aliases = {alias: index for alias, index in json.load(f).items() if index in self._indices}
+
+    def _resolve(self, index):
+        # Alias name -> index name, index names map to themselves
+        return self._aliases.get(index, index)
+
+    def _drop_aliases(self, index):
+        self._aliases = {alias: target for alias, target in self._aliases.items() if target != index}
+        self._save_aliases()
+
+    def _save_aliases(self):
+        if not self.data_dir:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        path = os.path.join(self.data_dir, ALIASES_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._aliases, f)
+        os.replace(path + ".tmp", path)
+
+    def _get(self, index, required=True):
+        local_index = self._indices.get(self._resolve(index))
+        if local_index is None and required:
+            raise KeyError(f"no such index [{index}]")
+        return local_index
+
+    def _searchable(self, index):
+        # Writes become visible on the next read, like a near-real-time refresh
+        local_index = self._get(index)
+        if local_index.dirty:
+            with self._lock:
+                if local_index.dirty:
+                    local_index.refresh()
+        return local_index
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    # Documents
+
+    def bulk(self, operations, **kwargs):
+        lines = [json.loads(line) if isinstance(line, (bytes, str)) else line for line in operations]
+        items = []
+        i = 0
+        with self._lock:
+            while i < len(lines):
+                header = lines[i]["index"]
+                self._get(header["_index"]).index(header["_id"], lines[i + 1])
+                items.append({"index": {"_index": header["_index"], "_id": str(header["_id"]), "status": 201}})
+                i += 2
+        return {"errors": False, "items": items}
+
+    def index(self, index, id, document, **kwargs):
+        with self._lock:
+            self._get(index).index(id, document)
+        return {"_index": index, "_id": str(id), "result": "created"}
+
+    def count(self, index, **kwargs):
+        return {"count": len(self._searchable(index).ids)}
+
+    def mget(self, index, ids, source_excludes=None, source_includes=None, **kwargs):
+        local_index = self._searchable(index)
+        index = self._resolve(index)
+        docs = []
+        for _id in ids:
+            row = local_index.rows.get(str(_id))
+            if row is None:
+                docs.append({"_index": index, "_id": str(_id), "found": False})
+                continue
+            source = _filter_source(local_index.sources[row], source_includes, source_excludes)
+            docs.append({"_index": index, "_id": str(_id), "found": True, "_source": source})
+        return {"docs": docs}
+
+    # Search
+
+    def search(self, index, body=None, **kwargs):
+        body = dict(body or {}, **kwargs)
+        local_index = self._searchable(index)
+        index = self._resolve(index)
+        size = body.get("size", 10)
+
+        if "retriever" in body:
+            hits = self._retriever(local_index, index, body["retriever"], size)
+        elif "knn" in body:
+            hits = self._knn(local_index, index, body["knn"])[:size]
+        else:
+            scores, mask = self._query(local_index, body.get("query", {"match_all": {}}))
+            hits = self._top_hits(local_index, index, scores, mask, size)
+
+        source_option = body.get("_source", True)
+        for hit in hits:
+            if source_option is not False:
+                includes = source_option if isinstance(source_option, list) else None
+                hit["_source"] = _filter_source(local_index.sources[hit.pop("_row")], includes, None)
+            else:
+                hit.pop("_row")
+        return {"hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits}}
+
+    def msearch(self, searches, index=None, **kwargs):
+        responses = []
+        for header, body in zip(searches[0::2], searches[1::2]):
+            try:
+                responses.append(self.search(index=header.get("index", index), body=body))
+            except Exception as e:
+                responses.append({"error": {"type": type(e).__name__, "reason": str(e)}, "status": 400})
+        return {"responses": responses}
+
+    def _top_hits(self, local_index, index, scores, mask, size):
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+        top = candidates[_top_k(scores[candidates], size)]
+        return [{"_index": index, "_id": local_index.ids[row], "_score": float(scores[row]), "_row": int(row)} for row in top]
+
+    def _query(self, local_index, query):
+        """
+        Evaluates a query DSL clause.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Per-doc scores and the boolean mask of matching docs.
+        """
+        n_docs = len(local_index.ids)
+        (kind, clause), = query.items()
+
+        if kind == "match_all":
+            return np.ones(n_docs, dtype=np.float32), np.ones(n_docs, dtype=bool)
+
+        if kind == "multi_match":
+            tokens = analyze(clause["query"])
+            best = np.zeros(n_docs, dtype=np.float32)
+            mask = np.zeros(n_docs, dtype=bool)
+            # best_fields: the best boosted field score counts
+            for field_spec in clause.get("fields", []):
+                field, boost = _FIELD_BOOST.match(field_spec).groups()
+                scores, matched = local_index.field_index(field).score(tokens)
+                best = np.maximum(best, scores * float(boost or 1.0))
+                field_mask = matched >= len(set(tokens)) if clause.get("operator") == "and" else matched > 0
+                mask |= field_mask
+            return best, mask
+
+        if kind == "match":
+            (field, options), = clause.items()
+            if not isinstance(options, dict):
+                options = {"query": options}
+            tokens = analyze(str(options["query"]))
+            scores, matched = local_index.field_index(field).score(tokens)
+            mask = matched >= len(set(tokens)) if options.get("operator") == "and" else matched > 0
+            return scores, mask
+
+        if kind == "function_score":
+            # Only random_score, which samples documents (e.g. the eval set of scripts/tune_retrieval.py)
+            _, mask = self._query(local_index, clause.get("query", {"match_all": {}}))
+            seed = int(clause.get("random_score", {}).get("seed", 0))
+            return np.random.default_rng(seed).random(n_docs, dtype=np.float32), mask
+
+        if kind in ("term", "terms"):
+            (field, value), = clause.items()
+            values = value if kind == "terms" else [value.get("value") if isinstance(value, dict) else value]
+            mask = np.zeros(n_docs, dtype=bool)
+            for v in values:
+                mask[local_index.term_rows(field, v)] = True
+            return np.zeros(n_docs, dtype=np.float32), mask
+
+        if kind == "bool":
+            scores = np.zeros(n_docs, dtype=np.float32)
+            mask = np.ones(n_docs, dtype=bool)
+            for sub in _as_list(clause.get("must")):
+                sub_scores, sub_mask = self._query(local_index, sub)
+                scores += sub_scores
+                mask &= sub_mask
+            mask &= self._filter_mask(local_index, clause.get("filter"))
+            for sub in _as_list(clause.get("must_not")):
+                mask &= ~self._query(local_index, sub)[1]
+            should = _as_list(clause.get("should"))
+            if should:
+                should_mask = np.zeros(n_docs, dtype=bool)
+                for sub in should:
+                    sub_scores, sub_mask = self._query(local_index, sub)
+                    scores += sub_scores * sub_mask
+                    should_mask |= sub_mask
+                if not clause.get("must") and not clause.get("filter"):
+                    mask &= should_mask
+            return scores, mask
+
+        raise ValueError(f"Unsupported query type for the local engine: {kind}")
+
+    def _filter_mask(self, local_index, filters):
+        mask = np.ones(len(local_index.ids), dtype=bool)
+        for sub in _as_list(filters):
+            mask &= self._query(local_index, sub)[1]
+        return mask
+
+    def _knn(self, local_index, index, knn):
+        if local_index.vectors is None or not len(local_index.ids):
+            return []
+        query = np.asarray(knn["query_vector"], dtype=np.float32)
+        if len(query) != local_index.dims:
+            raise ValueError(f"The query vector has {len(query)} dims, the index has {local_index.dims}")
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        allowed = self._filter_mask(local_index, knn.get("filter")) if knn.get("filter") else None
+        candidates = self._ivf_candidates(local_index, query)
+        if allowed is not None:
+            candidates = np.flatnonzero(allowed) if candidates is None else candidates[allowed[candidates]]
+
+        cosine = _dot(self._matrix(local_index), query, candidates)
+        rows = np.arange(len(local_index.ids)) if candidates is None else candidates
+        k = knn.get("k", 10)
+        top = _top_k(cosine, k)
+        # Elasticsearch reports cosine similarity as (1 + cos) / 2
+        return [
+            {"_index": index, "_id": local_index.ids[rows[i]], "_score": float((1 + cosine[i]) / 2), "_row": int(rows[i])}
+            for i in top
+        ]
+
+    def _matrix(self, local_index):
+        if local_index.f32 is None and local_index.vectors.size * 4 <= self.float32_cache_mb * 1024 * 1024:
+            with self._lock:
+                if local_index.f32 is None:
+                    local_index.f32 = np.asarray(local_index.vectors, dtype=np.float32)
+        return local_index.f32 if local_index.f32 is not None else local_index.vectors
+
+    def _ivf_candidates(self, local_index, query):
+        # None means "every row" (exact search)
+        if not self.ivf_lists or len(local_index.ids) < self.ivf_min_docs:
+            return None
+        with self._lock:
+            if local_index.ivf is None:
+                local_index.ivf = _build_ivf(local_index.vectors, self.ivf_lists)
+        centroids, assignments = local_index.ivf
+        probes = np.argsort(-(centroids @ query))[:self.nprobe]
+        return np.flatnonzero(np.isin(assignments, probes))
+
+    def _retriever(self, local_index, index, retriever, size):
+        (kind, spec), = retriever.items()
+        if kind == "standard":
+            scores, mask = self._query(local_index, spec["query"])
+            return self._top_hits(local_index, index, scores, mask, size)
+        if kind == "knn":
+            return self._knn(local_index, index, spec)[:size]
+        if kind == "rrf":
+            window = spec.get("rank_window_size", size)
+            lists = [self._retriever(local_index, index, sub, window) for sub in spec["retrievers"]]
+            fused = rrf_fuse(lists, k_const=spec.get("rank_constant", 60), limit=size)
+            for hit in fused:
+                hit.pop("_fusion_ranks", None)
+            return fused
+        raise ValueError(f"Unsupported retriever for the local engine: {kind}")
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _filter_source(source, includes=None, excludes=None):
+    if includes:
+        source = {k: v for k, v in source.items() if k in includes}
+    if excludes:
+        source = {k: v for k, v in source.items() if k not in excludes}
+    return dict(source)
+
+
+def _top_k(scores, k):
+    # Partial selection, then a stable sort of the k survivors
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.lexsort((top, -scores[top]))]
+    return np.argsort(-scores, kind="stable")
+
+
+def _dot(vectors, query, rows=None, block=65536):
+    # Blockwise float16 -> float32 so a large memmap is never upcast at once
+    if vectors.dtype == np.float32:
+        return vectors @ query if rows is None else vectors[rows] @ query
+    if rows is not None:
+        return vectors[rows].astype(np.float32) @ query
+    out = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        out[start:start + block] = vectors[start:start + block].astype(np.float32) @ query
+    return out
+
+
+def _build_ivf(vectors, n_lists, iterations=10, sample=100000, seed=0):
+    """Spherical k-means on a sample of the vectors, then assigns every row to its nearest centroid."""
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(vectors))
+    sample_rows = rng.choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+    data = vectors[np.sort(sample_rows)].astype(np.float32)
+    centroids = data[rng.choice(len(data), size=n_lists, replace=False)]
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = data[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), 65536):
+        block = vectors[start:start + 65536].astype(np.float32)
+        assignments[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assignments
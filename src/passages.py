@@ -0,0 +1,80 @@
+import re
+
+# Passage ids are "<article id>#<passage number>"
+PASSAGE_SEPARATOR = "#"
+
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def token_spans(text, tokenizer=None):
+    # Character spans of the tokens, whitespace words unless a HF fast tokenizer is given
+    if tokenizer is None:
+        return [m.span() for m in _WORD_PATTERN.finditer(text)]
+    encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return [span for span in encoded["offset_mapping"] if span[1] > span[0]]
+
+
+def model_tokenizer(model):
+    # The embedding model's HF fast tokenizer (offset mappings need a fast one), None to count whitespace words
+    tokenizer = getattr(model, "tokenizer", None)
+    return tokenizer if getattr(tokenizer, "is_fast", False) else None
+
+
+def split_passages(text, max_tokens=128, stride=32, tokenizer=None):
+    """
+    Splits an article into overlapping, token-bounded passages.
+
+    Args:
+        text (str): Article body.
+        max_tokens (int): Maximum number of tokens per passage.
+        stride (int): Number of tokens shared by consecutive passages.
+        tokenizer: HuggingFace fast tokenizer of the embedding model (see `model_tokenizer`),
+            whitespace words are counted if None.
+
+    Returns:
+        List[str]: Passages in article order (empty for an empty text).
+    """
+    if stride >= max_tokens:
+        raise ValueError("stride must be smaller than max_tokens")
+
+    spans = token_spans(text or "", tokenizer)
+    passages = []
+    step = max_tokens - stride
+    for start in range(0, len(spans), step):
+        window = spans[start:start + max_tokens]
+        passages.append(text[window[0][0]:window[-1][1]])
+        if start + max_tokens >= len(spans):
+            break
+    return passages
+
+
+def passage_id(parent_id, passage_no):
+    return f"{parent_id}{PASSAGE_SEPARATOR}{passage_no}"
+
+
+def parent_of(_id):
+    return str(_id).split(PASSAGE_SEPARATOR, 1)[0]
+
+
+def collapse_to_articles(hits, limit=None):
+    """
+    Keeps the best-ranked passage of every article.
+
+    Args:
+        hits (List[dict]): Ranked passage hits (ids "<article id>#<n>").
+        limit (int): Maximum number of articles to return.
+
+    Returns:
+        List[dict]: One hit per article, in rank order.
+    """
+    seen = set()
+    collapsed = []
+    for hit in hits:
+        parent = parent_of(hit["_id"])
+        if parent in seen:
+            continue
+        seen.add(parent)
+        collapsed.append(hit)
+        if limit and len(collapsed) >= limit:
+            break
+    return collapsed
@@ -1,38 +1,73 @@
-from elasticsearch import Elasticsearch
-from scripts.date_extractor import extract_turkish_date
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.date_extractor import extract_date_parts, join_date_parts, to_month_year
+from src.backends import get_search_client
+from src.embedder import truncate_dims
+from src.fusion import build_rrf_retriever_body, rrf_fuse
+from src.instrumentation import count, span, traced
+from src.passages import collapse_to_articles
 
-def query_similar(prompt, model, k=10, index="mlsum_tr_semantic", host="localhost", port=9200, es=None):
-    if not es:
-        es = Elasticsearch(f"http://{host}:{port}")
+# Candidate window sizes of the two retrievers
+WINDOW_SIZE_LEX = 50
+WINDOW_SIZE_VEC = 100
 
-    # Extract date from the prompt
-    date = extract_turkish_date(prompt)
-    lexical_query = prompt.replace(date, "").strip() if date else prompt
+# Retrieval parameters used when no config file is present, scripts/tune_retrieval.py writes tuned ones
+DEFAULT_RETRIEVAL_CONFIG = {
+    "window_size_lex": WINDOW_SIZE_LEX,
+    "window_size_vec": WINDOW_SIZE_VEC,
+    "knn_k": 50,
+    "num_candidates": 100,
+    "k_const": 60,
+    "w_lex": 1.0,
+    "w_vec": 1.3,
+    "limit": 25,
+}
+RETRIEVAL_CONFIG_PATH = os.environ.get("RETRIEVAL_CONFIG", "retrieval_config.json")
 
-    # Embed the prompt
-    embedding = embed_prompt(prompt, model)
+# Fields never sent back to the client when hits are hydrated
+HYDRATE_EXCLUDES = ["embedding"]
 
-    # Validate dimensions
-    mapping = es.indices.get_mapping(index=index)
-    dims = mapping[index]["mappings"]["properties"]["embedding"]["dims"]
-    if len(embedding) != dims:
-        raise ValueError(f"Dimension mismatch: got {len(embedding)}, expected {dims}")
+# Runs the lexical search of a query while the calling thread runs its kNN search
+_search_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SEARCH_THREADS", "16")), thread_name_prefix="lexical-search"
+)
 
-    # Choose size of final result set
-    window_size = 50
 
-    # Build the hybrid RRF body
+def build_date_filter(month, year):
+    # Term filters on the numeric date fields of the index
+    filters = []
+    if year:
+        filters.append({"term": {"year": year}})
+    if month:
+        filters.append({"term": {"month": month}})
+    return filters
+
+
+def build_lexical_query(lexical_query, date, date_filter=None, fields=("summary^3", "title^2")):
+    multi_match = {
+        "multi_match": {
+            "query": lexical_query,
+            "fields": list(fields),
+            "operator": "or"
+        }
+    }
+    if date_filter:
+        return {
+            "bool": {
+                "must": [multi_match],
+                "filter": date_filter
+            }
+        }
     if date:
-        lexical = {
+        # Indices without year/month fields only have the free-text date
+        return {
             "bool": {
                 "must": [
-                    {
-                        "multi_match": {
-                            "query": lexical_query,
-                            "fields": ["summary^3", "title^2"],
-                            "operator": "or"
-                        }
-                    },
+                    multi_match,
                     {
                         "match": {
                             "date": {
@@ -44,68 +79,349 @@ def query_similar(prompt, model, k=10, index="mlsum_tr_semantic", host="localhos
                 ]
             }
         }
-    else:
-        lexical = {
-            "multi_match": {
-                "query": lexical_query,
-                "fields": ["summary^3", "title^2"],
-                "operator": "or"
-            }
-        }
+    return multi_match
+
+
+_config_lock = threading.Lock()
+_config_cache = {}
 
-    window_size_lex = 50
-    window_size_vec = 100
 
+def load_retrieval_config(path=None):
+    """
+    Reads the retrieval parameters (window sizes, kNN candidates, RRF constant,
+    weights and fused size) from a JSON file written by scripts/tune_retrieval.py.
+
+    Missing keys, or a missing file, fall back to DEFAULT_RETRIEVAL_CONFIG. The
+    file is read again only when its modification time changes, so a re-tuned
+    config is picked up without a restart. A file that cannot be read or parsed
+    is reported once and the last good config (or the defaults) stays in use.
+
+    Args:
+        path (str): Config file, $RETRIEVAL_CONFIG or retrieval_config.json if None.
+
+    Returns:
+        dict: The retrieval parameters.
+    """
+    path = path or RETRIEVAL_CONFIG_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return DEFAULT_RETRIEVAL_CONFIG
+    with _config_lock:
+        cached = _config_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            # The tuner stores its evaluation next to the parameters, keep only known keys
+            params = stored.get("params", stored)
+            config = {key: type(default)(params.get(key, default)) for key, default in DEFAULT_RETRIEVAL_CONFIG.items()}
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            # A truncated or hand-broken file must not take down every query, it is retried once it changes
+            config = cached[1] if cached else DEFAULT_RETRIEVAL_CONFIG
+            print(f"⚠️ Ignoring retrieval config {path} ({e}), keeping the {'last good' if cached else 'default'} config")
+        _config_cache[path] = (mtime, config)
+        return config
+
+
+def build_search_bodies(prompt, embedding, k=10, properties=None, config=None):
+    """
+    Builds the lexical and kNN request bodies of the hybrid search for one prompt.
+
+    When the index has numeric year/month fields (see `properties`), a date in the
+    prompt becomes a pre-filter of both the BM25 query and the kNN search. Window
+    sizes and kNN candidates come from `config` (see `load_retrieval_config`).
+
+    Returns:
+        Tuple[dict, dict]: The BM25 body and the kNN body.
+    """
+    # Extract date from the prompt
+    ay, yil = extract_date_parts(prompt)
+    date = join_date_parts(ay, yil)
+    lexical_query = prompt.replace(date, "").strip() if date else prompt
+
+    date_filter = None
+    if date and properties and "year" in properties and "month" in properties:
+        date_filter = build_date_filter(*to_month_year(ay, yil))
+
+    # Passage indices repeat title/summary on every passage, the passage text tells them apart
+    fields = ("summary^3", "title^2")
+    if properties and "passage" in properties:
+        fields += ("passage",)
+
+    config = config or load_retrieval_config()
+    knn_k = max(k, config["knn_k"])
+
+    # Retrieval only needs ids and scores, _source is fetched for the fused survivors
     lexical_body = {
-        "size": window_size_lex,
-        "query": lexical
+        "size": config["window_size_lex"],
+        "_source": False,
+        "query": build_lexical_query(lexical_query, date, date_filter, fields)
     }
     vec_body = {
-        "size": window_size_vec,
+        "size": config["window_size_vec"],
+        "_source": False,
         "knn": {
             "field": "embedding",
             "query_vector": embedding,
-            "k": max(k, window_size),
-            "num_candidates": max(100, window_size)
+            "k": knn_k,
+            "num_candidates": max(config["num_candidates"], knn_k)
         }
     }
+    if date_filter:
+        vec_body["knn"]["filter"] = date_filter
+    return lexical_body, vec_body
+
 
-    lex_hits = es.search(index=index, body=lexical_body)["hits"]["hits"]
-    vec_hits = es.search(index=index, body=vec_body)["hits"]["hits"]
+def get_client(host="localhost", port=9200):
+    # One client (and connection pool) per cluster for the whole process, $SEARCH_BACKEND=local runs in-process
+    return get_search_client(host=host, port=port)
 
-    # Fuse the queries with RRF
-    def rrf_merge(lex_hits, vec_hits, *, k_const=60, w_lex=1.0, w_vec=1.3, limit=25):
-        """
-        Client-side Reciprocal Rank Fusion (RRF) with per-retriever weights.
-        - lex_hits, vec_hits: lists from ES (you control their sizes when querying)
-        - k_const: rank_constant (larger = flatter influence)
-        - w_lex, w_vec: weights to bias lexical vs vector
-        - limit: final fused size
-        """
-        acc = {}
 
-        def add_list(hits, weight):
-            for r, h in enumerate(hits, start=1):
-                _id = h["_id"]
-                entry = acc.setdefault(_id, {"hit": h, "score": 0.0})
-                entry["score"] += weight * (1.0 / (k_const + r))
+class IndexMetadataCache:
+    """
+    IndexMetadataCache keeps the mapping properties of searched indices so the
+    query path does not call `get_mapping` on every request.
 
-        add_list(lex_hits, w_lex)
-        add_list(vec_hits, w_vec)
+    Names may be aliases (see `src.index_versions`): the cached metadata then
+    belongs to the index the alias pointed at, recorded as "index", and the
+    query path searches that index so dims and vectors always agree. Alias
+    entries expire after `alias_ttl` seconds so an alias swap reaches every
+    process quickly, index entries after `ttl`; both can be dropped explicitly
+    with `invalidate` (e.g. after an index is rebuilt).
+    """
+
+    def __init__(self, ttl: float = 300.0, alias_ttl: float = 10.0):
+        self.ttl = ttl
+        self.alias_ttl = alias_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, index):
+        with self._lock:
+            entry = self._entries.get(index)
+        if not entry:
+            return None
+        ttl = self.ttl if entry[1]["index"] == index else self.alias_ttl
+        if time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        return None
+
+    def put(self, index, mapping_response):
+        resolved, mapping = next(iter(mapping_response.items()))
+        mappings = mapping["mappings"]
+        properties = mappings["properties"]
+        metadata = {
+            "index": resolved,
+            "properties": properties,
+            "dims": properties["embedding"]["dims"],
+            # Set when the index holds Matryoshka-truncated vectors
+            "truncate_dims": mappings.get("_meta", {}).get("matryoshka_dims"),
+            "model": mappings.get("_meta", {}).get("model")
+        }
+        with self._lock:
+            self._entries[index] = (time.monotonic(), metadata)
+        return metadata
 
-        fused = sorted(acc.values(), key=lambda x: (-x["score"], x["hit"]["_id"]))
+    def fetch(self, es, index):
+        return self.get(index) or self.put(index, es.indices.get_mapping(index=index))
 
-        # Expose RRF score as _score for inspection
-        for e in fused:
-            e["hit"]["_score"] = e["score"]
-        return [e["hit"] for e in fused[:limit]]
+    def invalidate(self, index=None):
+        with self._lock:
+            if index is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(index, None)
 
 
-    return rrf_merge(lex_hits, vec_hits)
+# Shared by all sync callers of query_similar / query_similar_batch
+index_metadata = IndexMetadataCache()
 
 
-def embed_prompt(prompt, model):
-    return model.encode(prompt).tolist()
+def check_dims(dims, embeddings):
+    for embedding in embeddings:
+        if len(embedding) != dims:
+            raise ValueError(f"Dimension mismatch: got {len(embedding)}, expected {dims}")
+
+
+def attach_sources(hits, mget_response):
+    # Drop hits whose document vanished between search and fetch
+    sources = {doc["_id"]: doc["_source"] for doc in mget_response["docs"] if doc.get("found")}
+    hydrated = []
+    for hit in hits:
+        if hit["_id"] in sources:
+            hit["_source"] = sources[hit["_id"]]
+            hydrated.append(hit)
+    return hydrated
+
+
+def hydrate_hits(es, index, hits):
+    """
+    Fetches `_source` (without the embedding) for the final hits in one mget.
+
+    Returns:
+        List[dict]: The hits, in order, with their `_source` attached.
+    """
+    if not hits:
+        return hits
+    with span("hydrate", docs=len(hits)):
+        response = es.mget(index=index, ids=[hit["_id"] for hit in hits], source_excludes=HYDRATE_EXCLUDES)
+    return attach_sources(hits, response)
+
+
+def rrf_merge(lex_hits, vec_hits, *, k_const=60, w_lex=1.0, w_vec=1.3, limit=25):
+    """
+    Client-side Reciprocal Rank Fusion (RRF) with per-retriever weights.
+    - lex_hits, vec_hits: lists from ES (you control their sizes when querying)
+    - k_const: rank_constant (larger = flatter influence)
+    - w_lex, w_vec: weights to bias lexical vs vector
+    - limit: final fused size
+    """
+    return rrf_fuse([lex_hits, vec_hits], weights=[w_lex, w_vec], k_const=k_const, limit=limit)
+
+
+def is_passage_index(properties):
+    return bool(properties) and "parent_id" in properties
+
+
+def fuse_hits(lex_hits, vec_hits, properties=None, limit=None, config=None):
+    # RRF constant, weights and (unless given) the fused size come from the retrieval config
+    config = config or load_retrieval_config()
+    limit = limit or config["limit"]
+    weights = {"k_const": config["k_const"], "w_lex": config["w_lex"], "w_vec": config["w_vec"]}
+    # Passage hits are fused first and then collapsed to their best passage per article
+    if is_passage_index(properties):
+        return collapse_to_articles(rrf_merge(lex_hits, vec_hits, limit=None, **weights), limit=limit)
+    return rrf_merge(lex_hits, vec_hits, limit=limit, **weights)
+
+
+@traced()
+def query_similar(prompt, model, k=10, index="mlsum_tr_semantic", host="localhost", port=9200, es=None,
+                  fusion="client", embedding=None, config=None, embedding_cache=None):
+    # fusion="server" lets Elasticsearch fuse with its native rrf retriever (8.14+, unweighted)
+    # embedding: the prompt's model embedding if the caller already computed it (e.g. for a cache lookup)
+    # config: retrieval parameters, the tuned config file (or the defaults) if None
+    # embedding_cache: QueryEmbeddingCache consulted before the model
+    if not es:
+        es = get_client(host, port)
+    config = config or load_retrieval_config()
+
+    # Resolve an alias once, every request of this query goes to the index the metadata describes
+    metadata = index_metadata.fetch(es, index)
+    index = metadata["index"]
+
+    # Embed the prompt (truncated like the index vectors, if they are)
+    if embedding is None:
+        with span("embed_prompt"):
+            embedding = embed_prompt(prompt, model, metadata["truncate_dims"], embedding_cache)
+    else:
+        embedding = truncate_dims(embedding, metadata["truncate_dims"]).tolist()
+
+    # Validate dimensions
+    check_dims(metadata["dims"], [embedding])
+
+    # Build the hybrid RRF body
+    lexical_body, vec_body = build_search_bodies(prompt, embedding, k, metadata["properties"], config)
+
+    if fusion == "server":
+        body = build_rrf_retriever_body(
+            lexical_body["query"], vec_body["knn"],
+            rank_window_size=max(config["window_size_lex"], config["window_size_vec"]),
+            rank_constant=config["k_const"], size=config["limit"]
+        )
+        with span("rrf_search", index=index):
+            hits = es.search(index=index, body=body)["hits"]["hits"]
+        count("es_hits", len(hits), retriever="rrf")
+        if is_passage_index(metadata["properties"]):
+            hits = collapse_to_articles(hits)
+        return hydrate_hits(es, index, hits)
+    if fusion != "client":
+        raise ValueError(f"Unknown fusion mode: {fusion}")
+
+    # Both searches in flight at once, the latency is about max(lexical, kNN) instead of their sum
+    def lexical_search():
+        with span("lexical_search", index=index):
+            return es.search(index=index, body=lexical_body)["hits"]["hits"]
+
+    # The worker runs in a copy of this context, so its span nests under the caller's
+    lexical = _search_pool.submit(contextvars.copy_context().run, lexical_search)
+    with span("knn_search", index=index):
+        vec_hits = es.search(index=index, body=vec_body)["hits"]["hits"]
+    lex_hits = lexical.result()
+    count("es_hits", len(lex_hits), retriever="lexical")
+    count("es_hits", len(vec_hits), retriever="knn")
+
+    # Fuse the queries with RRF and hydrate only the survivors
+    with span("rrf_merge"):
+        fused = fuse_hits(lex_hits, vec_hits, metadata["properties"], config=config)
+    return hydrate_hits(es, index, fused)
+
+
+@traced()
+def query_similar_batch(prompts, model, k=10, index="mlsum_tr_semantic", host="localhost", port=9200, es=None,
+                        config=None, embedding_cache=None):
+    """
+    Hybrid retrieval for many prompts in one embedding batch and one _msearch round-trip.
+
+    Args:
+        prompts (List[str]): The queries.
+        model: SentenceTransformer used to embed the prompts.
+        k (int): Minimum number of kNN neighbours per prompt.
+        index (str): Index to search.
+        es (Elasticsearch): Client to use, the shared pooled client if None.
+        config (dict): Retrieval parameters, see `load_retrieval_config`.
+        embedding_cache (QueryEmbeddingCache): Cache consulted before the model, only misses are encoded.
+
+    Returns:
+        List[List[dict]]: RRF-fused hits for every prompt, in the order of `prompts`.
+    """
+    prompts = list(prompts)
+    if not prompts:
+        return []
+    if not es:
+        es = get_client(host, port)
+    config = config or load_retrieval_config()
+
+    # Embed all prompts in one batch
+    metadata = index_metadata.fetch(es, index)
+    index = metadata["index"]
+    with span("embed_prompt", batch=len(prompts)):
+        encoded = embedding_cache.encode(prompts, model.encode) if embedding_cache is not None else model.encode(prompts)
+        embeddings = truncate_dims(encoded, metadata["truncate_dims"]).tolist()
+    check_dims(metadata["dims"], embeddings)
+
+    # Two searches (lexical, kNN) per prompt in a single request
+    searches = []
+    for prompt, embedding in zip(prompts, embeddings):
+        lexical_body, vec_body = build_search_bodies(prompt, embedding, k, metadata["properties"], config)
+        searches.extend([{"index": index}, lexical_body, {"index": index}, vec_body])
+    with span("msearch", index=index, searches=len(searches) // 2):
+        responses = es.msearch(searches=searches)["responses"]
+
+    results = []
+    for i in range(len(prompts)):
+        lex_resp, vec_resp = responses[2 * i], responses[2 * i + 1]
+        for resp in (lex_resp, vec_resp):
+            if "error" in resp:
+                raise RuntimeError(f"Search failed for prompt {prompts[i]!r}: {resp['error']}")
+        results.append(fuse_hits(lex_resp["hits"]["hits"], vec_resp["hits"]["hits"], metadata["properties"], config=config))
+
+    # One mget hydrates the survivors of every prompt
+    ids = list(dict.fromkeys(hit["_id"] for hits in results for hit in hits))
+    if not ids:
+        return results
+    with span("hydrate", docs=len(ids)):
+        response = es.mget(index=index, ids=ids, source_excludes=HYDRATE_EXCLUDES)
+    return [attach_sources(hits, response) for hits in results]
+
+
+def embed_prompt(prompt, model, dims=None, cache=None):
+    # dims: Matryoshka truncation matching the index vectors
+    # cache: QueryEmbeddingCache, repeated prompts skip the model (it stores the full vectors)
+    if cache is not None:
+        return truncate_dims(cache.encode([prompt], model.encode)[0], dims).tolist()
+    return truncate_dims(model.encode(prompt), dims).tolist()
 
 
 def print_retrievals(prompt, retrievals = None):
@@ -127,4 +443,4 @@ def print_retrievals(prompt, retrievals = None):
             print("=" * 80)
     except ValueError:
         print("The structure of the retrievals are not as expected. Skipped.")
-        
\ No newline at end of file
+
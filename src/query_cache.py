@@ -0,0 +1,182 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.instrumentation import count
+from src.text import analyze
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:  # redis is only needed when a client is passed in
+    RedisError = OSError
+
+# Failures of a Redis tier; connection and timeout errors of the socket layer are OSErrors
+REDIS_ERRORS = (RedisError, OSError)
+
+
+def normalize_query(prompt):
+    # Turkish-aware lowercasing, punctuation dropped and whitespace collapsed: "  Asgari ÜCRET?" == "asgari ücret"
+    return " ".join(analyze(prompt))
+
+
+class QueryEmbeddingCache:
+    """
+    QueryEmbeddingCache keeps the embeddings of recent prompts so repeated
+    questions skip the embedding model.
+
+    Prompts are normalised before lookup, so questions differing only in
+    case, whitespace or punctuation share one entry (the embedding of the
+    first variant seen). Lookups go to an in-process LRU first and then, when
+    a Redis client is given, to Redis, where vectors are stored as raw
+    float16 bytes under a key of the model name and the normalised prompt;
+    every process sharing the Redis instance warms the others. Redis is an
+    optimisation only: when it fails a lookup counts as a miss and a write is
+    skipped, and the error is counted.
+
+    Attributes:
+        model_name (str): Embedding model the vectors belong to, part of every key.
+        memory_hits (int): Lookups answered by the LRU.
+        redis_hits (int): Lookups answered by Redis.
+        misses (int): Lookups that needed the model.
+        redis_errors (int): Redis calls that failed.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 4096, redis_client=None, ttl: int = 7 * 24 * 3600,
+                 namespace: str = "rag_qemb"):
+        """
+        Args:
+            model_name (str): Embedding model identifier.
+            max_entries (int): Prompts kept in the in-process LRU.
+            redis_client (redis.Redis): Optional shared second tier.
+            ttl (int): Lifetime of the Redis entries in seconds.
+            namespace (str): Redis key prefix.
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.redis = redis_client
+        self.ttl = ttl
+        self.namespace = namespace
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, prompt):
+        digest = hashlib.sha256(normalize_query(prompt).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{self.model_name}:{digest}"
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _record(self, tier, n=1):
+        if not n:
+            return
+        with self._lock:
+            if tier == "memory":
+                self.memory_hits += n
+            elif tier == "redis":
+                self.redis_hits += n
+            elif tier == "redis_error":
+                self.redis_errors += n
+            else:
+                self.misses += n
+        count("query_embedding_cache", n, result=tier)
+
+    def get_many(self, prompts):
+        """
+        Looks up several prompts, with one Redis round-trip for the LRU misses.
+
+        Returns:
+            List[np.ndarray]: float32 embedding per prompt, None where it is not cached.
+        """
+        keys = [self.key(prompt) for prompt in prompts]
+        vectors = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[i] = vector
+        self._record("memory", sum(vector is not None for vector in vectors))
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self.redis is not None:
+            try:
+                raws = self.redis.mget([keys[i] for i in missing])
+            except REDIS_ERRORS:
+                raws = [None] * len(missing)
+                self._record("redis_error")
+            for i, raw in zip(missing, raws):
+                if raw:
+                    vectors[i] = np.frombuffer(raw, dtype=np.float16).astype(np.float32)
+                    self._remember(keys[i], vectors[i])
+            self._record("redis", sum(vectors[i] is not None for i in missing))
+        self._record("miss", sum(vector is None for vector in vectors))
+        return vectors
+
+    def get(self, prompt):
+        return self.get_many([prompt])[0]
+
+    def put_many(self, prompts, vectors):
+        keys = [self.key(prompt) for prompt in prompts]
+        vectors = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector)
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, vector in zip(keys, vectors):
+                    pipe.set(key, vector.astype(np.float16).tobytes(), ex=self.ttl)
+                pipe.execute()
+            except REDIS_ERRORS:
+                self._record("redis_error")
+
+    def put(self, prompt, vector):
+        self.put_many([prompt], [vector])
+
+    def encode(self, prompts, encode_fn):
+        """
+        Embeds prompts, running `encode_fn` only for the ones not cached.
+
+        Args:
+            prompts (List[str]): The queries.
+            encode_fn (Callable[[List[str]], np.ndarray]): Batch encoder, e.g. `model.encode`.
+
+        Returns:
+            np.ndarray: float32 embeddings in the order of `prompts`.
+        """
+        vectors = self.get_many(prompts)
+        # Variants of one missing question are encoded once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_query(prompts[i]), []).append(i)
+        if missing:
+            firsts = [positions[0] for positions in missing.values()]
+            encoded = encode_fn([prompts[i] for i in firsts])
+            self.put_many([prompts[i] for i in firsts], encoded)
+            for positions, vector in zip(missing.values(), encoded):
+                for i in positions:
+                    vectors[i] = np.asarray(vector, dtype=np.float32)
+        return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, memory_hits, redis_hits, misses, redis_errors = (
+                len(self._entries), self.memory_hits, self.redis_hits, self.misses, self.redis_errors
+            )
+        lookups = memory_hits + redis_hits + misses
+        return {
+            "entries": entries,
+            "memory_hits": memory_hits,
+            "redis_hits": redis_hits,
+            "misses": misses,
+            "redis_errors": redis_errors,
+            "hit_rate": (memory_hits + redis_hits) / lookups if lookups else 0.0,
+        }
@@ -1,6 +1,10 @@
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import hashlib
+import threading
+from collections import OrderedDict
 import torch
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from src.instrumentation import count, observe, span, traced
 
 class CrossEncoderReranker:
     """
@@ -10,13 +14,26 @@ class CrossEncoderReranker:
     This is typically used in RAG (Retrieval-Augmented Generation) pipelines to
     rerank retrieved passages before passing the top-k to a generator model.
 
+    Pairs are sorted by token length and scored in bounded micro-batches, so
+    short candidates are never padded to the longest article, and scores are
+    kept in an LRU cache keyed by (query hash, doc id).
+
+    On CPU the model can run as fp32 PyTorch ("torch"), with int8 dynamic
+    quantization of its Linear layers ("int8") or as an exported ONNX Runtime
+    graph ("onnx", requires `optimum[onnxruntime]`).
+
     Attributes:
         model_name (str): Name of the HuggingFace model to use.
         top_k (int): Number of top-scoring candidates to return.
         device (str): Computation device, automatically set to 'cuda' if available.
+        batch_size (int): Maximum number of pairs per forward pass.
+        max_length (int): Token budget of a query-candidate pair.
+        backend (str): Inference backend, one of "torch", "int8" or "onnx".
     """
 
-    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", top_k: int = 5, device: str = None):
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", top_k: int = 5, device: str = None,
+                 batch_size: int = 16, max_length: int = 256, cache_size: int = 4096,
+                 backend: str = "torch", num_threads: int = None):
         """
         Initializes the CrossEncoderReranker with a specified model and top_k.
 
@@ -24,19 +41,153 @@ class CrossEncoderReranker:
             model_name (str): HuggingFace model identifier.
             top_k (int): Number of top results to return after reranking.
             device (str): Manually specified device ('cuda' or 'cpu'). Auto-detected if None.
+            batch_size (int): Maximum number of pairs per forward pass.
+            max_length (int): Token budget of a query-candidate pair, longer candidates are truncated.
+            cache_size (int): Number of (query, doc) scores kept in the LRU cache, 0 disables it.
+            backend (str): "torch" (fp32), "int8" (dynamic quantization, CPU) or "onnx" (ONNX Runtime, CPU).
+            num_threads (int): Intra-op CPU threads of the backend. Library default if None.
         """
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model_name = model_name
+        self.backend = backend
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(self.device)
+        self.model = self._load_model(model_name, backend, num_threads)
         self.top_k = top_k
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _load_model(self, model_name, backend, num_threads):
+        if backend == "torch":
+            return AutoModelForSequenceClassification.from_pretrained(model_name).to(self.device)
+
+        # Quantized and ONNX backends are CPU only
+        self.device = "cpu"
+        if backend == "int8":
+            model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        if backend == "onnx":
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+            except ImportError as e:
+                raise ImportError("The onnx backend requires `pip install optimum[onnxruntime]`") from e
+            session_options = onnxruntime.SessionOptions()
+            if num_threads:
+                session_options.intra_op_num_threads = num_threads
+            return ORTModelForSequenceClassification.from_pretrained(
+                model_name, export=True, session_options=session_options
+            )
+        raise ValueError(f"Unknown reranker backend: {backend}")
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        # Case and whitespace differences map to the same cached scores
+        return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _text_key(text: str) -> str:
+        return "text:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forward(self, queries: List[str], candidates: List[str]) -> List[float]:
+        # Tokenize once without padding to learn every pair's length
+        encoded = self.tokenizer(queries, candidates, truncation=True, max_length=self.max_length)
+        order = sorted(range(len(candidates)), key=lambda i: len(encoded["input_ids"][i]))
 
-    def rerank(self, query: str, candidates: List[str]) -> List[Tuple[str, float]]:
+        scores = [0.0] * len(candidates)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            # Pad each micro-batch only to its own longest pair
+            inputs = self.tokenizer.pad(
+                [{key: encoded[key][i] for key in encoded.keys()} for i in batch],
+                return_tensors="pt"
+            ).to(self.device)
+
+            # Disable gradient tracking for inference
+            with torch.no_grad():
+                # Compute relevance scores (logits)
+                logits = self.model(**inputs).logits.squeeze(-1)
+
+            for i, score in zip(batch, logits.cpu().tolist()):
+                scores[i] = score
+        return scores
+
+    def score(self, query: str, candidates: List[str], ids: Optional[List[str]] = None) -> List[float]:
+        """
+        Scores candidates against the query, using cached scores where possible.
+
+        Args:
+            query (str): The input query or question.
+            candidates (List[str]): Texts to score.
+            ids (List[str]): Stable ids of the candidates (e.g. ES _id), text hashes if None.
+
+        Returns:
+            List[float]: One relevance score per candidate, in input order.
+        """
+        return self.score_many([(query, candidates, ids)])[0]
+
+    def score_many(self, requests: List[Tuple[str, List[str], Optional[List[str]]]]) -> List[List[float]]:
+        """
+        Scores the candidates of several queries, all uncached pairs in one set of micro-batches.
+
+        Args:
+            requests (List[Tuple[str, List[str], Optional[List[str]]]]): (query, candidates, ids) triples.
+
+        Returns:
+            List[List[float]]: The scores of every request, in input order.
+        """
+        all_scores, missing = [], []
+        for n, (query, candidates, ids) in enumerate(requests):
+            query_key = self._query_key(query)
+            keys = [(query_key, str(_id)) for _id in ids] if ids else [(query_key, self._text_key(c)) for c in candidates]
+            scores = [self._cache_get(key) for key in keys]
+            missing.extend((n, i, keys[i]) for i, score in enumerate(scores) if score is None)
+            all_scores.append(scores)
+
+        pairs = sum(len(scores) for scores in all_scores)
+        count("rerank_cache_hits", pairs - len(missing))
+        count("rerank_cache_misses", len(missing))
+        if missing:
+            observe("rerank_batch_size", len(missing))
+            with span("rerank_forward", pairs=len(missing), backend=self.backend):
+                computed = self._forward(
+                    [requests[n][0] for n, _, _ in missing], [requests[n][1][i] for n, i, _ in missing]
+                )
+            for (n, i, key), score in zip(missing, computed):
+                all_scores[n][i] = score
+                self._cache_put(key, score)
+        return all_scores
+
+    @traced("rerank")
+    def rerank(self, query: str, candidates: List[str], ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
         """
         Scores and reranks the candidate texts based on their relevance to the query.
 
         Args:
             query (str): The input query or question.
             candidates (List[str]): List of retrieved documents/passages to rerank.
+            ids (List[str]): Optional stable ids of the candidates, used as score cache keys.
 
         Returns:
             List[Tuple[str, float]]: A list of top-k (text, score) pairs, sorted by relevance.
@@ -44,22 +195,8 @@ class CrossEncoderReranker:
         if not candidates:
             return []
 
-        # Tokenize the query-candidate pairs as input for the cross-encoder
-        inputs = self.tokenizer(
-            [query] * len(candidates),  # Duplicate query for pairwise scoring
-            candidates,
-            padding=True,
-            truncation=True,
-            return_tensors="pt"
-        ).to(self.device)
-
-        # Disable gradient tracking for inference
-        with torch.no_grad():
-            # Compute relevance scores (logits)
-            scores = self.model(**inputs).logits.squeeze(-1)
-
         # Pair each candidate with its score and sort descending
-        results = list(zip(candidates, scores.cpu().tolist()))
+        results = list(zip(candidates, self.score(query, candidates, ids)))
         results.sort(key=lambda x: x[1], reverse=True)
 
         # Return top-k results
@@ -78,30 +215,43 @@ class CrossEncoderReranker:
         Returns:
             List[dict]: Top-k hits in their original format with an added "rerank_score" field.
         """
-        if not retrievals:
-            return []
+        return self.rerank_many_with_metadata([(prompt, retrievals)], top_k)[0]
 
-        # Map candidate texts to raw hits
-        text_to_hit = {}
-        texts = []
+    @traced("rerank")
+    def rerank_many_with_metadata(self, requests: list, top_k: int = 5):
+        """
+        Batched `rerank_with_metadata`: the hits of several prompts are scored together.
 
-        for hit in retrievals:
-            src = hit["_source"]
-            text = src.get("text", "")
-            # Only include hits that have text
-            if text:
-                texts.append(text)
-                text_to_hit[text] = hit
+        Args:
+            requests (list): (prompt, retrievals) pairs.
+            top_k (int): Number of top results to return per prompt.
+
+        Returns:
+            List[List[dict]]: Top-k hits of every request, in input order.
+        """
+        # Keep the hits that have text
+        kept = []
+        for prompt, retrievals in requests:
+            # Passage documents are scored on their passage, articles on their text
+            hits = [hit for hit in retrievals if hit["_source"].get("passage") or hit["_source"].get("text", "")]
+            kept.append(hits)
 
-        # Rerank the texts
-        reranked = self.rerank(prompt, texts)[:top_k]
+        # Score the texts and keep the top-k hits
+        all_scores = self.score_many([
+            (prompt, [hit["_source"].get("passage") or hit["_source"]["text"] for hit in hits], [hit["_id"] for hit in hits])
+            for (prompt, _), hits in zip(requests, kept)
+        ])
 
-        # Map back to original hits and attach reranker scores
-        reranked_hits = []
-        for text, score in reranked:
-            hit = text_to_hit[text].copy()  # Copy so we can safely add score
-            hit["rerank_score"] = score
-            reranked_hits.append(hit)
+        results = []
+        for hits, scores in zip(kept, all_scores):
+            ranked = sorted(zip(hits, scores), key=lambda x: x[1], reverse=True)[:min(top_k, self.top_k)]
 
-        return reranked_hits
+            # Attach reranker scores to copies of the original hits
+            reranked_hits = []
+            for hit, score in ranked:
+                hit = hit.copy()  # Copy so we can safely add score
+                hit["rerank_score"] = score
+                reranked_hits.append(hit)
+            results.append(reranked_hits)
 
+        return results
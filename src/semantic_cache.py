@@ -0,0 +1,280 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import numpy as np
+from scripts.date_extractor import extract_date_parts
+from src.instrumentation import count, span
+from src.query_cache import REDIS_ERRORS
+from src.text import turkish_lower
+
+# Named entities: capitalised words not starting a sentence, or taking a suffix after an apostrophe ("Ankara'da")
+_ENTITY_PATTERN = re.compile(r"(?<=[^.!?\s])\s+([A-ZÇĞİÖŞÜ][^\s'’.,;:!?\"()]*)|\b([A-ZÇĞİÖŞÜ]\w*)['’]")
+
+# Keys fetched per Redis MGET when a version is loaded
+_MGET_BATCH = 500
+
+
+def index_version(es, index):
+    """
+    Identifies the current contents of an index.
+
+    The version changes when the index is recreated (new uuid) or when its
+    document count changes, which is what invalidates cached answers.
+
+    Returns:
+        str: "<index uuid>:<document count>".
+    """
+    (settings,) = es.indices.get_settings(index=index).values()
+    return f"{settings['settings']['index']['uuid']}:{es.count(index=index)['count']}"
+
+
+def prompt_anchors(prompt):
+    """
+    The parts of a question that its embedding barely reflects: "asgari ücret
+    2023" and "asgari ücret 2024" embed almost identically but need different
+    answers. Two questions can share an answer only if their anchors are equal.
+
+    Returns:
+        List: [month, year, numbers, named entities], lists sorted.
+    """
+    ay, yil = extract_date_parts(prompt or "")
+    numbers = sorted(set(re.findall(r"\d+", prompt or "")))
+    entities = sorted({turkish_lower(inner or suffixed) for inner, suffixed in _ENTITY_PATTERN.findall(prompt or "")})
+    return [ay and ay.lower(), yil, numbers, entities]
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class SemanticAnswerCache:
+    """
+    SemanticAnswerCache returns stored answers for questions that are close
+    enough to an earlier one, before any retrieval runs.
+
+    Entries are keyed on the normalised prompt embedding. A lookup compares the
+    query embedding with every live entry of the current index version in one
+    matrix product and returns the best entry above `threshold` whose prompt
+    has the same date, numbers and named entities (see `prompt_anchors`),
+    since the embedding barely separates "... 2023" from "... 2024". Entries store
+    the answer and the ids of the documents it was generated from, and belong
+    to the index version they were generated against, so a rebuilt or
+    re-populated index never serves stale answers.
+
+    With a Redis client the entries are also written to Redis (with the same
+    TTL), so they survive restarts and are shared by every app process. The
+    keys of a version are kept in a Redis set, so loading a version never
+    scans the keyspace. Redis is optional: when it fails, lookups use the
+    in-process entries, stores stay in-process, and the error is counted.
+
+    Attributes:
+        threshold (float): Minimum cosine similarity of a hit.
+        ttl (int): Entry lifetime in seconds.
+        max_entries (int): In-memory entries kept per version, oldest evicted first.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that fell through.
+        redis_errors (int): Number of Redis calls that failed.
+    """
+
+    def __init__(self, redis_client=None, threshold: float = 0.92, ttl: int = 600, max_entries: int = 10000,
+                 namespace: str = "rag_semantic", version_ttl: float = 30.0):
+        """
+        Args:
+            redis_client (redis.Redis): Optional shared store of the entries.
+            threshold (float): Minimum cosine similarity of a hit.
+            ttl (int): Entry lifetime in seconds.
+            max_entries (int): In-memory entries kept, oldest evicted first.
+            namespace (str): Redis key prefix.
+            version_ttl (float): Seconds an index version is trusted before it is fetched again.
+        """
+        self.redis = redis_client
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+        self._version = None
+        self._versions = {}
+        self._entries = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def current_version(self, es, index):
+        # Fetching the version costs two requests, it is refreshed every version_ttl seconds
+        with self._lock:
+            cached = self._versions.get(index)
+        if cached and time.monotonic() - cached[0] < self.version_ttl:
+            return cached[1]
+        version = f"{index}:{index_version(es, index)}"
+        with self._lock:
+            self._versions[index] = (time.monotonic(), version)
+        return version
+
+    def _key(self, version, prompt):
+        return f"{self.namespace}:{version}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+    def _members_key(self, version):
+        # Set of the entry keys of a version
+        return f"{self.namespace}:members:{version}"
+
+    def _redis_error(self, operation):
+        with self._lock:
+            self.redis_errors += 1
+        count("answer_cache_redis_error", operation=operation)
+
+    def _switch(self, version):
+        """
+        Moves to another index version, dropping the entries of the previous one.
+        Called with the lock held; returns True if the caller has to `_load` the
+        version's entries from Redis (after releasing the lock).
+        """
+        if version == self._version:
+            return False
+        self._version = version
+        self._entries = []
+        self._matrix = None
+        return self.redis is not None
+
+    def _load(self, version):
+        # Redis round-trips run without the lock, lookups meanwhile see the entries stored so far
+        loaded, expired = [], []
+        try:
+            keys = sorted(self.redis.smembers(self._members_key(version)))
+            for start in range(0, len(keys), _MGET_BATCH):
+                batch = keys[start:start + _MGET_BATCH]
+                for key, raw in zip(batch, self.redis.mget(batch)):
+                    if raw:
+                        loaded.append(self._entry(json.loads(raw)))
+                    else:
+                        expired.append(key)
+            if expired:
+                self.redis.srem(self._members_key(version), *expired)
+        except REDIS_ERRORS:
+            # Served from the entries loaded so far and those stored by this process
+            self._redis_error("load")
+        loaded.sort(key=lambda entry: entry["created"])
+        with self._lock:
+            if version != self._version:
+                return
+            stored = {entry["prompt"] for entry in self._entries}
+            self._entries = [entry for entry in loaded if entry["prompt"] not in stored] + self._entries
+            self._entries = self._entries[-self.max_entries:]
+            self._matrix = None
+
+    @staticmethod
+    def _entry(entry):
+        vector = np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float16).astype(np.float32)
+        # Entries written before anchors were stored get them from their prompt
+        return {**entry, "anchors": entry.get("anchors") or prompt_anchors(entry["prompt"]), "vector": vector}
+
+    def _append(self, entry):
+        self._entries.append(self._entry(entry))
+        if len(self._entries) > self.max_entries:
+            self._entries = self._entries[-self.max_entries:]
+        self._matrix = None
+
+    def lookup(self, embedding, version, prompt):
+        """
+        Finds a stored answer for a near-duplicate question.
+
+        Args:
+            embedding (array-like): Prompt embedding.
+            version (str): Current index version, see `current_version`.
+            prompt (str): The question, whose anchors must match the entry's.
+
+        Returns:
+            dict: {"prompt", "answer", "doc_ids", "similarity"} of the best hit, None on a miss.
+        """
+        with span("answer_cache_lookup"):
+            hit = self._lookup(_normalize(embedding), version, prompt_anchors(prompt))
+        count("answer_cache", result="hit" if hit else "miss")
+        return hit
+
+    def _lookup(self, query, version, anchors):
+        now = time.time()
+        with self._lock:
+            switched = self._switch(version)
+        if switched:
+            self._load(version)
+        with self._lock:
+            live = [entry for entry in self._entries if now - entry["created"] < self.ttl]
+            if len(live) != len(self._entries):
+                self._entries, self._matrix = live, None
+            if self._entries and self._matrix is None:
+                self._matrix = np.stack([entry["vector"] for entry in self._entries])
+            if not self._entries or self._matrix.shape[1] != len(query):
+                self.misses += 1
+                return None
+
+            similarities = self._matrix @ query
+            # Most similar first, among the entries asking about the same date and entities
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            best = next(
+                (int(i) for i in candidates[np.argsort(-similarities[candidates])]
+                 if self._entries[i]["anchors"] == anchors),
+                None
+            )
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = self._entries[best]
+        return {
+            "prompt": entry["prompt"],
+            "answer": entry["answer"],
+            "doc_ids": entry["doc_ids"],
+            "similarity": float(similarities[best]),
+        }
+
+    def store(self, prompt, embedding, answer, doc_ids, version):
+        """
+        Stores the answer generated for a prompt and the documents it used.
+
+        Args:
+            prompt (str): The question.
+            embedding (array-like): Prompt embedding.
+            answer (str): The generated answer.
+            doc_ids (List[str]): Ids of the context documents, in context order.
+            version (str): Index version the documents were retrieved from.
+        """
+        entry = {
+            "prompt": prompt,
+            "answer": answer,
+            "doc_ids": [str(_id) for _id in doc_ids],
+            "created": time.time(),
+            "anchors": prompt_anchors(prompt),
+            "embedding": base64.b64encode(_normalize(embedding).astype(np.float16).tobytes()).decode("ascii"),
+        }
+        with self._lock:
+            switched = self._switch(version)
+        if switched:
+            self._load(version)
+        with self._lock:
+            if version == self._version:
+                self._append(entry)
+        if self.redis is not None:
+            key = self._key(version, prompt)
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.set(key, json.dumps(entry, ensure_ascii=False), ex=self.ttl)
+                pipe.sadd(self._members_key(version), key)
+                # Refreshed on every store, so the set lives as long as its newest entry;
+                # members whose entry expired are pruned on load
+                pipe.expire(self._members_key(version), self.ttl)
+                pipe.execute()
+            except REDIS_ERRORS:
+                self._redis_error("store")
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._entries = []
+            self._matrix = None
+            self._versions.clear()
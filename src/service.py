@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import os
+from aiohttp import web
+from src.cascade import RerankCascade
+from src.embedding_cache import model_identifier
+from src.instrumentation import PrometheusExporter, configure_from_env, get_exporter, observe, span
+from src.query import hydrate_hits, query_similar
+from src.query_cache import QueryEmbeddingCache
+
+# Default address of the query service, also read by the Streamlit client
+DEFAULT_SERVICE_URL = "http://localhost:8080"
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class MicroBatcher:
+    """
+    MicroBatcher collects concurrent requests for a few milliseconds and runs
+    them through a batch function in one call.
+
+    A batch is closed when it reaches `max_batch_size` items or `max_wait_ms`
+    after its first item arrived. The batch function runs in a worker thread,
+    one batch at a time, and requests arriving meanwhile form the next batch.
+    Submissions beyond `max_queue` waiting items are rejected with
+    QueueFullError instead of growing the latency of everyone queued.
+
+    Attributes:
+        batches (int): Number of batches run.
+        items (int): Number of items processed.
+    """
+
+    def __init__(self, fn, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue: int = 256,
+                 name: str = "batch"):
+        """
+        Args:
+            fn (Callable[[list], list]): Maps a list of items to a list of results, in order.
+            max_batch_size (int): Maximum items per call of `fn`.
+            max_wait_ms (float): Maximum time the first item of a batch waits for company.
+            max_queue (int): Maximum number of waiting items.
+            name (str): Label of the batcher's metrics.
+        """
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._worker = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, item):
+        if self._queue is None:
+            # Created on first use so they belong to the running loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError(f"{self._queue.qsize()} requests already waiting")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            observe("micro_batch_size", len(batch), batcher=self.name)
+            observe("micro_batch_queue_depth", self._queue.qsize(), batcher=self.name)
+            try:
+                results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        if self._worker:
+            self._worker.cancel()
+
+
+class QueryService:
+    """
+    QueryService answers retrieval requests of many concurrent users.
+
+    Prompt embedding and cross-encoder reranking run through micro-batchers,
+    so concurrent requests share forward passes; the searches of each request
+    run in worker threads. Near-duplicate questions are answered from the
+    semantic answer cache before any retrieval, when one is configured.
+    Prompt embeddings are cached (in-process, and in Redis when the cache is
+    given a client), so repeated questions never reach the embedding model,
+    and requests for a prompt whose embedding is already being computed wait
+    for that one instead of queueing their own.
+
+    Attributes:
+        embed_batcher (MicroBatcher): Batches prompt embeddings.
+        rerank_batcher (MicroBatcher): Batches cross-encoder scoring.
+        embedding_cache (QueryEmbeddingCache): Embeddings of recent prompts.
+        coalesced_embeds (int): Embeddings served by another request's in-flight computation.
+    """
+
+    def __init__(self, model, es, reranker, cascade=None, answer_cache=None, index: str = "mlsum_tr_semantic",
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue: int = 256, embedding_cache=None):
+        self.model = model
+        self.es = es
+        self.reranker = reranker
+        self.cascade = cascade or RerankCascade()
+        self.answer_cache = answer_cache
+        self.index = index
+        self.embed_batcher = MicroBatcher(self._encode, max_batch_size, max_wait_ms, max_queue, name="embed")
+        self.rerank_batcher = MicroBatcher(self._rerank, max_batch_size, max_wait_ms, max_queue, name="rerank")
+        self.embedding_cache = embedding_cache or QueryEmbeddingCache(model_identifier(model))
+        self.coalesced_embeds = 0
+        self._embeds_in_flight = {}
+
+    def _encode(self, prompts):
+        return list(self.model.encode(prompts))
+
+    def _rerank(self, requests):
+        # Requests of one batch may ask for different top_k, score together and cut per request
+        top_k = max(top_k for _, _, top_k in requests)
+        ranked = self.reranker.rerank_many_with_metadata([(prompt, hits) for prompt, hits, _ in requests], top_k)
+        return [hits[:top_k] for hits, (_, _, top_k) in zip(ranked, requests)]
+
+    async def _cache_call(self, fn, *args):
+        # The Redis tier is network I/O, keep it off the event loop
+        if self.embedding_cache.redis is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def embed(self, prompt):
+        # Keyed like the cache, so "Asgari ücret?" joins an in-flight "asgari ücret"
+        key = self.embedding_cache.key(prompt)
+        task = self._embeds_in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._embed(prompt))
+            self._embeds_in_flight[key] = task
+            task.add_done_callback(lambda _: self._embeds_in_flight.pop(key, None))
+        else:
+            self.coalesced_embeds += 1
+        # Shielded, a caller that goes away does not cancel the embedding the others wait for
+        return await asyncio.shield(task)
+
+    async def _embed(self, prompt):
+        embedding = await self._cache_call(self.embedding_cache.get, prompt)
+        if embedding is None:
+            embedding = await self.embed_batcher.submit(prompt)
+            await self._cache_call(self.embedding_cache.put, prompt, embedding)
+        return embedding
+
+    async def query(self, prompt: str, k: int = 5, top_k: int = 5) -> dict:
+        """
+        Retrieves and reranks the context of a prompt.
+
+        Returns:
+            dict: {"hits": reranked hits, "cached": semantic cache hit or None, "index_version": str or None}.
+        """
+        # Worker threads inherit the task's context, so their spans nest under this one
+        with span("service_query"):
+            return await self._query(prompt, k, top_k)
+
+    async def _query(self, prompt, k, top_k):
+        with span("embed_wait"):
+            embedding = await self.embed(prompt)
+
+        version = None
+        if self.answer_cache is not None:
+            version = await asyncio.to_thread(self.answer_cache.current_version, self.es, self.index)
+            # A version switch loads its entries from Redis, kept off the event loop
+            cached = await asyncio.to_thread(self.answer_cache.lookup, embedding, version, prompt)
+            if cached:
+                hits = await asyncio.to_thread(
+                    hydrate_hits, self.es, self.index, [{"_id": _id} for _id in cached["doc_ids"]]
+                )
+                return {"hits": hits, "cached": cached, "index_version": version}
+
+        retrievals = await asyncio.to_thread(
+            query_similar, prompt, self.model, k=k, index=self.index, es=self.es, embedding=embedding
+        )
+
+        # Cascade decision per request, cross-encoding batched across requests
+        depth, path = self.cascade.decide(retrievals)
+        self.cascade.record(path)
+        if depth == 0:
+            hits = [hit.copy() for hit in retrievals[:top_k]]
+        else:
+            with span("rerank_wait", candidates=depth):
+                hits = await self.rerank_batcher.submit((prompt, retrievals[:depth], top_k))
+        for hit in hits:
+            hit["cascade_path"] = path
+        return {"hits": hits, "cached": None, "index_version": version}
+
+    async def store_answer(self, prompt: str, answer: str, doc_ids: list, index_version: str):
+        if self.answer_cache is None:
+            return
+        embedding = await self.embed(prompt)
+        await asyncio.to_thread(self.answer_cache.store, prompt, embedding, answer, doc_ids, index_version)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "queue_depth": batcher.depth,
+                "batches": batcher.batches,
+                "mean_batch_size": batcher.items / batcher.batches if batcher.batches else 0.0,
+            }
+            for name, batcher in (("embed", self.embed_batcher), ("rerank", self.rerank_batcher))
+        } | {
+            "cascade": dict(self.cascade.stats),
+            "embedding_cache": dict(self.embedding_cache.stats(), coalesced=self.coalesced_embeds),
+        }
+
+    def close(self):
+        self.embed_batcher.close()
+        self.rerank_batcher.close()
+
+
+def _json_safe(hits):
+    # Hits carry numpy floats after reranking
+    return [{key: float(value) if key.endswith("score") and value is not None else value for key, value in hit.items()} for hit in hits]
+
+
+def create_app(service: QueryService) -> web.Application:
+    """
+    HTTP interface of a QueryService:
+        POST /query  {"prompt", "k"?, "top_k"?} -> {"hits", "cached", "index_version"}
+        POST /answer {"prompt", "answer", "doc_ids", "index_version"} stores an answer in the semantic cache
+        GET  /stats  batcher, cascade and embedding cache statistics
+        GET  /metrics Prometheus text metrics (INSTRUMENTATION=prometheus)
+        GET  /health
+    A full queue answers 503 so clients can back off.
+    """
+    async def query(request):
+        body = await request.json()
+        if not str(body.get("prompt", "")).strip():
+            raise web.HTTPBadRequest(text="prompt is required")
+        try:
+            result = await service.query(body["prompt"], k=int(body.get("k", 5)), top_k=int(body.get("top_k", 5)))
+        except QueueFullError as e:
+            raise web.HTTPServiceUnavailable(text=str(e))
+        result["hits"] = _json_safe(result["hits"])
+        return web.json_response(result)
+
+    async def answer(request):
+        body = await request.json()
+        await service.store_answer(body["prompt"], body["answer"], body["doc_ids"], body.get("index_version"))
+        return web.json_response({"stored": service.answer_cache is not None})
+
+    async def stats(request):
+        return web.json_response(service.stats())
+
+    async def metrics(request):
+        exporter = get_exporter()
+        if not isinstance(exporter, PrometheusExporter):
+            raise web.HTTPNotFound(text="Prometheus instrumentation is not enabled")
+        return web.Response(text=exporter.render(), content_type="text/plain")
+
+    async def health(request):
+        return web.json_response({"status": "ok"})
+
+    async def on_cleanup(app):
+        service.close()
+
+    app = web.Application()
+    app.add_routes([
+        web.post("/query", query),
+        web.post("/answer", answer),
+        web.get("/stats", stats),
+        web.get("/metrics", metrics),
+        web.get("/health", health),
+    ])
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+# Usage: python -m src.service [--port 8080] [--max-batch-size 32] [--max-wait-ms 5]
+if __name__ == "__main__":
+    import redis
+    from src.query import get_client
+    from src.semantic_cache import SemanticAnswerCache
+    from src.startup import check_index, load_models
+
+    MODEL_NAME = "jinaai/jina-embeddings-v3"
+
+    parser = argparse.ArgumentParser(description="Micro-batching retrieval service")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--index", default="mlsum_tr_semantic")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-queue", type=int, default=256)
+    args = parser.parse_args()
+
+    configure_from_env()
+
+    # Serving never indexes: fail fast on a missing index, then load both models concurrently
+    es = get_client("localhost", 9200)
+    print(f"Index '{args.index}' holds {check_index(es, args.index)} documents")
+    model, reranker = load_models(MODEL_NAME)
+    redis_client = redis.Redis(host=os.environ.get("REDIS_HOST", "localhost"), port=6379, db=0)
+
+    # Both caches share the Redis client; query embeddings are shared by every service replica
+    service = QueryService(
+        model, es, reranker, answer_cache=SemanticAnswerCache(redis_client), index=args.index,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, max_queue=args.max_queue,
+        embedding_cache=QueryEmbeddingCache(MODEL_NAME, redis_client=redis_client)
+    )
+    web.run_app(create_app(service), port=args.port)
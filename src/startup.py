@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Short Turkish inputs that exercise tokenizers and kernels before the first real request
+WARMUP_PROMPT = "Asgari ücret zammı hakkında ne açıklandı?"
+WARMUP_PASSAGE = "Çalışma Bakanlığı yeni asgari ücreti açıkladı ve zammın ocak ayından itibaren geçerli olacağını duyurdu."
+
+
+class IndexNotReadyError(RuntimeError):
+    pass
+
+
+def check_index(es, index_name="mlsum_tr_semantic", timeout="5s"):
+    """
+    Cheap serving-path replacement of `index_data`: verifies the cluster is
+    reachable and the index exists and holds documents, without importing
+    `datasets` or touching the embedding model.
+
+    Args:
+        es: Search client (Elasticsearch or the local engine).
+        index_name (str): Index the service will query.
+        timeout (str): How long Elasticsearch may wait for a yellow cluster.
+
+    Returns:
+        int: Number of documents in the index.
+
+    Raises:
+        IndexNotReadyError: The index is missing or empty.
+    """
+    if hasattr(es, "cluster"):
+        es.cluster.health(index=index_name, wait_for_status="yellow", timeout=timeout)
+    if not es.indices.exists(index=index_name):
+        raise IndexNotReadyError(
+            f"Index '{index_name}' does not exist, build it first (python -m src.driver or scripts/index_full_corpus.py)"
+        )
+    count = es.count(index=index_name)["count"]
+    if not count:
+        raise IndexNotReadyError(f"Index '{index_name}' is empty")
+    return count
+
+
+def load_embedding_model(model_name, **model_kwargs):
+    # Imported here so paths that never embed do not pay for torch
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, **model_kwargs)
+
+
+def load_reranker(**reranker_kwargs):
+    from src.reranker import CrossEncoderReranker
+    return CrossEncoderReranker(**reranker_kwargs)
+
+
+def warmup(model=None, reranker=None):
+    # First calls allocate buffers and pick kernels, pay that before traffic arrives
+    if model is not None:
+        model.encode([WARMUP_PROMPT])
+    if reranker is not None:
+        reranker.score(WARMUP_PROMPT, [WARMUP_PASSAGE])
+
+
+def load_models(model_name="jinaai/jina-embeddings-v3", model_kwargs=None, reranker_kwargs=None,
+                run_warmup=True, verbose=True):
+    """
+    Loads the embedding model and the cross-encoder concurrently, then warms them up.
+
+    Most of the loading time is file I/O and weight initialisation, which
+    release the GIL, so two threads overlap well.
+
+    Args:
+        model_name (str): SentenceTransformer model identifier.
+        model_kwargs (dict): Extra SentenceTransformer arguments, defaults to trust_remote_code=True.
+        reranker_kwargs (dict): CrossEncoderReranker arguments.
+        run_warmup (bool): Run one encode and one rerank before returning.
+        verbose (bool): Print the timings.
+
+    Returns:
+        Tuple[SentenceTransformer, CrossEncoderReranker]: The loaded models.
+    """
+    start = time.perf_counter()
+    model_kwargs = {"trust_remote_code": True} if model_kwargs is None else model_kwargs
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-load") as pool:
+        model_future = pool.submit(load_embedding_model, model_name, **model_kwargs)
+        reranker_future = pool.submit(load_reranker, **(reranker_kwargs or {}))
+        model, reranker = model_future.result(), reranker_future.result()
+    loaded = time.perf_counter()
+
+    if run_warmup:
+        warmup(model, reranker)
+    if verbose:
+        print(f"Models loaded in {loaded - start:.1f}s, warmed up in {time.perf_counter() - loaded:.1f}s")
+    return model, reranker
@@ -0,0 +1,13 @@
+import re
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def turkish_lower(text):
+    # str.lower maps "I" to "i" and "İ" to "i̇", Turkish maps them to "ı" and "i"
+    return text.replace("I", "ı").replace("İ", "i").lower()
+
+
+def analyze(text):
+    # Lowercased word tokens, the analysis shared by the local engine, the caches and the context builder
+    return _TOKEN_PATTERN.findall(turkish_lower(text or ""))
@@ -1,12 +1,10 @@
-import streamlit as st
+import os
 import requests
-from sentence_transformers import SentenceTransformer
-from src.indexing import index_data
-from src.query import query_similar
-from src.reranker import CrossEncoderReranker
-from scripts.redis_key_generator import make_cache_key
-from elasticsearch import Elasticsearch
-import redis
+import streamlit as st
+from src.context_builder import ContextBuilder
+from src.instrumentation import configure_from_env, observe, span
+from src.llm_client import LLMClient, DEFAULT_LLM_URL
+from src.service import DEFAULT_SERVICE_URL
 
 
 
@@ -19,29 +17,25 @@ st.caption("Elasticsearch + SentenceTransformer + CrossEncoderReranker + Hugging
 # Global setup (first time only)
 @st.cache_resource(show_spinner=True)
 def initialize_rag_pipeline():
-    st.write("🔄 Elasticsearch'e bağlanılıyor ve modeller yükleniyor...")
-
-    # Elasticsearch connection (Docker's 9200 port)
-    es = Elasticsearch("http://localhost:9200")
-
-    # Embedding model
-    model_name = "jinaai/jina-embeddings-v3"
-    model = SentenceTransformer(model_name, trust_remote_code=True)
+    # INSTRUMENTATION=prometheus|json exports spans and metrics, no-op by default
+    configure_from_env()
 
-    # Index data preparation (if needed)
-    index_data(model)  # if already exists, don't recreate
+    # Retrieval, reranking and the semantic answer cache run in the query service (python -m src.service),
+    # which batches the models across all sessions; the UI only holds pooled HTTP clients
+    service = requests.Session()
+    service_url = os.environ.get("RAG_SERVICE_URL", DEFAULT_SERVICE_URL)
 
-    # Reranker
-    reranker = CrossEncoderReranker()
+    # Pooled, streaming LLM client shared by all sessions (LLM_URL may point at scripts/llm_stub_server.py)
+    llm = LLMClient(os.environ.get("LLM_URL", DEFAULT_LLM_URL))
 
-    # Redis connection
-    redis_client = redis.Redis(host="localhost", port=6379, db=0)
+    # Deduplicated, sentence-selected context packed into LLM_MAX_PROMPT_TOKENS, with the template parsed once
+    context_builder = ContextBuilder(max_tokens=int(os.environ.get("LLM_MAX_PROMPT_TOKENS", "1500")))
 
-    return model, es, reranker, redis_client
+    return service, service_url, llm, context_builder
 
 
 # setup only once (cache_resource)
-model, es, reranker, redis_client = initialize_rag_pipeline()
+service, service_url, llm, context_builder = initialize_rag_pipeline()
 
 # UI input field
 prompt = st.text_area("Sorunuzu yazın:", height=100)
@@ -51,77 +45,54 @@ if st.button("Cevabı Al"):
         st.warning("Lütfen bir soru girin.")
     else:
         with st.spinner("Veriler getiriliyor ve LLM çalıştırılıyor..."):
-            # Retrieval + Reranker
-            retrievals = query_similar(prompt, model, es=es, k=5)
-            reranked_retrievals = reranker.rerank_with_metadata(prompt, retrievals)
-
-            # Context creation
-            rag_context = ""
-            for idx, r in enumerate(reranked_retrievals, 1):
-                src = r.get("_source", {})
-                summary = src.get("summary", "")
-                text = src.get("text", "")
-
-                rag_context += f"{idx}. Özet: {summary}\n   Metin: {text[:500]}...\n"
-
-            # Cache checking
-            cache_key = make_cache_key(prompt, rag_context)
-            cached = redis_client.get(cache_key)
+            # Retrieval + Reranker, near-duplicate questions come back with their cached answer
+            with span("service_request"):
+                res = service.post(f"{service_url}/query", json={"prompt": prompt, "k": 5}, timeout=30)
+            res.raise_for_status()
+            result = res.json()
+            reranked_retrievals = result["hits"]
+            cached = result["cached"]
 
             if cached:
-                answer = cached.decode()
-                st.success("⚡ Cevap (Redis Cache)")
+                answer = cached["answer"]
+                st.success(f"⚡ Cevap (Semantik Cache, benzerlik {cached['similarity']:.2f})")
+                st.subheader("📄 Cevap:")
+                st.write(answer)
 
             else:
-                # LLM endpoint call
-                llm_url = "https://ilbeygulmez-mlsum-rag-llm.hf.space/ask"
-
-                system_prompt = f"""
-                    Sen tarafsız bir haber asistanısın. 
-                    Görevin, verilen bağlamı inceleyerek soruya yalnızca bu bilgilere dayanarak yanıt vermektir. 
-                    Yanıtını Türkçe ve kısa, açık cümlelerle ver. Bağlamdaki bilgileri kullan, fakat bağlamın kendisine atıfta bulunma.
-
-                    Örnek:
-                    Soru: Türkiye’nin 2020 yılında ekonomik büyüme oranı neydi?
-                    Bağlam:
-                    1. Özet: Türkiye ekonomisi 2020 yılında pandemi etkisiyle daralma yaşasa da yılın son çeyreğinde toparlanma görüldü. Yıllık bazda %1,8 büyüme kaydedildi.
-                    2. Metin: TÜİK verilerine göre, 2020 yılı büyüme oranı %1,8 olarak açıklandı.
-                    Cevap: Türkiye ekonomisi 2020 yılında %1,8 oranında büyümüştür.
-
-                    Şimdi senin sıran:
-
-                    Soru: {prompt}
-
-                    Bağlamlar:
-                    {rag_context}
-
-                    Cevap:
-                    """
-
+                # Context creation
+                with span("context_build"):
+                    built = context_builder.build(prompt, reranked_retrievals)
+                observe("context_bytes", len(built["context"].encode("utf-8")))
+                observe("prompt_tokens", built["tokens"])
+
+                # LLM endpoint call, tokens are shown as they arrive
+                st.subheader("📄 Cevap:")
                 try:
-                    print("Prompt sent to LLM: ", system_prompt)
-                    res = requests.post(llm_url, json={"prompt": system_prompt}, timeout=30)
-                    res.raise_for_status()
-                    answer = res.json().get("answer")
+                    print("Prompt sent to LLM: ", built["prompt"])
+                    # Identical contexts for the same question share one generation
+                    answer = st.write_stream(llm.stream(built["prompt"], key=built["cache_key"]))
 
                     if answer:
-                        # Cache the valid answer (30 minutes TTL)
-                        redis_client.set(cache_key, answer, ex=600)
+                        # Cache the valid answer with the documents it is based on (10 minutes TTL)
+                        service.post(f"{service_url}/answer", json={
+                            "prompt": prompt,
+                            "answer": answer,
+                            "doc_ids": built["doc_ids"],
+                            "index_version": result["index_version"],
+                        }, timeout=10)
                     else:
-                        answer = "❌ Cevap alınamadı."
+                        st.write("❌ Cevap alınamadı.")
 
                 except Exception as e:
-                    answer = f"❌ Hata oluştu: {e}"
+                    st.write(f"❌ Hata oluştu: {e}")
 
             # Result display
-            st.subheader("📄 Cevap:")
-            st.write(answer)
-
             with st.expander("📚 Kullanılan Bağlamlar"):
                 for idx, r in enumerate(reranked_retrievals, 1):
                     src = r.get("_source", {})
                     summary = src.get("summary", "")
-                    text = src.get("text", "")
+                    text = src.get("passage") or src.get("text", "")
                     title = src.get("title", "")
                     date = src.get("date", "")
 